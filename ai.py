@@ -0,0 +1,456 @@
+'''Batched decision making for the CPU players. Instead of looping over every
+player, blob and pellet for each bot in turn, the danger, reward and nearest
+food of every bot are computed together as array operations over the
+positions and radii of all the blobs and pellets in the world'''
+import math
+from collections import namedtuple
+import numpy
+from rules import EAT_RATIO
+
+# the number of ticks between two plans of the same CPU player
+REPLAN_INTERVAL = 5
+# the kinds of plan a CPU player can have
+NOTHING, FLEE, CHASE, FOOD = range(4)
+# the number of bot blobs scored against all other blobs at once, which bounds
+# the size of the temporary arrays
+CHUNK = 256
+
+
+class BlobArrays():
+    '''The blobs of a list of players flattened into arrays: the absolute
+    position and radius of each blob and the row of the player owning it.
+    Blobs of the same player are contiguous'''
+
+    def __init__(self, players):
+        self.players = players
+        self.blobs = []
+        owner = []
+        for i, p in enumerate(players):
+            self.blobs.extend(p.blobs)
+            owner.extend([i] * len(p.blobs))
+        n = len(self.blobs)
+        self.owner = numpy.array(owner, dtype=numpy.intp)
+        # where the blobs of each player start, and how many there are
+        self.count = numpy.array([len(p.blobs) for p in players],
+                                 dtype=numpy.intp)
+        self.first = numpy.cumsum(self.count) - self.count
+        self.r = numpy.fromiter((b.r for b in self.blobs), float, n)
+        # positions are absolute, i.e. the centers of the blobs
+        self.x = numpy.fromiter((b.x for b in self.blobs), float, n) + self.r
+        self.y = numpy.fromiter((b.y for b in self.blobs), float, n) + self.r
+        centers = [p.get_absolute_position() for p in players]
+        self.cx = numpy.array([c[0] for c in centers], dtype=float)
+        self.cy = numpy.array([c[1] for c in centers], dtype=float)
+
+
+# The blobs sorted into a coarse grid of square cells: the size of a cell, the
+# column and row of the first cell, the number of columns and rows, the
+# indices of the blobs in cell order (row by row) and where each cell starts
+BlobGrid = namedtuple('BlobGrid', ['size', 'col0', 'row0', 'cols', 'rows',
+                                   'order', 'starts'])
+# The alive pellets of a FoodStore sorted by the cell of its index they are
+# in, with the number in each cell and where each cell starts
+FoodCells = namedtuple('FoodCells', ['alive', 'counts', 'starts'])
+
+
+def sort_by_cell(cells, n_cells):
+    '''Returns the order that sorts items by their cell, and the number of
+    items in each of n_cells cells and where each cell starts in that
+    order'''
+    order = numpy.argsort(cells, kind='stable')
+    counts = numpy.bincount(cells, minlength=n_cells)
+    return order, counts, numpy.concatenate(([0], numpy.cumsum(counts)))
+
+
+def spans(first, counts):
+    '''Returns the indices of several runs of consecutive indices, each
+    given by its first index and length, one run after the other'''
+    ends = numpy.cumsum(counts)
+    return (numpy.arange(int(ends[-1]) if len(ends) else 0) +
+            numpy.repeat(first - (ends - counts), counts))
+
+
+def blob_grid(arrays, sight_factor):
+    '''Sorts the blobs of a BlobArrays into a grid whose cells are at least
+    as large as the sight range plus the largest radius, so a bot can only
+    see blobs in the 3x3 cells around its own'''
+    size = sight_factor + arrays.r.max()
+    col = (arrays.x // size).astype(numpy.intp)
+    row = (arrays.y // size).astype(numpy.intp)
+    col0, row0 = int(col.min()), int(row.min())
+    cols = int(col.max()) - col0 + 1
+    rows = int(row.max()) - row0 + 1
+    order, _, starts = sort_by_cell((row - row0) * cols + (col - col0),
+                                    cols * rows)
+    return BlobGrid(size, col0, row0, cols, rows, order, starts)
+
+
+def near_blobs(grid, col, row):
+    '''Returns the indices of the blobs in the 3x3 cells of a BlobGrid
+    around the given cell, in increasing order'''
+    c, r = col - grid.col0, row - grid.row0
+    c_lo, c_hi = max(c - 1, 0), min(c + 1, grid.cols - 1)
+    parts = []
+    for rr in range(max(r - 1, 0), min(r + 1, grid.rows - 1) + 1):
+        if c_lo <= c_hi:
+            # the cells of a row are next to each other in the order
+            parts.append(grid.order[grid.starts[rr * grid.cols + c_lo]:
+                                    grid.starts[rr * grid.cols + c_hi + 1]])
+    if not parts:
+        return numpy.zeros(0, dtype=numpy.intp)
+    return numpy.sort(numpy.concatenate(parts))
+
+
+def food_cells(food):
+    '''Sorts the alive pellets of a FoodStore by the cell of its index'''
+    index = food.index
+    alive = numpy.flatnonzero(food.alive)
+    order, counts, starts = sort_by_cell(food.cell[alive],
+                                         index.cols * index.rows)
+    return FoodCells(alive[order], counts, starts)
+
+
+def group_argbest(values, groups, n_groups):
+    '''Returns, for each group, the largest value and the first index holding
+    it (or -1 if the group has no entries)'''
+    best = numpy.zeros(n_groups)
+    numpy.maximum.at(best, groups, values)
+    rows = numpy.full(n_groups, -1, dtype=numpy.intp)
+    hit = numpy.flatnonzero((values == best[groups]) & (values > 0))[::-1]
+    rows[groups[hit]] = hit
+    return best, rows
+
+
+def pick(values, rows, missing):
+    '''Returns values[rows], with missing wherever the row is -1'''
+    picked = numpy.full(len(rows), missing, dtype=values.dtype)
+    found = rows >= 0
+    picked[found] = values[rows[found]]
+    return picked
+
+
+def danger_reward(arrays, bot_rows, sight_factor, eat_ratio=EAT_RATIO,
+                  grid=None):
+    '''Finds the most dangerous and most rewarding blob for each of the players
+    at the given rows of the BlobArrays. Danger and reward are a function of
+    the size difference between one of the bot's blobs and the other blob, and
+    of the distance from the bot to the other blob; only blobs that can eat
+    the bot's blob (or that it can eat) by the eat_ratio count. Returns the
+    danger values, the indices of the dangerous blobs (-1 for none), the
+    reward values and the indices of the rewarding blobs. The blob_grid of
+    the arrays is made if it is not given'''
+    n_bots = len(bot_rows)
+    counts = arrays.count[bot_rows]
+    mine = spans(arrays.first[bot_rows], counts)
+
+    row_danger = numpy.zeros(len(mine))
+    row_danger_blob = numpy.zeros(len(mine), dtype=numpy.intp)
+    row_reward = numpy.zeros(len(mine))
+    row_reward_blob = numpy.zeros(len(mine), dtype=numpy.intp)
+    if len(mine) == 0:
+        return (numpy.zeros(n_bots), numpy.full(n_bots, -1),
+                numpy.zeros(n_bots), numpy.full(n_bots, -1))
+    # bots are bucketed by the cell of the grid they are in, and each bucket
+    # is scored only against the blobs in the 3x3 cells around it
+    if grid is None:
+        grid = blob_grid(arrays, sight_factor)
+    size = grid.size
+    owner = arrays.owner[mine]
+    m_col = (arrays.cx[owner] // size).astype(numpy.intp)
+    m_row = (arrays.cy[owner] // size).astype(numpy.intp)
+    buckets = {}
+    for i, key in enumerate(zip(m_col.tolist(), m_row.tolist())):
+        buckets.setdefault(key, []).append(i)
+    for (col, row), bucket in buckets.items():
+        cand = near_blobs(grid, col, row)
+        if len(cand) == 0:
+            continue
+        o_x = arrays.x[cand][None, :]
+        o_y = arrays.y[cand][None, :]
+        o_r = arrays.r[cand][None, :]
+        o_owner = arrays.owner[cand][None, :]
+        bucket = numpy.array(bucket, dtype=numpy.intp)
+        for start in range(0, len(bucket), CHUNK):
+            local = bucket[start:start + CHUNK]
+            rows = mine[local]
+            owner = arrays.owner[rows][:, None]
+            my_r = arrays.r[rows][:, None]
+            dx = o_x - arrays.cx[owner]
+            dy = o_y - arrays.cy[owner]
+            in_sight = ((numpy.abs(dx) <= sight_factor + o_r) &
+                        (numpy.abs(dy) <= sight_factor + o_r) &
+                        (o_owner != owner))
+            value = numpy.maximum(2, my_r * (o_r - my_r) ** 2 /
+                                  numpy.maximum(0.1, numpy.hypot(dx, dy)))
+            danger = numpy.where(in_sight & (o_r > my_r / eat_ratio),
+                                 value, 0)
+            reward = numpy.where(in_sight & (o_r < eat_ratio * my_r),
+                                 value, 0)
+            picked = numpy.arange(len(local))
+            best = numpy.argmax(danger, axis=1)
+            row_danger[local] = danger[picked, best]
+            row_danger_blob[local] = cand[best]
+            best = numpy.argmax(reward, axis=1)
+            row_reward[local] = reward[picked, best]
+            row_reward_blob[local] = cand[best]
+
+    groups = numpy.repeat(numpy.arange(n_bots), counts)
+    d_value, d_row = group_argbest(row_danger, groups, n_bots)
+    r_value, r_row = group_argbest(row_reward, groups, n_bots)
+    return (d_value, pick(row_danger_blob, d_row, -1),
+            r_value, pick(row_reward_blob, r_row, -1))
+
+
+def best_food(food, x, y, sight_factor, cells=None):
+    '''Finds the closest pellet in the FoodStore to each of the given points.
+    Candidates are the pellets in the cell of each point and the eight cells
+    around it, which is exact whenever the closest one is within a cell size;
+    the rest fall back to a search of the spatial index. Returns the pellet
+    indices (-1 for none) and their values, which are higher for closer food.
+    The food_cells of the store are made if they are not given'''
+    index = food.index
+    n = len(x)
+    max_distance = sight_factor * math.sqrt(2)
+    if cells is None:
+        cells = food_cells(food)
+    alive, counts, starts = cells
+
+    col = numpy.clip((x // index.cell_size).astype(numpy.intp),
+                     0, index.cols - 1)
+    row = numpy.clip((y // index.cell_size).astype(numpy.intp),
+                     0, index.rows - 1)
+    offsets = numpy.array([-1, 0, 1])
+    ncol = (col[:, None, None] + offsets[None, None, :]).repeat(3, axis=1)
+    nrow = (row[:, None, None] + offsets[None, :, None]).repeat(3, axis=2)
+    valid = ((ncol >= 0) & (ncol < index.cols) &
+             (nrow >= 0) & (nrow < index.rows)).reshape(n, 9)
+    cell = (nrow * index.cols + ncol).reshape(n, 9)
+    cell = numpy.where(valid, cell, 0)
+    lo = starts[cell]
+    size = numpy.where(valid, counts[cell], 0).ravel()
+    # expand the (point, cell) ranges into one flat list of candidates
+    total = int(size.sum())
+    owner = numpy.repeat(numpy.arange(n).repeat(9), size)
+    first = numpy.repeat(numpy.cumsum(size) - size, size)
+    candidates = alive[numpy.repeat(lo.ravel(), size) +
+                       numpy.arange(total) - first]
+
+    d = numpy.hypot(food.x[candidates] - x[owner],
+                    food.y[candidates] - y[owner])
+    closest, rows = group_argbest(1 / numpy.maximum(d, 1e-9), owner, n)
+    food_index = pick(candidates, rows, -1)
+    distance = pick(d, rows, numpy.inf)
+    for i in numpy.flatnonzero(distance > index.cell_size):
+        found = index.nearest(x[i], y[i], 1, max_distance)
+        if found:
+            distance[i], food_index[i] = found[0]
+        else:
+            food_index[i] = -1
+    found = (food_index >= 0) & (distance < max_distance)
+    food_index = numpy.where(found, food_index, -1)
+    value = numpy.where(found, 1 / numpy.maximum(distance, 1), 0)
+    return food_index, value
+
+
+def danger_reward_rows(bot_rows, arrays, grid, sight_factor, eat_ratio):
+    '''danger_reward for the players at the given rows of the BlobArrays,
+    against the blob_grid made once for the whole tick. Returns a (danger,
+    dangerous blob, reward, rewarding blob) tuple per bot. Every bot is
+    scored on its own, so the rows can be split between threads'''
+    return list(zip(*[a.tolist() for a in danger_reward(
+        arrays, numpy.array(bot_rows, dtype=numpy.intp), sight_factor,
+        eat_ratio, grid)]))
+
+
+def best_food_rows(bot_rows, arrays, food, cells, sight_factor):
+    '''best_food for the players at the given rows of the BlobArrays, with
+    the food_cells made once for the whole tick. Returns a (pellet, value)
+    pair per bot. Every bot is looked at on its own, so the rows can be
+    split between threads'''
+    bot_rows = numpy.array(bot_rows, dtype=numpy.intp)
+    return list(zip(*[a.tolist() for a in best_food(
+        food, arrays.cx[bot_rows], arrays.cy[bot_rows], sight_factor,
+        cells)]))
+
+
+def plan_targets(world, bots, sight_factor):
+    '''Decides what each of the given CPU players should do. A bot runs from
+    its most dangerous neighbour, chases its most rewarding one, or goes for
+    the closest food, whichever has the highest score. Both are worked out
+    in chunks of bots on the world's executor. Returns an array with the kind
+    of plan of each bot (NOTHING, FLEE, CHASE or FOOD) and a list of the
+    targets - a Blob when fleeing or chasing, the slot of a pellet in the
+    FoodStore when going for food, or None'''
+    prof = world.profiler
+    t = prof.clock()
+    everyone = world.all_players() + world.ghosts
+    arrays = BlobArrays(everyone)
+    rows = {id(p): i for i, p in enumerate(everyone)}
+    bot_rows = [rows[id(p)] for p in bots]
+    dangers = world.map_chunks(danger_reward_rows, bot_rows, arrays,
+                               blob_grid(arrays, sight_factor), sight_factor,
+                               world.rules.eat_ratio)
+    d_value, d_blob, r_value, r_blob = numpy.array(dangers).reshape(-1, 4).T
+    prof.add('danger_reward', t)
+    t = prof.clock()
+    foods = world.map_chunks(best_food_rows, bot_rows, arrays, world.food,
+                             food_cells(world.food), sight_factor)
+    f_index, f_value = numpy.array(foods).reshape(-1, 2).T
+    prof.add('best_food', t)
+    prof.count('replans', len(bots))
+
+    best = numpy.maximum(numpy.maximum(d_value, r_value), f_value)
+    flee = (d_blob >= 0) & (d_value == best)
+    chase = ~flee & (r_blob >= 0) & (r_value == best)
+    eat = ~flee & ~chase & (f_index >= 0)
+    kinds = numpy.full(len(bots), NOTHING, dtype=numpy.int8)
+    kinds[flee] = FLEE
+    kinds[chase] = CHASE
+    kinds[eat] = FOOD
+    targets = [None] * len(bots)
+    for i in numpy.flatnonzero(flee).tolist():
+        targets[i] = arrays.blobs[int(d_blob[i])]
+    for i in numpy.flatnonzero(chase).tolist():
+        targets[i] = arrays.blobs[int(r_blob[i])]
+    for i in numpy.flatnonzero(eat).tolist():
+        targets[i] = int(f_index[i])
+    return kinds, targets
+
+
+def steer(world, bots, kinds, targets):
+    '''Computes the direction each of the given CPU players moves in to carry
+    out its plan, steering away from the edges of the world when fleeing.
+    Returns an array with one row per bot; the rows of bots with no plan are
+    NaN'''
+    n = len(bots)
+    centers = [p.get_absolute_position() for p in bots]
+    px = numpy.array([c[0] for c in centers], dtype=float).reshape(n)
+    py = numpy.array([c[1] for c in centers], dtype=float).reshape(n)
+    tx = numpy.full(n, numpy.nan)
+    ty = numpy.full(n, numpy.nan)
+    for i, (kind, target) in enumerate(zip(kinds.tolist(), targets)):
+        if kind == FOOD:
+            tx[i] = world.food.x[target]
+            ty[i] = world.food.y[target]
+        elif kind != NOTHING:
+            tx[i], ty[i] = target.get_absolute_position()
+    flee = kinds == FLEE
+    sign = numpy.where(flee, -1, 1)
+    vectors = numpy.empty((n, 2))
+    vectors[:, 0] = sign * (tx - px)
+    vectors[:, 1] = sign * (ty - py)
+
+    # if nearing edge, dont go into edge
+    margin = 2 * numpy.array([p.r for p in bots], dtype=float)
+    push_x = numpy.where(px <= margin, 1,
+                         numpy.where(px >= world.width - margin, -1, 0))
+    push_y = numpy.where(py <= margin, 1,
+                         numpy.where(py >= world.height - margin, -1, 0))
+    edge = flee & ((push_x != 0) | (push_y != 0))
+    norm = numpy.hypot(vectors[edge, 0], vectors[edge, 1])
+    norm = numpy.where(norm == 0, 1, norm)
+    vectors[edge, 0] = vectors[edge, 0] / norm + push_x[edge]
+    vectors[edge, 1] = vectors[edge, 1] / norm + push_y[edge]
+    return vectors
+
+
+def movement_vectors(world, bots, sight_factor):
+    '''Computes the direction each of the given CPU players wants to move in,
+    planning from scratch for every one of them'''
+    kinds, targets = plan_targets(world, bots, sight_factor)
+    return steer(world, bots, kinds, targets)
+
+
+def crowding(world, bots, size):
+    '''Counts the blobs in the 3x3 block of cells of the given size around
+    each bot. The count can only go up when a blob comes within that distance
+    of the bot, so it is a cheap way to tell that something may have entered
+    its sight'''
+    entries = list(world.blob_index.entries.values())
+    cols = int(math.ceil(world.width / size))
+    rows = int(math.ceil(world.height / size))
+    grid = numpy.zeros((rows + 2, cols + 2))
+    if entries:
+        x = numpy.fromiter((e[0] for e in entries), float, len(entries))
+        y = numpy.fromiter((e[1] for e in entries), float, len(entries))
+        row = numpy.clip(y // size, 0, rows - 1).astype(numpy.intp)
+        col = numpy.clip(x // size, 0, cols - 1).astype(numpy.intp)
+        numpy.add.at(grid, (row + 1, col + 1), 1)
+    box = sum(grid[r:r + rows, c:c + cols] for r in range(3) for c in range(3))
+    centers = [p.get_absolute_position() for p in bots]
+    bx = numpy.array([c[0] for c in centers], dtype=float).reshape(len(bots))
+    by = numpy.array([c[1] for c in centers], dtype=float).reshape(len(bots))
+    return box[numpy.clip(by // size, 0, rows - 1).astype(numpy.intp),
+               numpy.clip(bx // size, 0, cols - 1).astype(numpy.intp)]
+
+
+# A cached decision of a CPU player: the kind of plan, its target, the uid
+# the target blob had (blobs are recycled, so the same object may later be
+# someone else's), the position of the target pellet when the plan is to go
+# for food, how crowded the area around the bot was when the plan was made
+# and the tick it was made on
+Plan = namedtuple('Plan', ['kind', 'target', 'uid', 'food_position',
+                           'crowd', 'tick'])
+
+
+class Planner():
+    '''A Planner spreads the re-planning of the CPU players across ticks.
+    Each bot makes a new plan every interval ticks, at a tick that depends on
+    its id so the bots are staggered evenly, and in between steers towards
+    the target it picked last time. A bot that is not moved on every tick
+    (a CPU player out of sight, at a lower level of detail) can miss its
+    turn, so it re-plans the first time it moves once interval ticks have
+    passed since its last plan. A bot re-plans early if its target has been
+    eaten or something new may have come into its sight'''
+
+    def __init__(self, interval=REPLAN_INTERVAL):
+        self.interval = interval
+        self.plans = {}
+
+    def is_valid(self, world, plan):
+        '''Checks that the target of a plan still exists'''
+        if plan.kind == FOOD:
+            return (world.food.alive[plan.target] and
+                    (world.food.x[plan.target],
+                     world.food.y[plan.target]) == plan.food_position)
+        if plan.kind != NOTHING:
+            return (plan.target in world.blob_index and
+                    plan.target.uid == plan.uid)
+        return True
+
+    def movement_vectors(self, world, bots, sight_factor):
+        '''Computes the direction each of the given CPU players wants to move
+        in, re-planning only for the bots that are due'''
+        crowd = crowding(world, bots, sight_factor).tolist()
+        tick = world.clock.ticks
+        due = []
+        for i, bot in enumerate(bots):
+            plan = self.plans.get(bot)
+            if (plan is None or
+                    (tick + bot.id_number) % self.interval == 0 or
+                    tick - plan.tick >= self.interval or
+                    crowd[i] > plan.crowd or
+                    not self.is_valid(world, plan)):
+                due.append(i)
+        if due:
+            kinds, targets = plan_targets(world, [bots[i] for i in due],
+                                          sight_factor)
+            for i, kind, target in zip(due, kinds.tolist(), targets):
+                food_position = None
+                uid = None
+                if kind == FOOD:
+                    food_position = (world.food.x[target],
+                                     world.food.y[target])
+                elif kind != NOTHING:
+                    # the blobs of ghosts have no uid, and are never in the
+                    # blob index anyway
+                    uid = getattr(target, 'uid', None)
+                self.plans[bots[i]] = Plan(kind, target, uid, food_position,
+                                           crowd[i], tick)
+        # forget the plans of players that are no longer around
+        self.plans = {bot: plan for bot, plan in self.plans.items()
+                      if world.playerIds.get(bot.id_number) is bot}
+        kinds = numpy.array([self.plans[bot].kind for bot in bots],
+                            dtype=numpy.int8)
+        targets = [self.plans[bot].target for bot in bots]
+        return steer(world, bots, kinds, targets)
@@ -0,0 +1,207 @@
+'''Benchmarks the hot paths of the game on seeded worlds of several sizes.
+
+Each scale builds a world with a given number of pellets, CPU players and
+blobs per player, and then times a full World.step as well as each phase of
+a tick on its own: food collisions, player collisions, the AI's danger/reward
+scoring and nearest-food search, and an offscreen paint (only when wx is
+installed). Results are printed as JSON with ticks per second and p50/p99
+latencies, and can be compared against a stored baseline to flag
+regressions:
+
+    python benchmark.py --scale small medium --out baseline.json
+    python benchmark.py --scale small medium --compare baseline.json
+'''
+import argparse
+import json
+import math
+import platform
+import random
+import sys
+import time
+import numpy
+import ai
+from world import World, UserInput
+from splitmerge import MAX_CELLS
+
+try:
+    import wx
+    from render import Renderer
+except ImportError:
+    wx = None
+
+# name -> (pellets, CPU players, blobs per player, world width and height)
+SCALES = {
+    'small': (2000, 20, 1, 2400),
+    'medium': (20000, 200, 4, 7600),
+    'large': (200000, 2000, 16, 24000),
+    'split': (2000, 20, 16, 2400),
+    'cells': (2000, 20, 128, 9600),
+    'crowd': (2000, 200, 1, 2400),
+}
+TICK = 0.05
+PHASES = ('tick', 'food_collisions', 'player_collisions', 'danger_reward',
+          'best_food', 'paint')
+
+
+def build_world(food, bots, splits, size, seed):
+    '''Builds a seeded world and splits every player until it has about the
+    given number of blobs. Players are made large enough that every split
+    leaves their blobs big enough to split again'''
+    random.seed(seed)
+    world = World(food, bots, size, size, seed=seed,
+                  max_cells=max(splits, MAX_CELLS))
+    rounds = int(round(math.log2(splits))) if splits > 1 else 0
+    for p in world.all_players():
+        if rounds:
+            r = 21 * 2 ** rounds
+            if p.center.r < r:
+                p.grow_blob(p.center, math.pi * (r * r - p.center.r ** 2))
+        for _ in range(rounds):
+            angle = random.uniform(0, 2 * math.pi)
+            p.shoot((math.cos(angle), math.sin(angle)))
+        world.index_player(p)
+    return world
+
+
+def percentile(samples, q):
+    '''Returns the q-th percentile of a list of samples'''
+    return float(numpy.percentile(numpy.array(samples), q))
+
+
+def summarize(samples):
+    '''Summarizes a list of durations in seconds'''
+    mean = sum(samples) / len(samples)
+    return {'mean_ms': mean * 1000,
+            'p50_ms': percentile(samples, 50) * 1000,
+            'p99_ms': percentile(samples, 99) * 1000,
+            'per_sec': 1 / mean if mean > 0 else float('inf'),
+            'samples': len(samples)}
+
+
+def timed(samples, name, fn, *args):
+    '''Calls fn with args and records how long it took under name'''
+    start = time.perf_counter()
+    fn(*args)
+    samples[name].append(time.perf_counter() - start)
+
+
+def food_collisions(world):
+    '''Lets every blob in the world eat the food it overlaps'''
+    for p in world.all_players():
+        for b in list(p.blobs):
+            world.handle_food_collisions(b)
+
+
+def scoring_inputs(world):
+    '''Flattens the world's blobs for the AI and picks every CPU player'''
+    everyone = world.all_players()
+    arrays = ai.BlobArrays(everyone)
+    rows = numpy.arange(len(everyone) - 1, dtype=numpy.intp)
+    return arrays, rows
+
+
+def danger_reward(world):
+    '''Scores the danger and reward of every CPU player'''
+    arrays, rows = scoring_inputs(world)
+    ai.danger_reward(arrays, rows, world.rules.sight, world.rules.eat_ratio)
+
+
+def best_food(world):
+    '''Finds the closest food of every CPU player'''
+    arrays, rows = scoring_inputs(world)
+    ai.best_food(world.food, arrays.cx[rows], arrays.cy[rows],
+                 world.rules.sight)
+
+
+def run_scale(name, ticks, warmup, seed):
+    '''Benchmarks a single scale and returns its results'''
+    food, bots, splits, size = SCALES[name]
+    start = time.perf_counter()
+    world = build_world(food, bots, splits, size, seed)
+    build = time.perf_counter() - start
+    samples = {phase: [] for phase in PHASES}
+    if wx is not None:
+        app = wx.App(False)
+        renderer = Renderer()
+        bitmap = wx.Bitmap(renderer.width, renderer.height)
+        dc = wx.MemoryDC(bitmap)
+    user_input = UserInput((1, 0), False)
+    for i in range(warmup + ticks):
+        timed(samples, 'food_collisions', food_collisions, world)
+        timed(samples, 'player_collisions', world.handle_player_collisions)
+        timed(samples, 'danger_reward', danger_reward, world)
+        timed(samples, 'best_food', best_food, world)
+        if wx is not None:
+            timed(samples, 'paint', renderer.draw, dc, world)
+        timed(samples, 'tick', world.step, TICK, user_input)
+        if i == warmup - 1:
+            samples = {phase: [] for phase in PHASES}
+    if wx is not None:
+        dc.SelectObject(wx.NullBitmap)
+    blobs = sum(len(p.blobs) for p in world.all_players())
+    return {'scale': name, 'food': food, 'bots': bots, 'splits': splits,
+            'size': size, 'blobs': blobs, 'build_s': build,
+            'phases': {phase: summarize(s) for phase, s in samples.items()
+                       if s}}
+
+
+def compare(results, baseline, threshold):
+    '''Compares results against a baseline, returning a list of regressions:
+    phases whose p50 latency grew by more than threshold (a fraction)'''
+    old = {r['scale']: r for r in baseline['results']}
+    regressions = []
+    for r in results['results']:
+        if r['scale'] not in old:
+            continue
+        for phase, stats in r['phases'].items():
+            before = old[r['scale']]['phases'].get(phase)
+            if before is None or before['p50_ms'] <= 0:
+                continue
+            change = stats['p50_ms'] / before['p50_ms'] - 1
+            if change > threshold:
+                regressions.append({'scale': r['scale'], 'phase': phase,
+                                    'baseline_p50_ms': before['p50_ms'],
+                                    'p50_ms': stats['p50_ms'],
+                                    'change': change})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--scale', nargs='+', default=['small', 'medium'],
+                        choices=sorted(SCALES), help='scales to run')
+    parser.add_argument('--ticks', type=int, default=50,
+                        help='measured ticks per scale')
+    parser.add_argument('--warmup', type=int, default=5,
+                        help='ticks to run before measuring')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='also write the JSON to this file')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='flag regressions against a stored result')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='p50 slowdown that counts as a regression')
+    args = parser.parse_args(argv)
+
+    results = {'meta': {'python': platform.python_version(),
+                        'numpy': numpy.__version__,
+                        'machine': platform.machine(),
+                        'seed': args.seed, 'ticks': args.ticks,
+                        'paint': wx is not None},
+               'results': [run_scale(name, args.ticks, args.warmup, args.seed)
+                           for name in args.scale]}
+    status = 0
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        results['regressions'] = compare(results, baseline, args.threshold)
+        status = 1 if results['regressions'] else 0
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,83 +1,166 @@
-import math
-from gameobject import GameObject
-import datetime
-
-
-class Blob(GameObject):
-    '''A Blob represents a single disk in the game. It can move, eat others,
-    and change its size. A player controls a collection of Blobs'''
-
-    def __init__(self, x, y, r, color, shoot, id_number, init_direction):
-        super().__init__(x, y, r, color, False)
-        self.shoot = shoot
-        self.time = datetime.datetime.now()
-        self.id_number = id_number
-        self.recover = False
-        self.init_direction = init_direction
-
-    def decr_radius(self):
-        '''Halves the radius of the given blob. This is used when a player
-        shoots a new, smaller blob and decreases the sizes of its existing
-        blobs'''
-        self.r = self.r / 2
-
-    def velocity(self):
-        '''Calculates the current velocity of the blob, which is a function
-        of its mass. If the blob was shot by a parent, its velocity is
-        temporarily (for 2 seconds) higher'''
-        if not self.shoot:
-            return 20 * math.pow(self.r, -0.439)
-        else:
-            now = datetime.datetime.now()
-            seconds = (now - self.time).seconds
-            micros = (now - self.time).microseconds / (10 ** 6)
-            delta = seconds + micros
-            if delta > 2:
-                self.shoot = False
-                self.recover = True
-            v_0 = 20 * math.pow(self.r, -0.439)
-            v = 5 * v_0 + ((v_0 * (1 - 5)) / 2) * delta
-            return v
-
-    def eatObj(self, obj):
-        '''Eats the given object, growing its radius accordingly. Note that
-        the new size is defined by the total area of this blob and the
-        eaten blob, so it is not linear in the radii'''
-        other_radius = obj.r
-        other_area = math.pi * math.pow(other_radius, 2)
-        this_area = math.pi * math.pow(self.r, 2)
-        new_area = other_area + this_area
-        self.r = math.sqrt(new_area / math.pi)
-
-    def move(self, direction, parent):
-        '''Moves the given blob in the given direction. If it is recovering
-        from being shot out, it moves back towards its parent'''
-        if self.recover:
-            px, py = parent.get_absolute_position()
-            parent_vector = (px - self.x, py-self.y)
-            x, y = GameObject.normalize(parent_vector)
-            if math.hypot(px - self.x, py - self.y) < 1.5 * parent.r:
-                self.recover = False
-        elif self.shoot:
-            x, y = GameObject.normalize(self.init_direction)
-        else:
-            x, y = GameObject.normalize(direction)
-        self.x += self.velocity() * x
-        self.y += self.velocity() * y
-
-    def decay(self):
-        '''Decreases the radius of the blob, called every 10 seconds and
-        decreases larger players faster'''
-        self.r = max(10, 0.99 * self.r)
-
-    def __lt__(self, other):
-        '''Compares two blobs to see if one is less than the other, defined by
-        comparing their radii. A blob can only be eaten by another blob if it
-        is less than that blob'''
-        return self.r < 0.75 * other.r
-
-    def __gt__(self, other):
-        '''Compares two blobs to see if one is greater than the other, defined
-        by comparing their radii. A blob can only eat another blob if it
-        is greater than that blob'''
-        return self.r > other.r / 0.75
+import math
+import itertools
+from gameobject import GameObject
+from rules import DEFAULT_RULES
+
+# unique ids for blobs, so a recycled blob is never mistaken for its old self
+_uids = itertools.count()
+
+
+class Blob(GameObject):
+    '''A Blob represents a single disk in the game. It can move, eat others,
+    and change its size. A player controls a collection of Blobs. How fast
+    it moves and what it can eat depend on the Rules of its world'''
+
+    __slots__ = ('uid', 'shoot', 'clock', 'time', 'id_number', 'recover',
+                 'init_direction', 'merge_time', 'rules')
+
+    def __init__(self, x, y, r, color, shoot, id_number, init_direction,
+                 clock, rules=DEFAULT_RULES):
+        self.reset(x, y, r, color, shoot, id_number, init_direction, clock,
+                   rules=rules)
+
+    def reset(self, x, y, r, color, shoot, id_number, init_direction, clock,
+              uid=None, rules=DEFAULT_RULES):
+        '''(Re)initializes every field of the blob, so a dead blob can be
+        reused by a BlobPool as if it were new'''
+        GameObject.__init__(self, x, y, r, color, False)
+        self.uid = next(_uids) if uid is None else uid
+        self.shoot = shoot
+        self.clock = clock
+        self.time = clock.time
+        self.id_number = id_number
+        self.recover = False
+        self.init_direction = init_direction
+        # the simulated time from which the blob may merge with the other
+        # blobs of its player, set when the player splits
+        self.merge_time = clock.time
+        self.rules = rules
+
+    def __hash__(self):
+        '''Blobs hash by uid rather than by address, so sets of blobs are
+        iterated in the same order every time a game is replayed'''
+        return self.uid
+
+    def decr_radius(self):
+        '''Halves the radius of the given blob. This is used when a player
+        shoots a new, smaller blob and decreases the sizes of its existing
+        blobs'''
+        self.r = self.r / 2
+
+    def velocity(self):
+        '''Calculates the current velocity of the blob, which is a function
+        of its mass. If the blob was shot by a parent, its velocity is
+        temporarily (for shoot_time seconds of simulated time) higher'''
+        rules = self.rules
+        if not self.shoot:
+            return rules.speed * math.pow(self.r, rules.speed_exponent)
+        else:
+            delta = self.clock.time - self.time
+            if delta > rules.shoot_time:
+                self.shoot = False
+                self.recover = True
+            v_0 = rules.speed * math.pow(self.r, rules.speed_exponent)
+            boost = rules.shoot_boost
+            v = boost * v_0 + ((v_0 * (1 - boost)) / rules.shoot_time) * delta
+            return v
+
+    def eatObj(self, obj):
+        '''Eats the given object, growing its radius accordingly. Note that
+        the new size is defined by the total area of this blob and the
+        eaten blob, so it is not linear in the radii'''
+        other_radius = obj.r
+        self.grow(math.pi * math.pow(other_radius, 2))
+
+    def grow(self, area):
+        '''Grows the blob by the given area, as if it had eaten objects with
+        that total area'''
+        this_area = math.pi * math.pow(self.r, 2)
+        new_area = area + this_area
+        self.r = math.sqrt(new_area / math.pi)
+
+    def move(self, direction, parent, steps=1):
+        '''Moves the given blob in the given direction, as far as it goes in
+        the given number of ticks. If it is recovering from being shot out, it
+        moves back towards its parent until it is close enough to touch it,
+        and once it may merge it heads for its parent again'''
+        if self.recover:
+            px, py = parent.get_absolute_position()
+            parent_vector = (px - self.x, py-self.y)
+            x, y = GameObject.normalize(parent_vector)
+            cx, cy = self.get_absolute_position()
+            if math.hypot(px - cx, py - cy) < 1.5 * parent.r + self.r:
+                self.recover = False
+        elif self.shoot:
+            x, y = GameObject.normalize(self.init_direction)
+        elif self is not parent and self.merge_time <= self.clock.time:
+            # once it may merge, the blob heads for its parent to merge
+            px, py = parent.get_absolute_position()
+            cx, cy = self.get_absolute_position()
+            x, y = GameObject.normalize((px - cx, py - cy))
+        else:
+            x, y = GameObject.normalize(direction)
+        v = self.velocity() * steps
+        self.x += v * x
+        self.y += v * y
+
+    def decay(self):
+        '''Decreases the radius of the blob, called every 10 seconds and
+        decreases larger players faster'''
+        self.r = max(10, 0.99 * self.r)
+
+    def __lt__(self, other):
+        '''Compares two blobs to see if one is less than the other, defined by
+        comparing their radii. A blob can only be eaten by another blob if it
+        is less than that blob'''
+        return self.r < self.rules.eat_ratio * other.r
+
+    def __gt__(self, other):
+        '''Compares two blobs to see if one is greater than the other, defined
+        by comparing their radii. A blob can only eat another blob if it
+        is greater than that blob'''
+        return self.r > other.r / self.rules.eat_ratio
+
+
+class BlobPool():
+    '''A BlobPool recycles blobs that have been eaten or merged, so that
+    splitting and respawning reuse them instead of allocating new ones. A
+    blob must not be used anywhere once it has been released. The uids of
+    the blobs are first, first + step, first + 2 * step and so on, so pools
+    with the same step and different firsts never hand out the same uid.
+    Every blob of the pool plays by the pool's rules'''
+
+    def __init__(self, first=0, step=1, rules=DEFAULT_RULES):
+        self.free = []
+        self.step = step
+        self.rules = rules
+        # the pool hands out the uids of its blobs, so they only depend on
+        # the history of the world the pool belongs to
+        self.uids = itertools.count(first, step)
+
+    def acquire(self, x, y, r, color, shoot, id_number, init_direction,
+                clock):
+        '''Returns a blob with the given fields, reusing a released one if
+        there is one'''
+        uid = next(self.uids)
+        if self.free:
+            b = self.free.pop()
+            b.reset(x, y, r, color, shoot, id_number, init_direction, clock,
+                    uid, self.rules)
+            return b
+        b = Blob(x, y, r, color, shoot, id_number, init_direction, clock,
+                 self.rules)
+        b.uid = uid
+        return b
+
+    def reserve_uids(self, last):
+        '''Makes sure every uid handed out from now on is greater than last,
+        e.g. after blobs with stored uids have been loaded'''
+        uid = next(self.uids)
+        if uid <= last:
+            uid += ((last - uid) // self.step + 1) * self.step
+        self.uids = itertools.count(uid, self.step)
+
+    def release(self, blob):
+        '''Hands a dead blob back to the pool'''
+        self.free.append(blob)
@@ -0,0 +1,15 @@
+class SimClock():
+    '''A SimClock keeps the simulated time of a world. It is advanced once per
+    step by the length of the step, and every rule that depends on time (the
+    speed boost of a shot blob, recombining blobs, decay) reads it instead of
+    the wall clock. This keeps those rules correct when the world is stepped
+    faster or slower than real time'''
+
+    def __init__(self, time=0.0, ticks=0):
+        self.time = time
+        self.ticks = ticks
+
+    def advance(self, dt):
+        '''Moves the clock forward by one tick of dt seconds'''
+        self.time += dt
+        self.ticks += 1
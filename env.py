@@ -0,0 +1,251 @@
+'''A batched environment for training agents to play as the user. A VecEnv
+steps N independent, seeded worlds in lockstep with the normal rules and CPU
+players, and returns stacked arrays:
+
+    env = VecEnv(64, seed=0, food_count=500, other_players=8)
+    obs = env.reset()                      # (N, OBS_SIZE) float32
+    obs, rewards, dones = env.step(actions)
+
+actions is an (N, 3) array of (dx, dy, split) rows - the direction to move in
+and whether to split (split > 0.5). The reward is the change in the user's
+mass over the step. When the user is eaten (or, if max_steps is given, has
+played that many steps) its row is done and the user respawns in the same
+world, so worlds are never rebuilt. An observation holds the user's mass,
+position and number of blobs followed by the FOOD_SEEN closest pellets and
+BLOBS_SEEN closest blobs of other players within the sight of the world's
+rules (as far as its CPU players see), relative to the user's center and
+zero-padded.
+
+With processes > 0 the worlds are spread across that many worker processes,
+which step their share of the worlds in parallel. env.frames(scale) returns
+the users' views as stacked (N, height, width, 3) images for pixel
+observations.
+'''
+import math
+import multiprocessing
+import numpy
+from gameobject import FRAME_WIDTH, FRAME_HEIGHT
+from world import World, UserInput
+from raster import Rasterizer
+from tiles import MAX_TILES, tiles_in_view
+
+TICK = 0.05
+FOOD_SEEN = 16
+BLOBS_SEEN = 16
+# mass, x, y, blobs, then (dx, dy) per pellet and (dx, dy, r) per blob
+OBS_SIZE = 4 + 2 * FOOD_SEEN + 3 * BLOBS_SEEN
+# masses are observed relative to a blob of this radius
+MASS_SCALE = math.pi * 100 ** 2
+
+
+def mass(player):
+    '''Returns the total area of a player's blobs'''
+    return math.pi * sum(b.r * b.r for b in player.blobs)
+
+
+def observe(world, out):
+    '''Writes the observation of the user of a world into the row out'''
+    out[:] = 0
+    user = world.user
+    x, y = user.get_absolute_position()
+    out[0] = mass(user) / MASS_SCALE
+    out[1] = x / world.width
+    out[2] = y / world.height
+    out[3] = len(user.blobs) / world.max_cells
+
+    sight = world.rules.sight
+    food = world.food
+    idx = food.in_rect(x - sight, y - sight, x + sight, y + sight)
+    dx = food.x[idx] - x
+    dy = food.y[idx] - y
+    if len(idx) > FOOD_SEEN:
+        closest = numpy.argpartition(dx * dx + dy * dy, FOOD_SEEN)[:FOOD_SEEN]
+        dx, dy = dx[closest], dy[closest]
+    start = 4
+    out[start:start + 2 * len(dx):2] = dx / sight
+    out[start + 1:start + 2 * len(dy):2] = dy / sight
+
+    blobs = [b for b in world.blob_index.query_rect(x - sight, y - sight,
+                                                    x + sight, y + sight)
+             if b.id_number != user.id_number]
+    if blobs:
+        n = len(blobs)
+        r = numpy.fromiter((b.r for b in blobs), float, n)
+        bx = numpy.fromiter((b.x for b in blobs), float, n) + r - x
+        by = numpy.fromiter((b.y for b in blobs), float, n) + r - y
+        if n > BLOBS_SEEN:
+            closest = numpy.argpartition(bx * bx + by * by,
+                                         BLOBS_SEEN)[:BLOBS_SEEN]
+            r, bx, by = r[closest], bx[closest], by[closest]
+        start = 4 + 2 * FOOD_SEEN
+        end = start + 3 * len(r)
+        out[start:end:3] = bx / sight
+        out[start + 1:end:3] = by / sight
+        # sizes are relative to the user's center blob, so > 1 is dangerous
+        out[start + 2:end:3] = r / user.center.r
+
+
+def respawn_user(world):
+    '''Takes the user's blobs out of a world and starts the user again, as
+    when it is eaten'''
+    for b in world.user.blobs:
+        world.blob_index.remove(b)
+        world.dead_blobs.append(b)
+    world.restart_user()
+
+
+class Worlds():
+    '''A batch of worlds stepped one after the other in this process. This
+    does the work of a VecEnv, or of one of its worker processes'''
+
+    def __init__(self, seeds, dt=TICK, max_steps=None, **world_args):
+        self.seeds = seeds
+        self.dt = dt
+        self.max_steps = max_steps
+        self.world_args = world_args
+        self.worlds = []
+        n = len(seeds)
+        self.obs = numpy.zeros((n, OBS_SIZE), dtype=numpy.float32)
+        self.rewards = numpy.zeros(n, dtype=numpy.float32)
+        self.dones = numpy.zeros(n, dtype=bool)
+        self.steps = numpy.zeros(n, dtype=numpy.int64)
+        self.rasterizer = None
+
+    def reset(self):
+        '''Builds the worlds the first time, and afterwards respawns the user
+        in each of them. Returns the observations'''
+        if not self.worlds:
+            self.worlds = [World(seed=seed, **self.world_args)
+                           for seed in self.seeds]
+        else:
+            for world in self.worlds:
+                respawn_user(world)
+        self.steps[:] = 0
+        for i, world in enumerate(self.worlds):
+            observe(world, self.obs[i])
+        return self.obs
+
+    def step(self, actions):
+        '''Steps every world with its row of actions and returns the
+        observations, rewards and done flags'''
+        for i, (world, (dx, dy, split)) in enumerate(
+                zip(self.worlds, actions.tolist())):
+            user = world.user
+            before = mass(user)
+            world.step(self.dt, UserInput((dx, dy), split > 0.5))
+            self.steps[i] += 1
+            if world.user is not user:
+                # the user was eaten and has already respawned
+                self.rewards[i] = -before
+                self.dones[i] = True
+            else:
+                self.rewards[i] = mass(user) - before
+                self.dones[i] = (self.max_steps is not None and
+                                 self.steps[i] >= self.max_steps)
+                if self.dones[i]:
+                    respawn_user(world)
+            if self.dones[i]:
+                self.steps[i] = 0
+            observe(world, self.obs[i])
+        return self.obs, self.rewards, self.dones
+
+    def frames(self, scale):
+        '''Returns the users' views of the worlds, scaled, as a stacked
+        array of images'''
+        if self.rasterizer is None or self.rasterizer.scale != scale:
+            # room for the tiles in view of every world
+            in_view = tiles_in_view(FRAME_WIDTH, FRAME_HEIGHT)
+            self.rasterizer = Rasterizer(
+                scale=scale,
+                max_tiles=max(MAX_TILES, in_view * len(self.worlds)))
+        out = numpy.empty((len(self.worlds),) +
+                          self.rasterizer.frame_shape(), dtype=numpy.uint8)
+        for i, world in enumerate(self.worlds):
+            out[i] = self.rasterizer.frame(world)
+        return out
+
+
+def _worker(conn, seeds, dt, max_steps, world_args):
+    '''Runs a batch of worlds in a worker process, answering the commands
+    sent down the pipe'''
+    worlds = Worlds(seeds, dt, max_steps, **world_args)
+    while True:
+        command, data = conn.recv()
+        if command == 'step':
+            conn.send(worlds.step(data))
+        elif command == 'reset':
+            conn.send(worlds.reset())
+        elif command == 'frames':
+            conn.send(worlds.frames(data))
+        else:
+            conn.close()
+            return
+
+
+class VecEnv():
+    '''Steps n worlds in lockstep and returns stacked arrays for all of them.
+    Any keyword arguments are passed on to World, e.g. to make smaller,
+    faster worlds for training'''
+
+    def __init__(self, n, seed=0, processes=0, dt=TICK, max_steps=None,
+                 **world_args):
+        self.n = n
+        seeds = list(range(seed, seed + n))
+        self.local = None
+        self.pipes = []
+        self.processes = []
+        if processes <= 0:
+            self.local = Worlds(seeds, dt, max_steps, **world_args)
+            return
+        self.slices = [s for s in numpy.array_split(numpy.arange(n),
+                                                    processes) if len(s)]
+        for indices in self.slices:
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=_worker, daemon=True,
+                args=(child, [seeds[i] for i in indices], dt, max_steps,
+                      world_args))
+            process.start()
+            child.close()
+            self.pipes.append(parent)
+            self.processes.append(process)
+
+    def reset(self):
+        '''Starts (or restarts) every world and returns the observations'''
+        if self.local is not None:
+            return self.local.reset().copy()
+        for pipe in self.pipes:
+            pipe.send(('reset', None))
+        return numpy.concatenate([pipe.recv() for pipe in self.pipes])
+
+    def step(self, actions):
+        '''Steps every world with its row of the (n, 3) actions array and
+        returns the observations, rewards and done flags'''
+        actions = numpy.asarray(actions, dtype=float).reshape(self.n, 3)
+        if self.local is not None:
+            obs, rewards, dones = self.local.step(actions)
+            return obs.copy(), rewards.copy(), dones.copy()
+        for pipe, indices in zip(self.pipes, self.slices):
+            pipe.send(('step', actions[indices]))
+        results = [pipe.recv() for pipe in self.pipes]
+        return tuple(numpy.concatenate([r[k] for r in results])
+                     for k in range(3))
+
+    def frames(self, scale=1):
+        '''Returns the view of the user of every world, scaled, as an (n,
+        height, width, 3) uint8 array'''
+        if self.local is not None:
+            return self.local.frames(scale)
+        for pipe in self.pipes:
+            pipe.send(('frames', scale))
+        return numpy.concatenate([pipe.recv() for pipe in self.pipes])
+
+    def close(self):
+        '''Stops the worker processes, if there are any'''
+        for pipe in self.pipes:
+            pipe.send(('close', None))
+            pipe.close()
+        for process in self.processes:
+            process.join()
+        self.pipes = []
+        self.processes = []
@@ -0,0 +1,274 @@
+'''A stream of the things that happen in a game, for match analytics and
+anomaly detection. A World reports every eat, pellet meal, split, merge and
+spawn to its event bus; the EventBus writes them into a preallocated buffer
+of fixed-size records and at the end of every tick hands the tick's records
+to an EventWriter, which appends them to a log on a thread of its own. The
+tick never waits for the disk: if the writer falls too far behind, whole
+ticks of events are dropped (and counted) instead. When no log is being
+written the World uses the NullEventBus, whose hooks do nothing.
+
+    bus = EventBus(EventWriter('match.events'))
+    world.events = bus
+    ...
+    bus.close()
+    events = read_events('match.events')     # one EVENT_DTYPE array
+
+A log is a sequence of segment files - match.events.0, match.events.1, ... -
+each started once the previous one reaches max_bytes. A segment is the
+MAGIC bytes followed by blocks of records, each block one tick's worth: a
+little-endian uint32 count and then count EVENT_DTYPE records.
+
+    python events.py match.events        # counts of each kind of event
+'''
+import glob
+import json
+import queue
+import re
+import sys
+import threading
+import time
+import numpy
+
+MAGIC = b'AGEV\x01\x00\x00\x00'
+# the kinds of event
+EAT, FOOD, SPLIT, MERGE, SPAWN = range(5)
+KINDS = ('eat', 'food', 'split', 'merge', 'spawn')
+# one event: the tick it happened on, its kind, the player it happened to
+# and the blob involved, the other player and blob (the one eaten, or -1;
+# for food, other is the number of pellets), where it happened and a value -
+# the area gained or lost, the number of new cells of a split, or the radius
+# of a spawned player
+EVENT_DTYPE = numpy.dtype([('tick', '<i8'), ('kind', 'u1'),
+                           ('player', '<i4'), ('uid', '<i8'),
+                           ('other', '<i4'), ('other_uid', '<i8'),
+                           ('x', '<f4'), ('y', '<f4'), ('value', '<f8')])
+COUNT = numpy.dtype('<u4')
+# the number of events the buffer starts with room for
+CAPACITY = 1024
+# the most ticks of events waiting for the writer before ticks are dropped
+MAX_PENDING = 1000
+MAX_BYTES = 64 * 1024 * 1024
+# the most seconds close() waits for the writer to finish
+CLOSE_TIMEOUT = 10
+
+
+class EventLogError(Exception):
+    '''Raised for a file that is not an event log'''
+    pass
+
+
+class NullEventBus():
+    '''An event bus that records nothing'''
+
+    enabled = False
+
+    def emit(self, kind, player, uid, other=-1, other_uid=-1, x=0, y=0,
+             value=0):
+        pass
+
+    def end_tick(self, tick):
+        pass
+
+    def close(self):
+        pass
+
+
+NULL_EVENTS = NullEventBus()
+
+
+class EventBus():
+    '''Collects the events of a tick in a preallocated array of records,
+    which doubles in size if a tick ever has more events than it holds, and
+    passes them to the writer at the end of the tick'''
+
+    enabled = True
+
+    def __init__(self, writer, capacity=CAPACITY):
+        self.writer = writer
+        self.buffer = numpy.zeros(capacity, EVENT_DTYPE)
+        self.n = 0
+
+    def emit(self, kind, player, uid, other=-1, other_uid=-1, x=0, y=0,
+             value=0):
+        '''Records an event of the current tick'''
+        if self.n == len(self.buffer):
+            self.buffer = numpy.concatenate(
+                (self.buffer, numpy.zeros(len(self.buffer), EVENT_DTYPE)))
+        self.buffer[self.n] = (0, kind, player, uid, other, other_uid, x, y,
+                               value)
+        self.n += 1
+
+    def end_tick(self, tick):
+        '''Stamps the events of the tick that just finished with its number
+        and hands a copy of them to the writer'''
+        if self.n:
+            events = self.buffer[:self.n].copy()
+            events['tick'] = tick
+            self.writer.put(events)
+            self.n = 0
+
+    def close(self):
+        '''Writes out everything still waiting and closes the log'''
+        self.writer.close()
+
+
+class EventWriter(threading.Thread):
+    '''Appends blocks of events to a log on a background thread. Blocks are
+    queued with put(), which never waits; the thread takes every block that
+    is waiting at once and writes them with a single call'''
+
+    def __init__(self, path, max_bytes=MAX_BYTES, max_pending=MAX_PENDING):
+        super(EventWriter, self).__init__(daemon=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.queue = queue.Queue(max_pending)
+        # the number of events dropped because the writer fell behind
+        self.dropped = 0
+        self.segment = -1
+        self.file = None
+        self.size = 0
+        self.rotate()
+        self.start()
+
+    def put(self, events):
+        '''Queues a block of events to be written, or drops it if too many
+        are waiting already'''
+        try:
+            self.queue.put_nowait(events)
+        except queue.Full:
+            self.dropped += len(events)
+
+    def rotate(self):
+        '''Closes the current segment and starts the next one'''
+        if self.file is not None:
+            self.file.close()
+        self.segment += 1
+        self.file = open('%s.%d' % (self.path, self.segment), 'wb')
+        self.file.write(MAGIC)
+        self.size = len(MAGIC)
+
+    def run(self):
+        done = False
+        while not done:
+            blocks = [self.queue.get()]
+            while True:
+                try:
+                    blocks.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if blocks[-1] is None:
+                blocks.pop()
+                done = True
+            chunks = []
+            for events in blocks:
+                chunks.append(numpy.array(len(events), COUNT).tobytes())
+                chunks.append(events.tobytes())
+            data = b''.join(chunks)
+            if self.size > len(MAGIC) and \
+                    self.size + len(data) > self.max_bytes:
+                self.rotate()
+            self.file.write(data)
+            self.file.flush()
+            self.size += len(data)
+        self.file.close()
+
+    def close(self, timeout=CLOSE_TIMEOUT):
+        '''Writes out everything queued so far and waits up to timeout
+        seconds for the thread to finish. If the thread has died, the blocks
+        it left queued are counted as dropped instead of waited on'''
+        deadline = time.monotonic() + timeout
+        while self.is_alive():
+            try:
+                self.queue.put(None, timeout=0.1)
+                break
+            except queue.Full:
+                if time.monotonic() >= deadline:
+                    break
+        self.join(max(0, deadline - time.monotonic()))
+        if self.is_alive():
+            return
+        while True:
+            try:
+                events = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if events is not None:
+                self.dropped += len(events)
+        if not self.file.closed:
+            self.file.close()
+
+
+class EventList():
+    '''An event writer that keeps the blocks of events in memory instead,
+    e.g. for a headless match that is summed up when it ends'''
+
+    def __init__(self):
+        self.blocks = []
+        self.dropped = 0
+
+    def put(self, events):
+        self.blocks.append(events)
+
+    def events(self):
+        '''Returns every event so far as a single EVENT_DTYPE array'''
+        if not self.blocks:
+            return numpy.zeros(0, EVENT_DTYPE)
+        return numpy.concatenate(self.blocks)
+
+    def close(self):
+        pass
+
+
+def segments(path):
+    '''Returns the segment files of a log, in order'''
+    names = glob.glob(glob.escape(path) + '.*')
+    numbered = [(int(m.group(1)), name) for name in names
+                for m in [re.search(r'\.(\d+)$', name)] if m]
+    return [name for _, name in sorted(numbered)]
+
+
+def iter_blocks(path):
+    '''Yields the blocks of events of a log, one EVENT_DTYPE array per
+    tick, from the first segment to the last'''
+    for name in segments(path):
+        with open(name, 'rb') as f:
+            data = f.read()
+        if data[:len(MAGIC)] != MAGIC:
+            raise EventLogError('%s is not an event log' % name)
+        offset = len(MAGIC)
+        while offset + COUNT.itemsize <= len(data):
+            count = int(numpy.frombuffer(data, COUNT, 1, offset)[0])
+            offset += COUNT.itemsize
+            end = offset + count * EVENT_DTYPE.itemsize
+            if end > len(data):
+                # the last block of a log still being written
+                break
+            yield numpy.frombuffer(data, EVENT_DTYPE, count, offset)
+            offset = end
+
+
+def read_events(path):
+    '''Returns every event in a log as a single EVENT_DTYPE array'''
+    blocks = list(iter_blocks(path))
+    if not blocks:
+        return numpy.zeros(0, EVENT_DTYPE)
+    return numpy.concatenate(blocks)
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if len(argv) != 1:
+        print('usage: python events.py LOG', file=sys.stderr)
+        return 2
+    events = read_events(argv[0])
+    counts = numpy.bincount(events['kind'], minlength=len(KINDS))
+    summary = {'events': len(events),
+               'ticks': len(numpy.unique(events['tick']))}
+    summary.update(zip(KINDS, counts.tolist()))
+    print(json.dumps(summary))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
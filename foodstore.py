@@ -0,0 +1,186 @@
+import numpy
+from palette import PALETTE
+from tiles import TILE_SIZE, tiles_in_rect, new_version
+
+
+class FoodStore():
+    '''A FoodStore keeps every food pellet as a struct of arrays rather than as
+    individual GameObjects. Each pellet is a slot with a position (the center
+    of the pellet), radius, palette index, alive flag and grid cell. This lets
+    every pellet a blob overlaps be found with a single vectorized distance
+    test, and lets eaten pellets be removed and respawned in O(1) by reusing
+    their slots. Pellets are also kept in a SpatialHash by slot, so queries
+    only test the pellets in nearby cells. The board is also split into
+    tiles of tile_size, each with a version that changes whenever a pellet
+    overlapping it is eaten or spawned, so renderers can cache the food of
+    each tile (see tiles.py)'''
+
+    def __init__(self, capacity, generator, index, tile_size=TILE_SIZE):
+        self.generator = generator
+        self.index = index
+        self.capacity = capacity
+        self.x = numpy.zeros(capacity)
+        self.y = numpy.zeros(capacity)
+        self.r = numpy.zeros(capacity)
+        self.color_index = numpy.zeros(capacity, dtype=numpy.uint8)
+        self.alive = numpy.zeros(capacity, dtype=bool)
+        self.cell = numpy.zeros(capacity, dtype=numpy.int32)
+        # the number of pellets tested for overlaps so far, for profiling
+        self.tested = 0
+        # the number of pellets taken from the generator so far
+        self.spawned = 0
+        # slots that are not alive, used as a stack
+        self.free = list(range(capacity - 1, -1, -1))
+        self.tile_size = tile_size
+        # tile -> its version, for the tiles that changed since the store was
+        # made or loaded; the others are at the base version
+        self.versions = {}
+        self.base = new_version()
+
+    def __len__(self):
+        '''Returns the number of pellets currently on the board'''
+        return self.capacity - len(self.free)
+
+    def spawn(self):
+        '''Takes the next pellet from the generator and places it in a free
+        slot, returning the slot's index. The generator yields (x, y, r,
+        color_index) tuples, where x and y are the top left corner as for a
+        GameObject and color_index is an index into the palette'''
+        i = self.free.pop()
+        x, y, r, color_index = next(self.generator)
+        self.spawned += 1
+        self.x[i] = x + r
+        self.y[i] = y + r
+        self.r[i] = r
+        self.color_index[i] = color_index
+        self.alive[i] = True
+        self.cell[i] = self.index.cell_of(x + r, y + r)
+        self.index.insert(i, x + r, y + r, r)
+        self.touch(i)
+        return i
+
+    def load(self, x, y, r, color_index, alive, free):
+        '''Replaces every pellet with the given arrays (centers, radii, palette
+        indices and alive flags, one entry per slot) and free stack, and
+        indexes the live pellets in one go'''
+        self.x[:] = x
+        self.y[:] = y
+        self.r[:] = r
+        self.color_index[:] = color_index
+        self.alive[:] = alive
+        self.free = numpy.asarray(free).tolist()
+        live = numpy.flatnonzero(self.alive)
+        self.cell[live] = self.index.cells_of(self.x[live], self.y[live])
+        self.index.insert_many(live, self.x[live], self.y[live], self.r[live])
+        self.versions = {}
+        self.base = new_version()
+
+    def remove(self, i):
+        '''Removes the pellet in the given slot from the board'''
+        if self.alive[i]:
+            self.alive[i] = False
+            self.free.append(int(i))
+            self.index.remove(int(i))
+            self.touch(i)
+
+    def replace(self, slots):
+        '''Removes the pellets in the given slots, and only once they are all
+        gone spawns as many new ones'''
+        for i in slots:
+            self.remove(i)
+        for _ in range(len(slots)):
+            self.spawn()
+
+    def touch(self, i):
+        '''Gives every tile the pellet in the given slot overlaps a new
+        version'''
+        x, y, r = float(self.x[i]), float(self.y[i]), float(self.r[i])
+        version = new_version()
+        for tile in self.tiles_in_rect(x - r, y - r, x + r, y + r):
+            self.versions[tile] = version
+
+    def tiles_in_rect(self, x0, y0, x1, y1):
+        '''Returns the (column, row) of every tile overlapping the given
+        rectangle'''
+        return tiles_in_rect(x0, y0, x1, y1, self.index.width,
+                             self.index.height, self.tile_size)
+
+    def tile_rect(self, tile):
+        '''Returns the rectangle a tile covers as (x0, y0, x1, y1)'''
+        size = self.tile_size
+        column, row = tile
+        return (column * size, row * size, (column + 1) * size,
+                (row + 1) * size)
+
+    def tile_version(self, tile):
+        '''Returns the current version of a tile'''
+        return self.versions.get(tile, self.base)
+
+    def in_tile(self, tile):
+        '''Returns the indices of every pellet that overlaps a tile'''
+        x0, y0, x1, y1 = self.tile_rect(tile)
+        reach = float(self.r.max()) if self.capacity else 0
+        return self.in_rect(x0 - reach, y0 - reach, x1 + reach, y1 + reach)
+
+    def color(self, i):
+        '''Returns the colour of the pellet in the given slot as an RGB
+        tuple'''
+        return PALETTE[self.color_index[i]]
+
+    def _candidates(self, x0, y0, x1, y1):
+        '''Returns the slots of the pellets in the cells overlapping the given
+        rectangle as an array'''
+        index = self.index
+        cells = index.cells
+        found = set()
+        for c in index.cells_in_rect(x0, y0, x1, y1):
+            if c in cells:
+                found.update(cells[c])
+        return numpy.fromiter(found, dtype=numpy.intp, count=len(found))
+
+    def overlapping(self, x, y, r):
+        '''Returns the indices of every pellet that collides with a disk
+        centered at (x, y) with radius r'''
+        idx = self._candidates(x - r, y - r, x + r, y + r)
+        self.tested += len(idx)
+        dx = self.x[idx] - x
+        dy = self.y[idx] - y
+        reach = self.r[idx] + r
+        return idx[dx * dx + dy * dy < reach * reach]
+
+    def overlapping_path(self, x0, y0, x1, y1, r):
+        '''Returns the indices of every pellet that collides with a disk of
+        radius r anywhere along its way from (x0, y0) to (x1, y1)'''
+        idx = self._candidates(min(x0, x1) - r, min(y0, y1) - r,
+                               max(x0, x1) + r, max(y0, y1) + r)
+        self.tested += len(idx)
+        sx, sy = x1 - x0, y1 - y0
+        length = sx * sx + sy * sy
+        px = self.x[idx] - x0
+        py = self.y[idx] - y0
+        # the point of the path closest to each pellet
+        if length > 0:
+            t = numpy.clip((px * sx + py * sy) / length, 0, 1)
+        else:
+            t = 0
+        dx = px - t * sx
+        dy = py - t * sy
+        reach = self.r[idx] + r
+        return idx[dx * dx + dy * dy < reach * reach]
+
+    def in_rect(self, x0, y0, x1, y1):
+        '''Returns the indices of every pellet whose center is inside the given
+        rectangle'''
+        idx = self._candidates(x0, y0, x1, y1)
+        px = self.x[idx]
+        py = self.y[idx]
+        return idx[(px >= x0) & (px <= x1) & (py >= y0) & (py <= y1)]
+
+    def nearest(self, x, y, sight_factor):
+        '''Returns the index of and distance to the closest pellet within
+        sight_factor of (x, y), or (None, None) if there is none'''
+        found = self.index.nearest(x, y, 1, sight_factor)
+        if not found:
+            return (None, None)
+        d, i = found[0]
+        return (i, d)
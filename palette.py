@@ -0,0 +1,31 @@
+'''A fixed, shared palette of colours. Food pellets store only a one byte
+index into it, and blobs share its colour tuples, so no colour objects are
+allocated while the game runs'''
+import random
+
+PALETTE_SIZE = 256
+
+
+def build_palette(size=PALETTE_SIZE, seed=0):
+    '''Builds a palette of random RGB tuples. It uses its own random number
+    generator so the palette is the same on every run and building it does
+    not change the state of the random module'''
+    rng = random.Random(seed)
+    return [(rng.randrange(256), rng.randrange(256), rng.randrange(256))
+            for _ in range(size)]
+
+
+PALETTE = build_palette()
+
+
+def random_color_index(rng=random):
+    '''Returns the index of a random colour of the palette, drawn from the
+    given random number generator'''
+    return rng.randrange(PALETTE_SIZE)
+
+
+def random_color(rng=random):
+    '''Returns a random colour of the palette as an RGB tuple. Colours are
+    plain tuples so the simulation does not depend on wx - wx accepts them
+    wherever a wx.Colour is needed'''
+    return PALETTE[random_color_index(rng)]
@@ -1,89 +1,158 @@
-import math
-from blob import Blob
-import datetime
-
-
-class Player():
-    '''A Player represents either the user or a CPU player. Most importabtly,
-    it stores a collection of blobs, including one that is the center, which
-    is always in the middle of the screen for that player'''
-
-    def __init__(self, x, y, r, color, id_number):
-        self.blobs = set()
-        b = Blob(x, y, r, color, False, id_number, None)
-        self.blobs.add(b)
-        self.size = 1
-        self.id_number = id_number
-        self.time = datetime.datetime.now()
-        self.shoot_time = None
-        self.has_recovered = True
-        self.center = b
-        self.r = r
-
-    def get_absolute_position(self):
-        '''Returns the position of the player as an x-y tuple. This is the same
-        as the absolute position of the center blob (the one at the center of
-        the screen at all times)'''
-        return self.center.get_absolute_position()
-
-    def shoot(self, direction):
-        '''Shoot a new blob in the given direction. This creates the double
-        the number of blobs (up to a max of 16), each with half the radius, and
-        halves the radius of each existing blob as well'''
-        if min(b.r for b in self.blobs) > 20 and self.size < 16:
-            x, y = self.center.get_absolute_position()
-            r = self.center.r / 2
-            color = self.center.color
-            for my_b in self.blobs:
-                my_b.decr_radius()
-            for _ in range(self.size):
-                self.blobs.add(Blob(x, y, r, color, True, self.id_number,
-                               direction))
-            self.size *= 2
-            self.shoot_time = datetime.datetime.now()
-
-    def recovery_time(self):
-        '''Gets the time needed to re-combine the constituent blob into one
-        large blob. The time increases as the total mass increases'''
-        total_mass = sum(b.r for b in self.blobs)
-        return 30 + 0.02 * total_mass
-
-    def move(self, direction):
-        '''Moves the player in a given direction. If the time is after the
-        recovery time, then some of the blobs may eat others. Note that the
-        usual rules for eating do not apply (the radius does not need to be
-        more than other.r/0.75).'''
-        now = datetime.datetime.now()
-        if self.shoot_time is None:
-            delta = 0
-        else:
-            delta = (now - self.shoot_time).seconds
-        to_remove = None
-        for b in self.blobs:
-            bx, by = b.get_absolute_position()
-            b.move(direction, self.center)
-            if delta > self.recovery_time() and to_remove is None:
-                for other in self.blobs:
-                    if other is not b:
-                        ox, oy = other.get_absolute_position()
-                        if math.hypot(bx - ox, by - oy) < b.r:
-                            b.eatObj(other)
-                            to_remove = other
-        if to_remove is not None:
-            self.remove_blob(to_remove)
-
-    def draw(self, dc, relative_position):
-        '''Draws the player by drawing all its constituent blobs'''
-        [b.draw(dc, relative_position) for b in self.blobs]
-
-    def decay(self):
-        '''Decays the player by decaying all its consituent blobs'''
-        (b.decay() for b in self.blobs)
-
-    def remove_blob(self, blob):
-        '''Removes a blob from the set of blobs, adjusting the center if
-        necessary'''
-        self.blobs.remove(blob)
-        if blob is self.center and len(self.blobs) > 0:
-            self.center = next(iter(self.blobs))
-        self.size -= 1
+from blob import BlobPool
+import splitmerge
+from splitmerge import MAX_CELLS
+
+# a player can only split if none of its blobs is this small
+MIN_SPLIT_RADIUS = 20
+
+
+class Player():
+    '''A Player represents either the user or a CPU player. Most importabtly,
+    it stores a collection of blobs, including one that is the center, which
+    is always in the middle of the screen for that player. A player can split
+    into at most max_cells blobs. The sum of the radii of its blobs (their
+    mass, for the recovery time) and the number of them too small to split
+    are kept up to date as blobs are added, removed, grown and shrunk, so a
+    split does not have to look at every blob first; the radius of a blob
+    must therefore only be changed through the player'''
+
+    __slots__ = ('blobs', 'clock', 'pool', 'size', 'id_number', 'time',
+                 'shoot_time', 'has_recovered', 'center', 'r', 'max_cells',
+                 'mass', 'small')
+
+    def __init__(self, x, y, r, color, id_number, clock, pool=None,
+                 max_cells=MAX_CELLS):
+        self.blobs = set()
+        self.clock = clock
+        self.pool = pool if pool is not None else BlobPool()
+        b = self.pool.acquire(x, y, r, color, False, id_number, None, clock)
+        self.blobs.add(b)
+        self.size = 1
+        self.id_number = id_number
+        self.time = clock.time
+        self.shoot_time = None
+        self.has_recovered = True
+        self.center = b
+        self.r = r
+        self.max_cells = max_cells
+        self.mass = b.r
+        self.small = int(b.r <= MIN_SPLIT_RADIUS)
+
+    @classmethod
+    def restore(cls, blobs, center, clock, pool, id_number, size, time,
+                shoot_time, has_recovered, r, max_cells=MAX_CELLS):
+        '''Rebuilds a player that was saved or handed off, from its blobs
+        (already built from the pool, center being the one at the center) and
+        the rest of its state. Player() would spawn a fresh blob, so the slots
+        are filled in directly'''
+        player = cls.__new__(cls)
+        player.blobs = set(blobs)
+        player.clock = clock
+        player.pool = pool
+        player.size = size
+        player.id_number = id_number
+        player.time = time
+        player.shoot_time = shoot_time
+        player.has_recovered = has_recovered
+        player.center = center
+        player.r = r
+        player.max_cells = max_cells
+        player.count_blobs()
+        return player
+
+    def count_blobs(self):
+        '''Works out the mass and the number of small blobs from scratch'''
+        self.mass = sum(b.r for b in self.blobs)
+        self.small = sum(1 for b in self.blobs if b.r <= MIN_SPLIT_RADIUS)
+
+    def get_absolute_position(self):
+        '''Returns the position of the player as an x-y tuple. This is the same
+        as the absolute position of the center blob (the one at the center of
+        the screen at all times)'''
+        return self.center.get_absolute_position()
+
+    def shoot(self, direction):
+        '''Shoot a new blob in the given direction. This creates the double
+        the number of blobs (up to a max of max_cells), each with half the
+        radius, and halves the radius of each existing blob as well. None of
+        the blobs can merge again until the recovery time has passed'''
+        new = min(self.size, self.max_cells - self.size)
+        if new <= 0 or self.small:
+            return
+        merge_time = self.clock.time + self.recovery_time()
+        x, y = self.center.get_absolute_position()
+        r = self.center.r / 2
+        color = self.center.color
+        small = 0
+        for my_b in self.blobs:
+            my_b.decr_radius()
+            my_b.merge_time = merge_time
+            small += my_b.r <= MIN_SPLIT_RADIUS
+        for _ in range(new):
+            b = self.pool.acquire(x, y, r, color, True, self.id_number,
+                                  direction, self.clock)
+            b.merge_time = merge_time
+            self.blobs.add(b)
+        self.size += new
+        # halving every blob halves their mass, and the new blobs are the
+        # size of the halved center
+        self.mass = self.mass / 2 + new * r
+        self.small = small + new * (r <= MIN_SPLIT_RADIUS)
+        self.shoot_time = self.clock.time
+
+    def recovery_time(self):
+        '''Gets the time needed to re-combine the constituent blob into one
+        large blob. The time increases as the total mass increases'''
+        rules = self.pool.rules
+        return rules.recovery_time + rules.recovery_per_mass * self.mass
+
+    def grow_blob(self, blob, area):
+        '''Grows one of the player's blobs by the given area'''
+        r = blob.r
+        blob.grow(area)
+        self.resized(blob, r)
+
+    def absorb(self, blob, other):
+        '''Lets one of the player's blobs eat another blob, which it grows by
+        the area of. The other blob is not removed from its player'''
+        r = blob.r
+        blob.eatObj(other)
+        self.resized(blob, r)
+
+    def resized(self, blob, r):
+        '''Accounts for one of the player's blobs having changed from radius
+        r to its current radius'''
+        self.mass += blob.r - r
+        self.small += ((blob.r <= MIN_SPLIT_RADIUS) -
+                       (r <= MIN_SPLIT_RADIUS))
+
+    def move(self, direction, steps=1):
+        '''Moves the player in a given direction, as far as it goes in the
+        given number of ticks. Then blobs whose recovery time has passed may
+        eat others - note that the usual rules for eating do not apply (the
+        radius does not need to be more than other.r/0.75) - and blobs that
+        may not merge yet are pushed apart'''
+        for b in self.blobs:
+            b.move(direction, self.center, steps)
+        if len(self.blobs) > 1:
+            splitmerge.resolve(self)
+
+    def draw(self, dc, relative_position):
+        '''Draws the player by drawing all its constituent blobs'''
+        [b.draw(dc, relative_position) for b in self.blobs]
+
+    def decay(self):
+        '''Decays the player by decaying all its consituent blobs'''
+        for b in self.blobs:
+            b.decay()
+        self.count_blobs()
+
+    def remove_blob(self, blob):
+        '''Removes a blob from the set of blobs, adjusting the center if
+        necessary'''
+        self.blobs.remove(blob)
+        if blob is self.center and len(self.blobs) > 0:
+            self.center = next(iter(self.blobs))
+        self.size -= 1
+        self.mass -= blob.r
+        self.small -= blob.r <= MIN_SPLIT_RADIUS
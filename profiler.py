@@ -0,0 +1,150 @@
+'''Per-phase timing of the simulation. A World reports how long each phase of
+a tick took and how much work it did to its profiler; the Profiler keeps the
+last few hundred ticks of each in rolling windows that can be summarized,
+turned into histograms, drawn as an overlay or dumped to a file. When
+profiling is off the World uses the NullProfiler, whose hooks do nothing'''
+import json
+import time
+import numpy
+
+# the number of ticks kept for each phase and counter
+WINDOW = 600
+# the edges of the histogram buckets, in milliseconds
+BUCKETS = [0, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, float('inf')]
+
+
+class NullProfiler():
+    '''A profiler that records nothing, so the hooks in the tick cost no more
+    than a method call'''
+
+    enabled = False
+
+    def clock(self):
+        return 0
+
+    def add(self, phase, start):
+        pass
+
+    def add_elapsed(self, phase, elapsed):
+        pass
+
+    def count(self, counter, n):
+        pass
+
+    def end_tick(self, start):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+class RollingWindow():
+    '''A fixed-size ring buffer of the most recent values of a series'''
+
+    def __init__(self, size=WINDOW):
+        self.values = numpy.zeros(size)
+        self.n = 0
+
+    def push(self, value):
+        '''Adds a value, overwriting the oldest one once the window is full'''
+        self.values[self.n % len(self.values)] = value
+        self.n += 1
+
+    def recent(self):
+        '''Returns the values currently in the window, in no particular
+        order'''
+        return self.values[:min(self.n, len(self.values))]
+
+    def last(self):
+        '''Returns the most recent value'''
+        return self.values[(self.n - 1) % len(self.values)] if self.n else 0
+
+
+class Profiler():
+    '''A Profiler times the phases of every tick and counts the work done in
+    them. Phases are timed with clock()/add() pairs, which may be reported
+    several times per tick (the durations add up); counters are added up in
+    the same way. end_tick() moves the totals of the tick into the rolling
+    windows'''
+
+    enabled = True
+
+    def __init__(self, window=WINDOW):
+        self.window = window
+        self.phases = {}
+        self.counters = {}
+        self.tick_phases = {}
+        self.tick_counters = {}
+
+    def clock(self):
+        '''Returns the current time, to be handed back to add()'''
+        return time.perf_counter()
+
+    def add(self, phase, start):
+        '''Adds the time since start to the given phase of this tick'''
+        self.add_elapsed(phase, time.perf_counter() - start)
+
+    def add_elapsed(self, phase, elapsed):
+        '''Adds a duration in seconds, measured elsewhere, to the given phase
+        of this tick'''
+        self.tick_phases[phase] = self.tick_phases.get(phase, 0) + elapsed
+
+    def count(self, counter, n):
+        '''Adds n to the given counter of this tick'''
+        self.tick_counters[counter] = self.tick_counters.get(counter, 0) + n
+
+    def end_tick(self, start):
+        '''Records the whole tick, which began at start, and the totals of its
+        phases and counters'''
+        self.add('tick', start)
+        for phase, elapsed in self.tick_phases.items():
+            if phase not in self.phases:
+                self.phases[phase] = RollingWindow(self.window)
+            self.phases[phase].push(elapsed * 1000)
+        for counter, n in self.tick_counters.items():
+            if counter not in self.counters:
+                self.counters[counter] = RollingWindow(self.window)
+            self.counters[counter].push(n)
+        self.tick_phases = {}
+        self.tick_counters = {}
+
+    def summary(self):
+        '''Summarizes every phase (in milliseconds) and counter over the
+        rolling window'''
+        result = {'phases': {}, 'counters': {}}
+        for phase, w in self.phases.items():
+            values = w.recent()
+            result['phases'][phase] = {
+                'last_ms': float(w.last()),
+                'mean_ms': float(values.mean()),
+                'p50_ms': float(numpy.percentile(values, 50)),
+                'p99_ms': float(numpy.percentile(values, 99)),
+                'max_ms': float(values.max()),
+                'histogram': numpy.histogram(values, BUCKETS)[0].tolist()}
+        for counter, w in self.counters.items():
+            values = w.recent()
+            result['counters'][counter] = {'last': float(w.last()),
+                                           'mean': float(values.mean()),
+                                           'max': float(values.max())}
+        return result
+
+    def overlay_lines(self):
+        '''Returns short lines of text describing the last tick and the rolling
+        window, slowest phase first, for drawing on screen'''
+        summary = self.summary()
+        phases = sorted(summary['phases'].items(),
+                        key=lambda item: -item[1]['mean_ms'])
+        lines = ['%-18s %6.2f ms  p99 %6.2f' % (phase, s['mean_ms'],
+                                                s['p99_ms'])
+                 for phase, s in phases]
+        lines.extend('%-18s %8.0f' % (counter, s['mean'])
+                     for counter, s in sorted(summary['counters'].items()))
+        return lines
+
+    def dump(self, path):
+        '''Writes the summary, with the histogram bucket edges, to a JSON
+        file'''
+        summary = self.summary()
+        summary['buckets_ms'] = [str(b) for b in BUCKETS]
+        with open(path, 'w') as f:
+            json.dump(summary, f, indent=2)
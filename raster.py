@@ -0,0 +1,190 @@
+'''Offscreen rendering of a World into NumPy images, without wx. A Rasterizer
+draws the same view as the Renderer - the food, then the other players'
+blobs smallest first, then the user's blobs - into an (height, width, 3)
+uint8 array, and can also draw a downscaled minimap of the whole board.
+
+Each layer (the food, the other blobs, the user's blobs) is drawn with a
+few vectorized writes: every disc is a stamp of pixel offsets for its
+(rounded) radius, cached per radius, and all the discs of the same radius
+are stamped at once, smallest first so larger discs cover smaller ones. The
+food of each tile of the board (see tiles.py) is drawn once and kept until
+the tile changes, so the food layer of a frame is a few array copies.
+
+    rasterizer = Rasterizer()
+    image = rasterizer.frame(world)
+    overview = rasterizer.minimap(world)
+'''
+import numpy
+from gameobject import FRAME_WIDTH, FRAME_HEIGHT
+from palette import PALETTE
+from tiles import TileCache, MAX_TILES
+
+MINIMAP_SIZE = 150
+BACKGROUND = (255, 255, 255)
+
+
+def pack(colors):
+    '''Packs an (n, 3) array of RGB colours into one uint32 per colour, laid
+    out in memory as R, G, B and an unused fourth byte'''
+    rgbx = numpy.zeros((len(colors), 4), dtype=numpy.uint8)
+    rgbx[:, :3] = colors
+    return rgbx.view(numpy.uint32).reshape(len(colors))
+
+
+PALETTE_PACKED = pack(numpy.array(PALETTE, dtype=numpy.uint8))
+BACKGROUND_PACKED = pack(numpy.array([BACKGROUND], dtype=numpy.uint8))[0]
+
+
+class Rasterizer():
+    '''A Rasterizer draws the part of a World around a player into a NumPy
+    image. Images are drawn into RGBX canvases, one uint32 per pixel, and
+    returned as (height, width, 3) views of them; a canvas is reused by the
+    next call of the same size, so copy an image to keep it. The view covers
+    width x height units of the world, and is scaled by scale, e.g. to make
+    small pixel observations. Up to max_tiles images of tiles of food are
+    kept'''
+
+    def __init__(self, width=FRAME_WIDTH, height=FRAME_HEIGHT, scale=1,
+                 max_tiles=MAX_TILES):
+        self.width = width
+        self.height = height
+        self.scale = scale
+        self.tiles = TileCache(self.draw_tile, max_tiles)
+        # radius in pixels -> (dy, dx) offsets of the pixels of a disc
+        self.stamps = {}
+        # (height, width) -> RGBX canvas
+        self.canvases = {}
+
+    def stamp(self, r):
+        '''Returns the pixel offsets of a disc of the given integer radius'''
+        s = self.stamps.get(r)
+        if s is None:
+            dy, dx = numpy.mgrid[-r:r + 1, -r:r + 1]
+            inside = dx * dx + dy * dy <= r * r
+            s = (dy[inside], dx[inside])
+            self.stamps[r] = s
+        return s
+
+    def canvas(self, height, width):
+        '''Returns the blank canvas of the given size and its pixels as a
+        flat uint32 array'''
+        canvas = self.canvases.get((height, width))
+        if canvas is None:
+            canvas = numpy.empty((height, width, 4), dtype=numpy.uint8)
+            self.canvases[(height, width)] = canvas
+        pixels = canvas.view(numpy.uint32).reshape(height * width)
+        pixels.fill(BACKGROUND_PACKED)
+        return canvas, pixels
+
+    def draw_discs(self, pixels, height, width, x, y, r, colors):
+        '''Draws discs (pixel centers x, y and radii r, with a packed colour
+        each) into the flat pixels of a canvas. Smaller discs are drawn first,
+        so larger ones cover them; discs of the same size are all drawn at
+        once'''
+        radii = numpy.rint(r).astype(numpy.intp)
+        cx = numpy.rint(x).astype(numpy.intp)
+        cy = numpy.rint(y).astype(numpy.intp)
+        for radius in numpy.unique(radii).tolist():
+            discs = numpy.flatnonzero(radii == radius)
+            dy, dx = self.stamp(radius)
+            py = cy[discs, None] + dy[None, :]
+            px = cx[discs, None] + dx[None, :]
+            inside = (py >= 0) & (py < height) & (px >= 0) & (px < width)
+            owners = numpy.broadcast_to(discs[:, None], py.shape)[inside]
+            pixels[(py * width + px)[inside]] = colors[owners]
+
+    def frame_shape(self):
+        '''Returns the shape of the images frame returns'''
+        return (int(round(self.height * self.scale)),
+                int(round(self.width * self.scale)), 3)
+
+    def viewport(self, world, player):
+        '''Returns the rectangle of the world that is in view, centered on the
+        player, as (x0, y0, x1, y1)'''
+        px, py = player.get_absolute_position()
+        return (px - self.width / 2, py - self.height / 2,
+                px + self.width / 2, py + self.height / 2)
+
+    def frame(self, world, player=None):
+        '''Draws the view of the given player (the user by default) and
+        returns it as a (height * scale, width * scale, 3) uint8 array'''
+        if player is None:
+            player = world.user
+        scale = self.scale
+        canvas, pixels = self.canvas(*self.frame_shape()[:2])
+        x0, y0, x1, y1 = self.viewport(world, player)
+
+        food = world.food
+        image = pixels.reshape(canvas.shape[:2])
+        for tile in food.tiles_in_rect(x0, y0, x1, y1):
+            tile_image = self.tiles.get(tile, food.tile_version(tile), food)
+            tx0, ty0 = food.tile_rect(tile)[:2]
+            self.blit(image, tile_image, int(round((tx0 - x0) * scale)),
+                      int(round((ty0 - y0) * scale)))
+        others = [b for b in world.blob_index.query_rect(x0, y0, x1, y1)
+                  if b.id_number != player.id_number]
+        self.draw_blobs(canvas, pixels, others, x0, y0, scale)
+        self.draw_blobs(canvas, pixels, list(player.blobs), x0, y0, scale)
+        return canvas[:, :, :3]
+
+    def minimap(self, world, size=MINIMAP_SIZE):
+        '''Draws the whole board scaled down to fit a size x size image, with
+        every pellet and blob, and returns it'''
+        canvas, pixels = self.canvas(size, size)
+        scale = size / max(world.width, world.height)
+        food = world.food
+        self.draw_food(canvas, pixels, food, numpy.flatnonzero(food.alive),
+                       0, 0, scale)
+        self.draw_blobs(canvas, pixels,
+                        [b for p in world.all_players() for b in p.blobs],
+                        0, 0, scale)
+        return canvas[:, :, :3]
+
+    def draw_tile(self, tile, version, food):
+        '''Draws the pellets overlapping a tile into an image of the tile, a
+        2d array of packed pixels'''
+        tx0, ty0, tx1, ty1 = food.tile_rect(tile)
+        height = int(round((ty1 - ty0) * self.scale))
+        width = int(round((tx1 - tx0) * self.scale))
+        image = numpy.full((height, width), BACKGROUND_PACKED,
+                           dtype=numpy.uint32)
+        idx = food.in_tile(tile)
+        self.draw_discs(image.reshape(height * width), height, width,
+                        (food.x[idx] - tx0) * self.scale,
+                        (food.y[idx] - ty0) * self.scale,
+                        food.r[idx] * self.scale,
+                        PALETTE_PACKED[food.color_index[idx]])
+        return image
+
+    def blit(self, image, tile_image, left, top):
+        '''Copies the part of a tile image that falls inside the image, with
+        its top left corner at (left, top) of the image'''
+        height, width = image.shape
+        th, tw = tile_image.shape
+        y0, x0 = max(0, top), max(0, left)
+        y1, x1 = min(height, top + th), min(width, left + tw)
+        if y0 < y1 and x0 < x1:
+            image[y0:y1, x0:x1] = tile_image[y0 - top:y1 - top,
+                                             x0 - left:x1 - left]
+
+    def draw_food(self, canvas, pixels, food, idx, x0, y0, scale):
+        '''Draws the pellets in the slots idx, relative to (x0, y0) of the
+        world and scaled'''
+        self.draw_discs(pixels, canvas.shape[0], canvas.shape[1],
+                        (food.x[idx] - x0) * scale, (food.y[idx] - y0) * scale,
+                        food.r[idx] * scale,
+                        PALETTE_PACKED[food.color_index[idx]])
+
+    def draw_blobs(self, canvas, pixels, blobs, x0, y0, scale):
+        '''Draws the given blobs, relative to (x0, y0) of the world and
+        scaled'''
+        n = len(blobs)
+        if n == 0:
+            return
+        r = numpy.fromiter((b.r for b in blobs), float, n)
+        x = numpy.fromiter((b.x for b in blobs), float, n) + r
+        y = numpy.fromiter((b.y for b in blobs), float, n) + r
+        colors = pack(numpy.array([b.color for b in blobs],
+                                  dtype=numpy.uint8))
+        self.draw_discs(pixels, canvas.shape[0], canvas.shape[1],
+                        (x - x0) * scale, (y - y0) * scale, r * scale, colors)
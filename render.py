@@ -0,0 +1,83 @@
+import numpy
+import wx
+from gameobject import FRAME_WIDTH, FRAME_HEIGHT
+from palette import PALETTE
+from simthread import RenderSnapshot
+from tiles import TileCache
+
+
+class Renderer():
+    '''A Renderer draws the part of a World around the user onto a wx DC.
+    Objects outside the viewport are culled through the world's spatial
+    indices before any per-object work is done, brushes are created once per
+    colour and cached, and everything visible is submitted with a few
+    DrawEllipseList calls, sorted by colour, instead of one DrawEllipse per
+    object. The culling is done by RenderSnapshot.capture, so a snapshot
+    made on another thread can be drawn in the same way. The food of each
+    tile is drawn once into a bitmap, kept until the tile changes, so a
+    frame is a few bitmaps copied into place with the blobs drawn on top'''
+
+    def __init__(self, width=FRAME_WIDTH, height=FRAME_HEIGHT):
+        self.width = width
+        self.height = height
+        self.brushes = {}
+        self.background = wx.Brush(wx.WHITE)
+        self.tiles = TileCache(self.draw_tile)
+
+    def brush(self, color):
+        '''Returns the cached brush for an RGB tuple, creating it if needed'''
+        b = self.brushes.get(color)
+        if b is None:
+            b = wx.Brush(wx.Colour(*color))
+            self.brushes[color] = b
+        return b
+
+    def draw(self, dc, world):
+        '''Draws the view of the user in a world'''
+        self.draw_snapshot(dc, RenderSnapshot.capture(world, self.width,
+                                                      self.height))
+
+    def draw_snapshot(self, dc, snapshot, previous=None, alpha=1):
+        '''Clears the DC and draws the food, then the other players' blobs,
+        then the user's blobs on top. If given the previous snapshot, the
+        view and the blobs are drawn alpha of the way from it to this one'''
+        dc.SetBackgroundMode(wx.SOLID)
+        dc.SetBackground(self.background)
+        dc.Clear()
+        x, y, bx, by, br = snapshot.interpolate(previous, alpha)
+        x0 = x - self.width / 2
+        y0 = y - self.height / 2
+        for food_tile in snapshot.food_tiles:
+            bitmap = self.tiles.get(food_tile.tile, food_tile.version,
+                                    food_tile)
+            tx0, ty0 = food_tile.rect[:2]
+            dc.DrawBitmap(bitmap, int(round(tx0 - x0)), int(round(ty0 - y0)))
+        self.draw_discs(dc, bx - x0, by - y0, br,
+                        [self.brush(c) for c in snapshot.blob_colors])
+
+    def draw_tile(self, tile, version, food_tile):
+        '''Draws the pellets of a FoodTile into a bitmap of the tile'''
+        tx0, ty0, tx1, ty1 = food_tile.rect
+        bitmap = wx.Bitmap(int(tx1 - tx0), int(ty1 - ty0))
+        dc = wx.MemoryDC(bitmap)
+        dc.SetBackground(self.background)
+        dc.Clear()
+        self.draw_discs(dc, food_tile.x - tx0, food_tile.y - ty0, food_tile.r,
+                        # pellets are sorted by colour, so consecutive
+                        # brushes are the same
+                        [self.brush(PALETTE[c])
+                         for c in food_tile.colors.tolist()])
+        dc.SelectObject(wx.NullBitmap)
+        return bitmap
+
+    def draw_discs(self, dc, x, y, r, brushes):
+        '''Draws discs with the given centers and radii, relative to the DC,
+        in a single DrawEllipseList call'''
+        if len(r) == 0:
+            return
+        rects = numpy.empty((len(r), 4))
+        rects[:, 0] = x - r
+        rects[:, 1] = y - r
+        rects[:, 2] = 2 * r
+        rects[:, 3] = 2 * r
+        dc.DrawEllipseList(rects.astype(int).tolist(), brushes=brushes)
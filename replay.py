@@ -0,0 +1,234 @@
+'''Deterministic recording and replay of games.
+
+An InputRecorder attached to a new World writes everything needed to play the
+game again to a log, one JSON object per line. The first line describes the
+world:
+
+    {"version": 3, "seed": seed, "food": pellets, "bots": CPU players,
+     "width": w, "height": h, "cell_size": s, "replan_interval": n,
+     "max_cells": n, "lod_interval": n, "user": true,
+     "rules": {"speed": 20, "eat_ratio": 0.75, ...}}
+
+and every tick after that adds a line with its length, the user's input, the
+input of the other human players, the players who joined or left before the
+tick and a hash of the state of the world after it:
+
+    {"dt": 0.05, "u": [dx, dy, split], "i": {"id": [dx, dy, split], ...},
+     "e": [["join", id], ["leave", id], ...], "h": "hash"}
+
+Every random number a world uses comes from its seeded streams and all its
+time-dependent rules read its simulation clock, so stepping a world built
+from the first line with the recorded input reproduces the game exactly.
+Replaying runs headless and as fast as the machine allows, checking the hash
+after every tick to catch the first tick where the replay diverges:
+
+    python server.py --record session.log
+    python replay.py session.log --profile profile.json
+
+With --frames, the user's view is rasterized every few ticks of the replay
+and the frames are stored as a (frames, height, width, 3) uint8 array in a
+.npy file.
+'''
+import argparse
+import hashlib
+import json
+import sys
+import time
+import numpy
+from world import World, UserInput
+from rules import Rules
+from splitmerge import MAX_CELLS
+from profiler import Profiler
+from raster import Rasterizer
+
+LOG_VERSION = 3
+
+
+class ReplayError(Exception):
+    '''Raised for a log that cannot be replayed, or a replay that does not
+    match its recording'''
+    pass
+
+
+def state_hash(world):
+    '''Returns a short hash of the state of a world: its clock, its food and
+    the position, size and owner of every blob'''
+    h = hashlib.blake2b(digest_size=8)
+    food = world.food
+    h.update(numpy.array([world.clock.ticks, len(food)], dtype='<i8'))
+    h.update(food.x.astype('<f8'))
+    h.update(food.y.astype('<f8'))
+    h.update(food.alive.astype(numpy.uint8))
+    blobs = sorted(((b.uid, p.id_number, b.x, b.y, b.r)
+                    for p in world.all_players() for b in p.blobs))
+    h.update(numpy.array(blobs, dtype='<f8').tobytes())
+    return h.hexdigest()
+
+
+def encode_input(user_input):
+    '''Turns a UserInput into a JSON list, or None'''
+    if user_input is None:
+        return None
+    dx, dy = user_input.direction
+    return [dx, dy, int(bool(user_input.split))]
+
+
+def decode_input(data):
+    '''Turns a JSON list back into a UserInput, or None'''
+    if data is None:
+        return None
+    dx, dy, split = data
+    return UserInput((dx, dy), bool(split))
+
+
+class InputRecorder():
+    '''An InputRecorder logs the input of every tick of a world to a file,
+    along with the players that join and leave and a hash of the state after
+    each tick. It must be attached to a world before it is first stepped'''
+
+    def __init__(self, world, path):
+        if world.clock.ticks != 0 or world.humans:
+            raise ReplayError('a recording must start with a new world')
+        self.file = open(path, 'w')
+        self.events = []
+        self.ticks = 0
+        self.write({'version': LOG_VERSION, 'seed': world.seed,
+                    'food': world.food.capacity,
+                    'bots': len(world.other_players),
+                    'width': world.width, 'height': world.height,
+                    'cell_size': world.food.index.cell_size,
+                    'replan_interval': world.planner.interval,
+                    'max_cells': world.max_cells,
+                    'lod_interval': world.lod_interval,
+                    'user': world.user is not None,
+                    'rules': world.rules._asdict()})
+        world.recorder = self
+
+    def write(self, data):
+        self.file.write(json.dumps(data, separators=(',', ':')) + '\n')
+
+    def event(self, kind, id_number):
+        '''Records a player joining or leaving before the next tick'''
+        self.events.append([kind, id_number])
+
+    def tick(self, world, dt, user_input, inputs):
+        '''Records a tick that the world has just finished'''
+        line = {'dt': dt, 'u': encode_input(user_input),
+                'h': state_hash(world)}
+        if inputs:
+            line['i'] = {str(k): encode_input(v) for k, v in inputs.items()}
+        if self.events:
+            line['e'] = self.events
+            self.events = []
+        self.write(line)
+        self.ticks += 1
+
+    def close(self):
+        '''Flushes and closes the log'''
+        self.file.close()
+
+
+def read_log(path):
+    '''Returns the description of the world and a list of the ticks in a
+    log'''
+    with open(path) as f:
+        lines = [json.loads(line) for line in f if line.strip()]
+    if not lines or lines[0].get('version') != LOG_VERSION:
+        raise ReplayError('not a replay log this version can read')
+    return lines[0], lines[1:]
+
+
+def build_world(header):
+    '''Builds the world a log was recorded from'''
+    return World(header['food'], header['bots'], header['width'],
+                 header['height'], header['cell_size'],
+                 header['replan_interval'], header['seed'],
+                 header.get('max_cells', MAX_CELLS),
+                 header.get('lod_interval', 1),
+                 user=header.get('user', True),
+                 rules=Rules(**header.get('rules', {})))
+
+
+def replay(path, profiler=None, check=True, on_tick=None):
+    '''Plays a log back on a new world, as fast as possible, and returns the
+    world. If check is true, the state of the world is compared with the
+    recording after every tick and a ReplayError names the first tick that
+    differs. on_tick, if given, is called with the tick number and the world
+    after every tick'''
+    header, ticks = read_log(path)
+    world = build_world(header)
+    if profiler is not None:
+        world.profiler = profiler
+    for i, line in enumerate(ticks):
+        for kind, id_number in line.get('e', []):
+            if kind == 'join':
+                if world.add_human() != id_number:
+                    raise ReplayError('tick %d: player %d joined with '
+                                      'another id' % (i, id_number))
+            else:
+                world.remove_human(id_number)
+        inputs = {int(k): decode_input(v)
+                  for k, v in line.get('i', {}).items()}
+        world.step(line['dt'], decode_input(line['u']), inputs)
+        if check and state_hash(world) != line['h']:
+            raise ReplayError('tick %d: replay diverged from the recording'
+                              % i)
+        if on_tick is not None:
+            on_tick(i, world)
+    return world
+
+
+class FrameWriter():
+    '''Rasterizes the user's view every few ticks into a .npy file'''
+
+    def __init__(self, path, ticks, every=1):
+        self.rasterizer = Rasterizer()
+        self.every = every
+        shape = ((ticks + every - 1) // every,) + \
+            self.rasterizer.frame_shape()
+        self.frames = numpy.lib.format.open_memmap(path, mode='w+',
+                                                   dtype=numpy.uint8,
+                                                   shape=shape)
+
+    def __call__(self, tick, world):
+        if tick % self.every == 0:
+            self.frames[tick // self.every] = self.rasterizer.frame(world)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replays a recorded game')
+    parser.add_argument('log')
+    parser.add_argument('--no-check', action='store_true',
+                        help='do not compare the state hashes')
+    parser.add_argument('--profile', metavar='FILE',
+                        help='profile the replay and dump the results here')
+    parser.add_argument('--frames', metavar='FILE',
+                        help='save the user\'s view to this .npy file')
+    parser.add_argument('--frame-every', type=int, default=1,
+                        help='ticks between two saved frames')
+    args = parser.parse_args(argv)
+    profiler = Profiler() if args.profile else None
+    on_tick = None
+    if args.frames:
+        header, ticks = read_log(args.log)
+        if not header.get('user', True):
+            parser.error('--frames needs a game with a user')
+        on_tick = FrameWriter(args.frames, len(ticks), args.frame_every)
+    start = time.perf_counter()
+    try:
+        world = replay(args.log, profiler, not args.no_check, on_tick)
+    except ReplayError as e:
+        print(e, file=sys.stderr)
+        return 1
+    elapsed = time.perf_counter() - start
+    ticks = world.clock.ticks
+    print(json.dumps({'ticks': ticks, 'seconds': elapsed,
+                      'ticks_per_sec': ticks / elapsed if elapsed else 0,
+                      'simulated_seconds': world.clock.time}))
+    if profiler is not None:
+        profiler.dump(args.profile)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,35 @@
+'''The constants that decide how the game plays, gathered in one place so
+they can be changed per world - for example to try out different balance
+settings side by side with sweep.py. A World takes a Rules and hands it to
+everything that needs it; the defaults are the game as it has always been
+played.
+
+    rules = Rules(eat_ratio=0.8, sight=400)
+    world = World(seed=1, rules=rules)
+'''
+from collections import namedtuple
+
+# the speed of a blob of radius r is SPEED * r ** SPEED_EXPONENT
+SPEED = 20
+SPEED_EXPONENT = -0.439
+# a blob that has just been shot out starts SHOOT_BOOST times faster and
+# slows down to its usual speed over SHOOT_TIME seconds
+SHOOT_BOOST = 5
+SHOOT_TIME = 2
+# a blob can only eat another blob that is less than EAT_RATIO of its radius
+EAT_RATIO = 0.75
+# the seconds before the blobs of a split player can merge again are
+# RECOVERY_TIME + RECOVERY_PER_MASS * the sum of their radii
+RECOVERY_TIME = 30
+RECOVERY_PER_MASS = 0.02
+# how far the CPU players can see
+SIGHT = 300
+
+Rules = namedtuple('Rules', ['speed', 'speed_exponent', 'shoot_boost',
+                             'shoot_time', 'eat_ratio', 'recovery_time',
+                             'recovery_per_mass', 'sight'],
+                   defaults=[SPEED, SPEED_EXPONENT, SHOOT_BOOST, SHOOT_TIME,
+                             EAT_RATIO, RECOVERY_TIME, RECOVERY_PER_MASS,
+                             SIGHT])
+
+DEFAULT_RULES = Rules()
@@ -0,0 +1,52 @@
+'''Fixed-timestep scheduling. Blobs move a fixed distance per step, so the
+speed of the game depends only on how many steps are run per second of wall
+time. A FixedStep keeps an accumulator of the wall time that has passed and
+hands it out as whole steps of dt, so the game runs at the same speed however
+late the thread that runs it wakes up:
+
+    scheduler = FixedStep(0.05)
+    while running:
+        for _ in range(scheduler.due()):
+            world.step(scheduler.dt)
+        sleep(scheduler.until_next())
+
+When the steps take longer than dt to run, at most max_steps are run per
+call and the rest of the time that has built up is dropped, so the game
+slows down for as long as it cannot keep up and recovers as soon as it can,
+instead of falling further and further behind'''
+import time
+
+# the most steps run at once to catch up after falling behind
+MAX_CATCH_UP = 5
+
+
+class FixedStep():
+    '''Turns the wall time that passes into a number of fixed steps'''
+
+    def __init__(self, dt, max_steps=MAX_CATCH_UP, clock=time.perf_counter):
+        self.dt = dt
+        self.max_steps = max_steps
+        self.clock = clock
+        self.last = clock()
+        # wall time not yet handed out as steps
+        self.accumulator = 0.0
+        # the number of steps dropped because the game could not keep up
+        self.dropped = 0
+
+    def due(self):
+        '''Returns the number of steps to run now to catch up with the wall
+        clock, at most max_steps'''
+        now = self.clock()
+        self.accumulator += now - self.last
+        self.last = now
+        steps = int(self.accumulator // self.dt)
+        self.accumulator -= steps * self.dt
+        if steps > self.max_steps:
+            self.dropped += steps - self.max_steps
+            steps = self.max_steps
+        return steps
+
+    def until_next(self):
+        '''Returns the wall time until the next step is due, in seconds'''
+        waited = self.accumulator + self.clock() - self.last
+        return max(0.0, self.dt - waited)
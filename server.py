@@ -0,0 +1,248 @@
+'''An authoritative multiplayer server. The server owns a single World and
+steps it at a fixed tick rate; clients connect over TCP and only send their
+input, one JSON object per line:
+
+    {"d": [dx, dy], "s": 1}
+
+where d is the direction to move in (it is normalized by the server) and s,
+if present and true, splits the player on the next tick. After every tick
+each client is sent one JSON line describing what changed inside its
+viewport (SIGHT units around the center of its player) since the last
+snapshot it was sent:
+
+    {"t": tick, "id": player id, "c": [x, y],
+     "f": [[slot, x, y, r, color index], ...],  pellets that came into view
+     "fr": [slot, ...],                          pellets that left view
+     "b": [[uid, x, y, r, owner, [r, g, b]], ...], blobs that came into view
+     "bu": [[uid, x, y, r], ...],                  blobs that moved or grew
+     "br": [uid, ...]}                             blobs that left view
+
+Positions are the centers of the objects, rounded to whole units. Clients
+whose sockets are not keeping up have snapshots skipped rather than queued;
+since snapshots are deltas against what was last sent, nothing is lost.
+
+    python server.py --port 8765 --tick-rate 20
+
+With --record, every tick's input is logged so the game can be replayed
+offline with replay.py. With --events, every eat, split, merge and spawn is
+streamed to an event log (see events.py).
+'''
+import argparse
+import asyncio
+import json
+import math
+import numpy
+from gameobject import GameObject, GAME_WIDTH
+from world import World, UserInput, FOOD_COUNT, OTHER_PLAYERS
+from rules import SIGHT
+from replay import InputRecorder
+from events import EventBus, EventWriter
+
+HOST = '127.0.0.1'
+PORT = 8765
+TICK_RATE = 20
+# a client with more than this many bytes waiting to be sent skips snapshots
+WRITE_LIMIT = 256 * 1024
+# the longest line of input a client may send
+MAX_LINE = 4096
+
+
+class Client():
+    '''A connected player: its socket, its latest input and what it was last
+    sent'''
+
+    def __init__(self, id_number, writer):
+        self.id_number = id_number
+        self.writer = writer
+        self.direction = (0, 0)
+        self.split = False
+        # the sorted slots and positions of the pellets the client has
+        self.food_slots = numpy.zeros(0, dtype=numpy.intp)
+        self.food_x = numpy.zeros(0, dtype=int)
+        self.food_y = numpy.zeros(0, dtype=int)
+        # uid -> (x, y, r) of the blobs the client has
+        self.blobs = {}
+
+    def user_input(self):
+        '''Returns the client's input for this tick. A split only happens
+        once per request'''
+        result = UserInput(self.direction, self.split)
+        self.split = False
+        return result
+
+
+class GameServer():
+    '''A GameServer steps a World at a fixed rate and streams interest-managed
+    snapshots of it to every connected client'''
+
+    def __init__(self, world=None, tick_rate=TICK_RATE, sight=SIGHT):
+        self.world = world if world is not None else World(user=False)
+        self.dt = 1 / tick_rate
+        self.sight = sight
+        self.clients = {}
+        self.ticks = 0
+        self.skipped = 0
+
+    async def serve(self, host=HOST, port=PORT):
+        '''Accepts clients on the given address and runs the world until
+        cancelled'''
+        server = await asyncio.start_server(self.handle_client, host, port,
+                                            limit=MAX_LINE)
+        async with server:
+            await self.run()
+
+    async def run(self):
+        '''Ticks the world at a fixed rate. If a tick runs late, the next one
+        is scheduled from now rather than trying to catch up'''
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while True:
+            self.tick()
+            next_tick += self.dt
+            delay = next_tick - loop.time()
+            if delay < 0:
+                next_tick = loop.time()
+                delay = 0
+            await asyncio.sleep(delay)
+
+    def tick(self):
+        '''Steps the world with every client's input and sends out the
+        snapshots'''
+        inputs = {c.id_number: c.user_input() for c in self.clients.values()}
+        self.world.step(self.dt, inputs=inputs)
+        self.ticks += 1
+        for client in list(self.clients.values()):
+            if client.writer.transport.get_write_buffer_size() > WRITE_LIMIT:
+                self.skipped += 1
+                continue
+            message = self.snapshot(client)
+            client.writer.write(json.dumps(message, separators=(',', ':'))
+                                .encode() + b'\n')
+
+    def snapshot(self, client):
+        '''Builds the delta between what the client has and what is now in its
+        viewport, and records the viewport as what the client has'''
+        world = self.world
+        player = world.playerIds[client.id_number]
+        cx, cy = player.center.get_absolute_position()
+        x0, y0 = cx - self.sight, cy - self.sight
+        x1, y1 = cx + self.sight, cy + self.sight
+        message = {'t': self.ticks, 'id': client.id_number,
+                   'c': [round(cx), round(cy)]}
+
+        food = world.food
+        idx = numpy.sort(food.in_rect(x0, y0, x1, y1))
+        xs = food.x[idx].round().astype(int)
+        ys = food.y[idx].round().astype(int)
+        # pellets the client does not have, or has at an old position (the
+        # slot was eaten and respawned in view since)
+        _, new_at, old_at = numpy.intersect1d(idx, client.food_slots,
+                                              assume_unique=True,
+                                              return_indices=True)
+        added = numpy.ones(len(idx), dtype=bool)
+        added[new_at] = ((xs[new_at] != client.food_x[old_at]) |
+                         (ys[new_at] != client.food_y[old_at]))
+        removed = numpy.ones(len(client.food_slots), dtype=bool)
+        removed[old_at] = False
+        message['f'] = numpy.column_stack(
+            (idx[added], xs[added], ys[added],
+             food.r[idx[added]].round().astype(int),
+             food.color_index[idx[added]])).tolist()
+        message['fr'] = client.food_slots[removed].tolist()
+        client.food_slots, client.food_x, client.food_y = idx, xs, ys
+
+        seen = {}
+        added = []
+        updated = []
+        for b in world.blob_index.query_rect(x0, y0, x1, y1):
+            bx, by = b.get_absolute_position()
+            state = (round(bx), round(by), round(b.r))
+            seen[b.uid] = state
+            before = client.blobs.get(b.uid)
+            if before is None:
+                added.append([b.uid, state[0], state[1], state[2],
+                              b.id_number, list(b.color)])
+            elif before != state:
+                updated.append([b.uid, state[0], state[1], state[2]])
+        message['b'] = added
+        message['bu'] = updated
+        message['br'] = [uid for uid in client.blobs if uid not in seen]
+        client.blobs = seen
+        return message
+
+    async def handle_client(self, reader, writer):
+        '''Adds a player for a new connection, reads its input until it
+        disconnects and then removes the player'''
+        client = Client(self.world.add_human(), writer)
+        self.clients[client.id_number] = client
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    self.apply_input(client, json.loads(line))
+                except (ValueError, TypeError, KeyError):
+                    # ignore malformed input rather than dropping the client
+                    continue
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            del self.clients[client.id_number]
+            self.world.remove_human(client.id_number)
+            writer.close()
+
+    def apply_input(self, client, data):
+        '''Records a client's input, to be applied on the next tick. Raises
+        ValueError (or TypeError) for input that is not a JSON object with a
+        finite direction, which never reaches the world'''
+        if not isinstance(data, dict):
+            raise ValueError('input must be a JSON object')
+        if 'd' in data:
+            dx, dy = data['d']
+            dx, dy = float(dx), float(dy)
+            if not (math.isfinite(dx) and math.isfinite(dy)):
+                raise ValueError('direction must be finite')
+            # scaled to at most 1 first, so squaring a huge component
+            # cannot overflow and a tiny one does not underflow to nothing
+            scale = max(abs(dx), abs(dy))
+            if scale > 0:
+                dx, dy = dx / scale, dy / scale
+            client.direction = GameObject.normalize((dx, dy))
+        if data.get('s'):
+            client.split = True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Runs the game server')
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--tick-rate', type=float, default=TICK_RATE)
+    parser.add_argument('--food', type=int, default=FOOD_COUNT)
+    parser.add_argument('--bots', type=int, default=OTHER_PLAYERS)
+    parser.add_argument('--size', type=int, default=GAME_WIDTH,
+                        help='width and height of the world')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--record', metavar='LOG',
+                        help='record the game so it can be replayed')
+    parser.add_argument('--events', metavar='LOG',
+                        help='log the events of the game')
+    args = parser.parse_args(argv)
+    world = World(args.food, args.bots, args.size, args.size,
+                  seed=args.seed, user=False)
+    recorder = InputRecorder(world, args.record) if args.record else None
+    if args.events:
+        world.events = EventBus(EventWriter(args.events))
+    server = GameServer(world, args.tick_rate)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if recorder is not None:
+            recorder.close()
+        world.events.close()
+
+
+if __name__ == '__main__':
+    main()
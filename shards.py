@@ -0,0 +1,575 @@
+'''A world too large for one core, split into a grid of regions (shards) that
+are simulated by separate worker processes:
+
+    world = ShardedWorld(columns=2, rows=2, seed=0)
+    id_number = world.add_human()
+    world.step(0.05, {id_number: UserInput((1, 0), False)})
+    world.close()
+
+Every shard is a World of the size of the whole board that only holds the
+players whose centers are in its region and the pellets that belong to it;
+all of a player's blobs live in the shard of its center. Each tick takes two
+rounds between the coordinator and the shards, which run in parallel:
+
+1. Every shard adopts the players handed over to it, steps its world - the
+   usual moves, food and collisions between its own blobs - and reports its
+   border blobs: those within the seam band of the edge of its region, and
+   any that have strayed outside it.
+2. The coordinator resolves eating between the border blobs of different
+   shards with the same rules as World.handle_player_collisions, and tells
+   every shard which of its blobs were eaten or grew, and which blobs of the
+   others are near it. Each shard applies the eats, lets those ghost copies
+   of foreign blobs eat its own pellets (the mass is credited to their owners
+   at the start of the next tick), and hands off the players whose centers
+   have left its region.
+
+Every eat across a seam is decided once, by the coordinator, from the state
+of both blobs after the same tick, so the two shards always agree on it. The
+ghosts also let the CPU players near a seam see the blobs on the other side
+of it, and count as viewers for the level of detail of the CPU players.
+
+The seam band is recomputed every tick from the largest blob and the
+furthest any blob has spread from the center of its player, so no pair of
+blobs that could eat each other is ever missed. Shards only talk through the
+coordinator, and each of them draws from random streams seeded from the seed
+and its position in the grid, so a sharded game is as reproducible as a
+World; with processes=False the shards run one after the other in this
+process, which is slower but plays out exactly the same.
+
+    python shards.py --grid 2x2 --ticks 200
+'''
+import argparse
+import json
+import math
+import multiprocessing
+import random
+import sys
+import time
+import numpy
+from gameobject import GameObject, GAME_WIDTH, GAME_HEIGHT
+from world import World, create_player, food_generator, FOOD_COUNT, \
+    OTHER_PLAYERS, INITIAL_RADIUS
+from player import Player
+from blob import BlobPool
+from spatial import SpatialHash, CELL_SIZE
+from rules import DEFAULT_RULES
+from events import FOOD
+
+# how far past the seam band a blob can move in one tick, including the
+# longer steps of the CPU players that are simulated at a lower rate
+SEAM_SLACK = 100
+# a border blob: its uid, the id of its player, its center, radius and
+# colour, whether its player is human and the shard that owns it
+BORDER_DTYPE = numpy.dtype([('uid', '<i8'), ('owner', '<i8'),
+                            ('x', '<f8'), ('y', '<f8'), ('r', '<f8'),
+                            ('color', 'u1', 3), ('human', '?'),
+                            ('shard', '<i4')])
+
+
+def shard_of(x, y, columns, rows, width, height):
+    '''Returns the index of the shard whose region contains the point'''
+    col = min(max(int(x * columns // width), 0), columns - 1)
+    row = min(max(int(y * rows // height), 0), rows - 1)
+    return row * columns + col
+
+
+def region_of(index, columns, rows, width, height):
+    '''Returns the region of a shard as (x0, y0, x1, y1)'''
+    row, col = divmod(index, columns)
+    return (width * col / columns, height * row / rows,
+            width * (col + 1) / columns, height * (row + 1) / rows)
+
+
+def pack_player(player, human):
+    '''Turns a player into plain data that can be sent to another shard'''
+    blobs = list(player.blobs)
+    return (player.id_number, human, player.size, player.time,
+            player.shoot_time, player.has_recovered, player.r,
+            blobs.index(player.center),
+            [(b.uid, b.x, b.y, b.r, b.color, b.shoot, b.time, b.recover,
+              b.init_direction, b.merge_time) for b in blobs])
+
+
+class Ghost():
+    '''A read-only copy of the border blobs of a player owned by another
+    shard. The CPU players can see it, but it cannot be touched'''
+
+    __slots__ = ('id_number', 'human', 'blobs')
+
+    def __init__(self, id_number, human):
+        self.id_number = id_number
+        self.human = human
+        self.blobs = []
+
+    def get_absolute_position(self):
+        '''Returns the center of the largest of the blobs'''
+        return max(self.blobs, key=lambda b: b.r).get_absolute_position()
+
+
+class ShardWorld(World):
+    '''The World of one shard: a board of the full size, with the food and
+    players of one region of it. Players and food are created inside the
+    region, the uids of blobs are unique among all the shards, and the
+    shard trades border blobs, eats and players with the coordinator'''
+
+    def __init__(self, index, columns, rows, food_count, bots, first_id,
+                 width, height, seed, **world_args):
+        self.index = index
+        self.grid = (columns, rows, width, height)
+        self.region = region_of(index, columns, rows, width, height)
+        super(ShardWorld, self).__init__(food_count, 0, width, height,
+                                         seed=seed, user=False, **world_args)
+        self.blob_pool = BlobPool(index, columns * rows, self.rules)
+        for i in range(bots):
+            self.spawn_CPU(first_id + i)
+
+    def food_source(self, start=0):
+        '''Returns a generator of pellets spread over the region'''
+        x0, y0, x1, y1 = self.region
+        for x, y, r, color_index in food_generator(x1 - x0, y1 - y0, start,
+                                                   self.rng.food):
+            yield (x + x0, y + y0, r, color_index)
+
+    def new_player(self, radius, id_number):
+        '''Returns a new player somewhere in the region'''
+        x0, y0, x1, y1 = self.region
+        player = create_player(radius, id_number, self.clock, x1 - x0,
+                               y1 - y0, self.blob_pool, self.rng.players,
+                               self.max_cells)
+        for b in player.blobs:
+            b.x += x0
+            b.y += y0
+        return player
+
+    def blobs_by_uid(self):
+        '''Returns a dictionary of every blob in the shard by uid'''
+        return {b.uid: b for p in self.all_players() for b in p.blobs}
+
+    def adopt(self, data):
+        '''Adds a player handed off by another shard'''
+        (id_number, human, size, time, shoot_time, has_recovered, r, center,
+         blobs) = data
+        built = []
+        for (uid, x, y, br, color, shoot, btime, recover, init_direction,
+             merge_time) in blobs:
+            b = self.blob_pool.acquire(x, y, br, color, shoot, id_number,
+                                       init_direction, self.clock)
+            b.uid = uid
+            b.time = btime
+            b.recover = recover
+            b.merge_time = merge_time
+            built.append(b)
+        player = Player.restore(built, built[center], self.clock,
+                                self.blob_pool, id_number, size, time,
+                                shoot_time, has_recovered, r, self.max_cells)
+        self.index_player(player)
+        self.playerIds[id_number] = player
+        if human:
+            self.humans[id_number] = player
+        else:
+            self.other_players.append(player)
+
+    def advance(self, dt, inputs, arrivals, credits, events, band):
+        '''The first round of a tick: adopts the players handed over, adds
+        the mass this shard's blobs ate elsewhere, lets human players join
+        and leave, steps the world and returns its border blobs, the largest
+        radius and the furthest any blob is from the center of its player'''
+        for data in arrivals:
+            self.adopt(data)
+        if credits:
+            blobs = self.blobs_by_uid()
+            for uid, n, area in credits:
+                # a blob that merged or was eaten since has lost the mass
+                if uid in blobs:
+                    b = blobs[uid]
+                    x, y = b.get_absolute_position()
+                    self.events.emit(FOOD, b.id_number, b.uid, n, x=x, y=y,
+                                     value=area)
+                    self.playerIds[b.id_number].grow_blob(b, area)
+                    x, y = b.get_absolute_position()
+                    self.blob_index.update(b, x, y, b.r)
+        for kind, id_number in events:
+            if kind == 'join':
+                self.add_human(id_number)
+            else:
+                self.remove_human(id_number)
+        self.step(dt, None, inputs)
+        return self.border(band)
+
+    def border(self, band):
+        '''Returns the blobs within band of the edge of the region or outside
+        it, as a BORDER_DTYPE array, with the largest radius in the shard and
+        the furthest any blob is from the center of its player'''
+        x0, y0, x1, y1 = self.region
+        blobs = list(self.blob_index.entries.items())
+        n = len(blobs)
+        spread = 0.0
+        for p in self.all_players():
+            if len(p.blobs) > 1:
+                cx, cy = p.get_absolute_position()
+                spread = max(spread, max(math.hypot(b.x + b.r - cx,
+                                                    b.y + b.r - cy)
+                                         for b in p.blobs))
+        if n == 0:
+            return numpy.zeros(0, BORDER_DTYPE), 0.0, spread
+        x = numpy.fromiter((e[0] for _, e in blobs), float, n)
+        y = numpy.fromiter((e[1] for _, e in blobs), float, n)
+        r = numpy.fromiter((e[2] for _, e in blobs), float, n)
+        near = ((x - r < x0 + band) | (x + r > x1 - band) |
+                (y - r < y0 + band) | (y + r > y1 - band))
+        rows = numpy.flatnonzero(near)
+        out = numpy.zeros(len(rows), BORDER_DTYPE)
+        if len(rows) == 0:
+            return out, float(r.max()), spread
+        picked = [blobs[i][0] for i in rows.tolist()]
+        out['uid'] = [b.uid for b in picked]
+        out['owner'] = [b.id_number for b in picked]
+        out['x'] = x[rows]
+        out['y'] = y[rows]
+        out['r'] = r[rows]
+        out['color'] = [b.color for b in picked]
+        out['human'] = [b.id_number in self.humans for b in picked]
+        out['shard'] = self.index
+        return out, float(r.max()), spread
+
+    def resolve(self, eaten, grown, ghosts):
+        '''The second round of a tick: applies the eats across seams decided
+        by the coordinator, keeps the ghosts of the other shards' blobs, lets
+        them eat this shard's pellets and returns what they ate, as (player
+        id, uid, pellets, area), and the players that have left the region,
+        packed for their new shards'''
+        blobs = self.blobs_by_uid()
+        for uid, area in grown:
+            b = blobs[uid]
+            self.playerIds[b.id_number].grow_blob(b, area)
+            x, y = b.get_absolute_position()
+            self.blob_index.update(b, x, y, b.r)
+        for uid in eaten:
+            self.lose_blob(blobs[uid])
+
+        self.ghosts = []
+        by_owner = {}
+        eaters = []
+        found = []
+        x0, y0, x1, y1 = self.region
+        for uid, owner, x, y, r, color, human, _ in ghosts.tolist():
+            ghost = by_owner.get(owner)
+            if ghost is None:
+                ghost = by_owner[owner] = Ghost(owner, human)
+                self.ghosts.append(ghost)
+            ghost.blobs.append(GameObject(x - r, y - r, r, tuple(color),
+                                          False))
+            if x + r < x0 or x - r > x1 or y + r < y0 or y - r > y1:
+                continue
+            eaters.append((owner, uid, r))
+            found.append(self.food.overlapping(x, y, r))
+        # the ghosts eat as the blobs of a world do: all at once, contested
+        # pellets going to the largest, respawned only once all are gone
+        slots, counts, areas = self.award_food(
+            found, [(-r, uid) for _, uid, r in eaters])
+        credits = [(owner, uid, n, area)
+                   for (owner, uid, _), n, area in zip(eaters, counts, areas)
+                   if n]
+        if len(slots):
+            self.replace_food(slots)
+        return credits, self.hand_off()
+
+    def lose_blob(self, blob):
+        '''Takes a blob eaten by a blob of another shard out of the world,
+        respawning its player if it was the last one, as in eat_blob'''
+        self.blob_index.remove(blob)
+        self.dead_blobs.append(blob)
+        player = self.playerIds[blob.id_number]
+        player.remove_blob(blob)
+        if len(player.blobs) == 0:
+            if player.id_number in self.humans:
+                self.restart_human(player.id_number)
+            else:
+                self.respawn_player(player)
+
+    def hand_off(self):
+        '''Takes the players whose centers have left the region out of the
+        world and returns them as (shard index, packed player) pairs'''
+        leaving = []
+        for player in self.all_players():
+            x, y = player.get_absolute_position()
+            index = shard_of(x, y, *self.grid)
+            if index == self.index:
+                continue
+            human = player.id_number in self.humans
+            leaving.append((index, pack_player(player, human)))
+            for b in player.blobs:
+                self.blob_index.remove(b)
+            del self.playerIds[player.id_number]
+            if human:
+                del self.humans[player.id_number]
+            else:
+                self.other_players.remove(player)
+        return leaving
+
+    def blob_records(self):
+        '''Returns every blob in the shard as a BORDER_DTYPE array'''
+        return self.border(math.inf)[0]
+
+
+def run_command(shard, message):
+    '''Runs a command sent by the coordinator on a shard'''
+    command, args = message
+    if command == 'advance':
+        return shard.advance(*args)
+    elif command == 'resolve':
+        return shard.resolve(*args)
+    elif command == 'blobs':
+        return shard.blob_records()
+    raise ValueError('unknown command %r' % command)
+
+
+def _worker(conn, args, world_args):
+    '''Runs a shard in a worker process, answering the commands sent down
+    the pipe'''
+    shard = ShardWorld(*args, **world_args)
+    while True:
+        message = conn.recv()
+        if message[0] == 'close':
+            conn.close()
+            return
+        conn.send(run_command(shard, message))
+
+
+class LocalShard():
+    '''A shard run in this process, behind the same send and recv as the
+    pipe to a worker process'''
+
+    def __init__(self, args, world_args):
+        self.shard = ShardWorld(*args, **world_args)
+        self.result = None
+
+    def send(self, message):
+        if message[0] != 'close':
+            self.result = run_command(self.shard, message)
+
+    def recv(self):
+        return self.result
+
+    def close(self):
+        pass
+
+
+class ShardedWorld():
+    '''A board of columns x rows regions, each simulated by its own shard.
+    The coordinator keeps track of which shard owns each player, routes the
+    input of the human players to them and resolves what happens at the
+    seams. The food and CPU players are spread evenly over the shards, and
+    any other keyword arguments are passed on to each shard's World'''
+
+    def __init__(self, columns=2, rows=2, food_count=None, other_players=None,
+                 width=None, height=None, seed=None, processes=True,
+                 **world_args):
+        count = columns * rows
+        if food_count is None:
+            food_count = FOOD_COUNT * count
+        if other_players is None:
+            other_players = OTHER_PLAYERS * count
+        if width is None:
+            width = GAME_WIDTH * columns
+        if height is None:
+            height = GAME_HEIGHT * rows
+        if seed is None:
+            seed = random.getrandbits(32)
+        self.seed = seed
+        self.grid = (columns, rows, width, height)
+        self.cell_size = world_args.get('cell_size', CELL_SIZE)
+        self.rules = world_args.get('rules', DEFAULT_RULES)
+        self.count = count
+        self.ticks = 0
+        self.shards = []
+        self.processes = []
+        # player id -> index of the shard that owns it
+        self.owners = {}
+        first_id = 0
+        for i in range(count):
+            food = food_count // count + (i < food_count % count)
+            bots = other_players // count + (i < other_players % count)
+            for id_number in range(first_id, first_id + bots):
+                self.owners[id_number] = i
+            args = (i, columns, rows, food, bots, first_id, width, height,
+                    seed * count + i)
+            first_id += bots
+            if processes:
+                parent, child = multiprocessing.Pipe()
+                process = multiprocessing.Process(
+                    target=_worker, args=(child, args, world_args),
+                    daemon=True)
+                process.start()
+                child.close()
+                self.shards.append(parent)
+                self.processes.append(process)
+            else:
+                self.shards.append(LocalShard(args, world_args))
+        self.next_id = first_id
+        self.band = self.rules.sight + INITIAL_RADIUS * 10 + SEAM_SLACK
+        # what each shard is sent with its next advance
+        self.arrivals = [[] for _ in range(count)]
+        self.credits = [[] for _ in range(count)]
+        self.events = [[] for _ in range(count)]
+        # the cross-shard eats of the last tick, for profiling
+        self.seam_eats = 0
+
+    def add_human(self):
+        '''Adds a human player on the next tick, in a random shard, and
+        returns its id'''
+        id_number = self.next_id
+        self.next_id += 1
+        index = random.Random(self.seed + id_number).randrange(self.count)
+        self.owners[id_number] = index
+        self.events[index].append(('join', id_number))
+        return id_number
+
+    def remove_human(self, id_number):
+        '''Takes a human player out on the next tick'''
+        index = self.owners.pop(id_number)
+        self.events[index].append(('leave', id_number))
+
+    def step(self, dt, inputs=None):
+        '''Advances every shard by a tick of dt seconds, with the inputs of
+        the human players (id -> UserInput)'''
+        inputs = inputs or {}
+        split = [{} for _ in range(self.count)]
+        for id_number, user_input in inputs.items():
+            split[self.owners[id_number]][id_number] = user_input
+        for i, shard in enumerate(self.shards):
+            shard.send(('advance', (dt, split[i], self.arrivals[i],
+                                    self.credits[i], self.events[i],
+                                    self.band)))
+        results = [shard.recv() for shard in self.shards]
+        self.arrivals = [[] for _ in range(self.count)]
+        self.events = [[] for _ in range(self.count)]
+
+        border = numpy.concatenate([r[0] for r in results])
+        eaten, grown = self.resolve_seams(border)
+        self.seam_eats = len(eaten)
+        gone = numpy.isin(border['uid'], list(eaten))
+        for i, shard in enumerate(self.shards):
+            mine = border['shard'] == i
+            x0, y0, x1, y1 = region_of(i, *self.grid)
+            near = (~gone & ~mine &
+                    (border['x'] + border['r'] > x0 - self.band) &
+                    (border['x'] - border['r'] < x1 + self.band) &
+                    (border['y'] + border['r'] > y0 - self.band) &
+                    (border['y'] - border['r'] < y1 + self.band))
+            shard.send(('resolve', (border['uid'][mine & gone].tolist(),
+                                    grown[i], border[near])))
+        credits = []
+        for shard in self.shards:
+            eaten_food, leaving = shard.recv()
+            credits.extend(eaten_food)
+            for index, data in leaving:
+                self.owners[data[0]] = index
+                self.arrivals[index].append(data)
+        # the mass goes to the shard that owns the player after the hand off
+        self.credits = [[] for _ in range(self.count)]
+        for owner, uid, n, area in credits:
+            if owner in self.owners:
+                self.credits[self.owners[owner]].append((uid, n, area))
+        largest = max(r[1] for r in results)
+        spread = max(r[2] for r in results)
+        self.band = max(self.rules.sight, spread) + largest + SEAM_SLACK
+        self.ticks += 1
+
+    def resolve_seams(self, border):
+        '''Decides which of the border blobs of different shards eat each
+        other, with the rules of World.handle_player_collisions: the pairs
+        that might touch come from a SpatialHash, a blob eats another when it
+        is large enough and their centers are closer than the larger radius,
+        judged by the sizes before anyone eats, and the eats are applied
+        largest eater first, so a blob is eaten once, by the largest blob
+        that can eat it, and a blob that is eaten eats nothing. Returns the
+        set of eaten uids and, for each shard, a list of (uid, area) of its
+        blobs that grew'''
+        eaten = set()
+        grown = [{} for _ in range(self.count)]
+        n = len(border)
+        if n > 1:
+            index = SpatialHash(self.grid[2], self.grid[3], self.cell_size)
+            index.insert_many(numpy.arange(n), border['x'], border['y'],
+                              border['r'])
+            uid = border['uid'].tolist()
+            shard = border['shard'].tolist()
+            x = border['x'].tolist()
+            y = border['y'].tolist()
+            r = border['r'].tolist()
+            eat_ratio = self.rules.eat_ratio
+            eats = []
+            for a, b in index.candidate_pairs():
+                if shard[a] == shard[b]:
+                    continue
+                if math.hypot(x[a] - x[b], y[a] - y[b]) >= max(r[a], r[b]):
+                    continue
+                if r[a] > r[b] / eat_ratio:
+                    eats.append((a, b))
+                elif r[b] > r[a] / eat_ratio:
+                    eats.append((b, a))
+            # as in World.resolve_eats
+            eats.sort(key=lambda e: (-r[e[0]], uid[e[0]], -r[e[1]], uid[e[1]]))
+            for eater, food in eats:
+                if uid[eater] in eaten or uid[food] in eaten:
+                    continue
+                eaten.add(uid[food])
+                grow = grown[shard[eater]]
+                grow[uid[eater]] = (grow.get(uid[eater], 0) +
+                                    math.pi * r[food] ** 2)
+        return eaten, [sorted(g.items()) for g in grown]
+
+    def blobs(self):
+        '''Returns every blob on the board as a BORDER_DTYPE array'''
+        for shard in self.shards:
+            shard.send(('blobs', None))
+        return numpy.concatenate([shard.recv() for shard in self.shards])
+
+    def close(self):
+        '''Stops the worker processes, if there are any'''
+        for shard in self.shards:
+            shard.send(('close', None))
+            shard.close()
+        for process in self.processes:
+            process.join()
+        self.shards = []
+        self.processes = []
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Runs a sharded world headless and reports its speed')
+    parser.add_argument('--grid', default='2x2',
+                        help='columns x rows of shards, e.g. 2x2')
+    parser.add_argument('--food', type=int,
+                        help='pellets on the board (default: %d per shard)'
+                        % FOOD_COUNT)
+    parser.add_argument('--bots', type=int,
+                        help='CPU players (default: %d per shard)'
+                        % OTHER_PLAYERS)
+    parser.add_argument('--ticks', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--in-process', action='store_true',
+                        help='run the shards one after the other in this '
+                        'process')
+    args = parser.parse_args(argv)
+    columns, rows = (int(n) for n in args.grid.split('x'))
+    world = ShardedWorld(columns, rows, args.food, args.bots,
+                         seed=args.seed, processes=not args.in_process)
+    try:
+        world.step(0.05)
+        start = time.perf_counter()
+        for _ in range(args.ticks):
+            world.step(0.05)
+        elapsed = time.perf_counter() - start
+    finally:
+        world.close()
+    print(json.dumps({'shards': columns * rows, 'ticks': args.ticks,
+                      'seconds': elapsed,
+                      'ticks_per_sec': args.ticks / elapsed}))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,246 @@
+'''Running a World on a thread of its own, so that a slow tick never blocks
+the GUI. The simulation thread owns the world: nothing else reads or changes
+it. Input reaches it through a queue, and after every tick it publishes a
+RenderSnapshot - an immutable copy of everything in the user's viewport,
+already culled and ordered for drawing.
+
+Publishing is a single assignment of the new snapshots to
+SimulationThread.published, so there are always two sets of snapshots in
+play: the one being built and the last one published, which the GUI draws.
+Neither side ever takes a lock or waits for the other. The last two states
+are published together, so the GUI can repaint at any rate and draw the
+blobs where they are between two steps of the simulation.
+
+    sim = SimulationThread(World())
+    sim.start()
+    sim.send('move', (dx, dy))
+    snapshot = sim.latest
+    sim.stop()
+'''
+import queue
+import threading
+import time
+from collections import namedtuple
+import numpy
+from gameobject import FRAME_WIDTH, FRAME_HEIGHT
+from world import UserInput
+from profiler import Profiler, NULL_PROFILER
+from scheduler import FixedStep, MAX_CATCH_UP
+from tiles import TileCache
+
+TICK = 0.05
+
+
+# the pellets overlapping a tile of the food layer at one version: the
+# rectangle the tile covers, and the centers, radii and palette indices of
+# the pellets, sorted by colour
+FoodTile = namedtuple('FoodTile', ['tile', 'version', 'rect', 'x', 'y', 'r',
+                                   'colors'])
+
+
+def frozen(array):
+    '''Makes an array read-only and returns it'''
+    array.flags.writeable = False
+    return array
+
+
+def read_food_tile(tile, version, food):
+    '''Copies the pellets of a tile out of a FoodStore into a FoodTile'''
+    idx = food.in_tile(tile)
+    idx = idx[numpy.argsort(food.color_index[idx], kind='stable')]
+    return FoodTile(tile, version, food.tile_rect(tile), frozen(food.x[idx]),
+                    frozen(food.y[idx]), frozen(food.r[idx]),
+                    frozen(food.color_index[idx]))
+
+
+class RenderSnapshot():
+    '''What is on screen after a tick, in world coordinates: the center of
+    the view, the tiles of food in view (a FoodTile each, whose version
+    tells whether an image of it drawn before is still good) and the blobs
+    in view (uids, centers, radii and colours, in the order they are drawn).
+    Snapshots are never changed once built, so the GUI can draw one while
+    the next is being made. time is the wall clock when the snapshot was
+    taken, for interpolating between two'''
+
+    __slots__ = ('tick', 'time', 'x', 'y', 'food_tiles', 'blob_uids',
+                 'blob_x', 'blob_y', 'blob_r', 'blob_colors', 'overlay')
+
+    def __init__(self, tick, time, x, y, food_tiles, blob_uids, blob_x,
+                 blob_y, blob_r, blob_colors, overlay=()):
+        self.tick = tick
+        self.time = time
+        self.x = x
+        self.y = y
+        self.food_tiles = food_tiles
+        self.blob_uids = blob_uids
+        self.blob_x = blob_x
+        self.blob_y = blob_y
+        self.blob_r = blob_r
+        self.blob_colors = blob_colors
+        self.overlay = overlay
+
+    @classmethod
+    def capture(cls, world, width=FRAME_WIDTH, height=FRAME_HEIGHT,
+                overlay=(), tiles=None):
+        '''Copies the part of a world around the user that is on screen. The
+        pellets of a tile are only copied again once the tile has changed if
+        the FoodTiles are kept in a TileCache of read_food_tile, given as
+        tiles'''
+        user = world.user
+        ux, uy = user.get_absolute_position()
+        x0, y0 = ux - width / 2, uy - height / 2
+        x1, y1 = ux + width / 2, uy + height / 2
+
+        food = world.food
+        if tiles is None:
+            tiles = TileCache(read_food_tile)
+        food_tiles = tuple(tiles.get(t, food.tile_version(t), food)
+                           for t in food.tiles_in_rect(x0, y0, x1, y1))
+
+        others = [b for b in world.blob_index.query_rect(x0, y0, x1, y1)
+                  if b.id_number != user.id_number]
+        # smaller blobs first so bigger ones are drawn over them, and the
+        # user's blobs on top
+        others.sort(key=lambda b: b.r)
+        blobs = others + sorted(user.blobs, key=lambda b: b.r)
+        n = len(blobs)
+        r = numpy.fromiter((b.r for b in blobs), float, n)
+        return cls(world.clock.ticks, time.perf_counter(), ux, uy, food_tiles,
+                   frozen(numpy.fromiter((b.uid for b in blobs), int, n)),
+                   frozen(numpy.fromiter((b.x for b in blobs), float, n) + r),
+                   frozen(numpy.fromiter((b.y for b in blobs), float, n) + r),
+                   frozen(r), tuple(b.color for b in blobs), tuple(overlay))
+
+    def interpolate(self, previous, alpha):
+        '''Returns the center of the view and the centers and radii of the
+        blobs alpha of the way from the previous snapshot to this one. Blobs
+        that were not in the previous snapshot are where they are now'''
+        if previous is None or alpha >= 1:
+            return self.x, self.y, self.blob_x, self.blob_y, self.blob_r
+        x = previous.x + (self.x - previous.x) * alpha
+        y = previous.y + (self.y - previous.y) * alpha
+        bx = self.blob_x.copy()
+        by = self.blob_y.copy()
+        br = self.blob_r.copy()
+        if len(previous.blob_uids) and len(bx):
+            order = numpy.argsort(previous.blob_uids)
+            uids = previous.blob_uids[order]
+            pos = numpy.minimum(numpy.searchsorted(uids, self.blob_uids),
+                                len(uids) - 1)
+            seen = uids[pos] == self.blob_uids
+            before = order[pos[seen]]
+            bx[seen] = previous.blob_x[before] + \
+                (bx[seen] - previous.blob_x[before]) * alpha
+            by[seen] = previous.blob_y[before] + \
+                (by[seen] - previous.blob_y[before]) * alpha
+            br[seen] = previous.blob_r[before] + \
+                (br[seen] - previous.blob_r[before]) * alpha
+        return x, y, bx, by, br
+
+
+class SimulationThread(threading.Thread):
+    '''Steps a world with a fixed timestep on a thread of its own and
+    publishes a RenderSnapshot of it after each round of steps. Commands from
+    other threads are queued with send() and applied before the next step:
+
+        ('move', (dx, dy))   the direction the user moves in
+        ('split', None)      split the user on the next step
+        ('profile', None)    turn the profiler on or off
+        ('dump', path)       dump the profiler's results to path
+        ('paint', seconds)   how long the GUI took to draw a snapshot
+
+    The steps are scheduled by a FixedStep, so the game keeps its speed when
+    the thread wakes up late, running up to max_steps at once to catch up.
+    published holds the last two snapshots, one step apart, so the GUI can
+    draw the state in between at any moment'''
+
+    def __init__(self, world, dt=TICK, max_steps=MAX_CATCH_UP):
+        super(SimulationThread, self).__init__(daemon=True)
+        self.world = world
+        self.dt = dt
+        self.max_steps = max_steps
+        self.inbox = queue.SimpleQueue()
+        self.stopped = threading.Event()
+        self.direction = (0, 0)
+        self.split = False
+        # the pellets of the tiles of food seen lately
+        self.tiles = TileCache(read_food_tile)
+        # (previous, latest), replaced in one assignment
+        self.published = (None, RenderSnapshot.capture(world,
+                                                       tiles=self.tiles))
+
+    @property
+    def latest(self):
+        '''The most recent snapshot'''
+        return self.published[1]
+
+    def send(self, command, data=None):
+        '''Queues a command for the simulation. Safe to call from any
+        thread'''
+        self.inbox.put((command, data))
+
+    def stop(self):
+        '''Stops stepping the world and waits for the current step to
+        finish'''
+        self.stopped.set()
+        if self.is_alive():
+            self.join()
+
+    def handle(self, command, data):
+        '''Applies a queued command'''
+        world = self.world
+        if command == 'move':
+            self.direction = data
+        elif command == 'split':
+            self.split = True
+        elif command == 'profile':
+            if world.profiler.enabled:
+                world.profiler = NULL_PROFILER
+            else:
+                world.profiler = Profiler()
+        elif command == 'dump':
+            if world.profiler.enabled:
+                world.profiler.dump(data)
+        elif command == 'paint':
+            # painting happens between ticks, so it is counted in the next
+            world.profiler.add_elapsed('paint', data)
+
+    def step(self):
+        '''Applies the queued commands and steps the world once'''
+        while True:
+            try:
+                command, data = self.inbox.get_nowait()
+            except queue.Empty:
+                break
+            self.handle(command, data)
+        self.world.step(self.dt, UserInput(self.direction, self.split))
+        self.split = False
+
+    def capture(self):
+        '''Takes a snapshot of the world, with the profiler's overlay if it
+        is on'''
+        prof = self.world.profiler
+        overlay = prof.overlay_lines() if prof.enabled else ()
+        return RenderSnapshot.capture(self.world, overlay=overlay,
+                                      tiles=self.tiles)
+
+    def tick(self, steps=1):
+        '''Runs a round of steps and publishes the state before the last of
+        them along with the state after it'''
+        previous = self.latest
+        for i in range(steps):
+            if i == steps - 1 and steps > 1:
+                previous = self.capture()
+            self.step()
+        self.published = (previous, self.capture())
+
+    def run(self):
+        scheduler = FixedStep(self.dt, self.max_steps)
+        while not self.stopped.is_set():
+            dropped = scheduler.dropped
+            steps = scheduler.due()
+            if steps:
+                self.world.profiler.count('dropped_steps',
+                                          scheduler.dropped - dropped)
+                self.tick(steps)
+            self.stopped.wait(scheduler.until_next())
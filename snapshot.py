@@ -0,0 +1,332 @@
+'''A compact, versioned binary format for the complete state of a World, for
+checkpointing long-running worlds and shipping initial state to clients.
+
+A snapshot is a fixed-size header followed by sections of fixed-width packed
+records, all little-endian and each starting on an 8 byte boundary:
+
+    header                   HEADER_DTYPE, once
+    food x, y, r             float64, one per food slot
+    food colour, alive       uint8, one per food slot
+    food free stack          int32, bottom of the stack first
+    players                  PLAYER_DTYPE, CPU players, then humans, then
+                             the user if the world has one, each with its
+                             cached plan if any
+    blobs                    BLOB_DTYPE, each player's blobs together
+    random streams           RNG_DTYPE, one per stream, in STREAMS order
+
+Every section is read straight out of the file (memory-mapped by load) with
+numpy.frombuffer, so nothing is parsed per object - only the players and
+blobs themselves are rebuilt, and the food index is filled in bulk. The
+seed and the state of each of the world's random streams are stored too, so
+a restored world draws the same random numbers the saved one would have, and
+so are the plans the CPU players are following, so its bots do not all
+re-plan at once on the first tick. The header holds the world's rules, so a
+world with rules of its own (from sweep.py, say) comes back with them.
+
+    snapshot.save(world, 'world.snap')
+    world = snapshot.load('world.snap')
+'''
+import mmap
+import numpy
+import ai
+from foodstore import FoodStore
+from player import Player
+from spatial import SpatialHash
+from streams import STREAMS
+from world import World
+from rules import Rules
+
+MAGIC = b'AGSN'
+VERSION = 8
+
+HEADER_DTYPE = numpy.dtype([
+    ('magic', 'S4'), ('version', '<u4'),
+    ('width', '<f8'), ('height', '<f8'), ('cell_size', '<f8'),
+    ('time', '<f8'), ('ticks', '<i8'), ('next_decay', '<f8'),
+    ('replan_interval', '<i4'), ('user_id', '<i4'), ('next_id', '<i4'),
+    ('food_capacity', '<i4'), ('food_free', '<i4'), ('players', '<i4'),
+    ('blobs', '<i4'), ('max_cells', '<i4'), ('food_spawned', '<i8'),
+    ('seed', '<u8'), ('lod_interval', '<i4'), ('has_user', 'u1'),
+    ('pad', 'u1', 3),
+    # the world's Rules, in the order of their fields
+    ('rules', '<f8', len(Rules._fields))])
+
+# kinds of player
+CPU, HUMAN, USER = range(3)
+
+PLAYER_DTYPE = numpy.dtype([
+    ('id', '<i4'), ('kind', 'u1'), ('has_recovered', 'u1'),
+    ('has_shoot_time', 'u1'), ('pad', 'u1'), ('size', '<i4'),
+    ('center', '<i4'), ('r', '<f8'), ('time', '<f8'), ('shoot_time', '<f8'),
+    ('first_blob', '<i4'), ('blobs', '<i4'),
+    # the player's ai.Plan: the uid of the target blob or the slot of the
+    # target pellet, -1 for none
+    ('has_plan', 'u1'), ('plan_kind', 'i1'), ('pad2', 'u1', 6),
+    ('plan_target', '<i8'), ('plan_food_x', '<f8'), ('plan_food_y', '<f8'),
+    ('plan_crowd', '<f8'), ('plan_tick', '<i8')])
+
+BLOB_DTYPE = numpy.dtype([
+    ('uid', '<i8'), ('x', '<f8'), ('y', '<f8'), ('r', '<f8'),
+    ('time', '<f8'), ('dx', '<f8'), ('dy', '<f8'), ('merge_time', '<f8'),
+    ('id', '<i4'),
+    ('color', 'u1', 3), ('shoot', 'u1'), ('recover', 'u1'),
+    ('has_direction', 'u1'), ('pad', 'u1', 2)])
+
+# the state of one random.Random, as returned by getstate
+RNG_DTYPE = numpy.dtype([
+    ('version', '<i4'), ('has_gauss', 'u1'), ('pad', 'u1', 3),
+    ('gauss', '<f8'), ('state', '<u4', 625), ('pad2', 'u1', 4)])
+
+
+class SnapshotError(Exception):
+    '''Raised for data that is not a snapshot this version can read'''
+    pass
+
+
+def _aligned(n):
+    '''Rounds a byte count up to the next multiple of 8'''
+    return (n + 7) // 8 * 8
+
+
+def _layout(capacity, free, players, blobs):
+    '''Returns the byte offset of every section and the total size'''
+    sections = [('food_x', 8 * capacity), ('food_y', 8 * capacity),
+                ('food_r', 8 * capacity), ('food_color', capacity),
+                ('food_alive', capacity), ('food_free', 4 * free),
+                ('players', PLAYER_DTYPE.itemsize * players),
+                ('blobs', BLOB_DTYPE.itemsize * blobs),
+                ('rng', RNG_DTYPE.itemsize * len(STREAMS))]
+    offsets = {}
+    offset = HEADER_DTYPE.itemsize
+    for name, size in sections:
+        offsets[name] = offset
+        offset = _aligned(offset + size)
+    return offsets, offset
+
+
+def dumps(world):
+    '''Packs the state of a world into bytes'''
+    food = world.food
+    humans = list(world.humans.values())
+    players = world.other_players + humans
+    kinds = [CPU] * len(world.other_players) + [HUMAN] * len(humans)
+    if world.user is not None:
+        players.append(world.user)
+        kinds.append(USER)
+    n_blobs = sum(len(p.blobs) for p in players)
+    offsets, size = _layout(food.capacity, len(food.free), len(players),
+                            n_blobs)
+    buffer = bytearray(size)
+
+    header = numpy.zeros(1, dtype=HEADER_DTYPE)
+    h = header[0]
+    h['magic'] = MAGIC
+    h['version'] = VERSION
+    h['width'] = world.width
+    h['height'] = world.height
+    h['cell_size'] = world.food.index.cell_size
+    h['time'] = world.clock.time
+    h['ticks'] = world.clock.ticks
+    h['next_decay'] = world.next_decay
+    h['replan_interval'] = world.planner.interval
+    h['has_user'] = world.user is not None
+    h['user_id'] = world.user.id_number if world.user is not None else -1
+    h['next_id'] = world.next_id
+    h['food_capacity'] = food.capacity
+    h['food_free'] = len(food.free)
+    h['food_spawned'] = food.spawned
+    h['players'] = len(players)
+    h['blobs'] = n_blobs
+    h['seed'] = world.seed
+    h['max_cells'] = world.max_cells
+    h['lod_interval'] = world.lod_interval
+    h['rules'] = world.rules
+    buffer[:HEADER_DTYPE.itemsize] = header.tobytes()
+
+    def put(name, array):
+        data = numpy.ascontiguousarray(array).tobytes()
+        buffer[offsets[name]:offsets[name] + len(data)] = data
+
+    put('food_x', food.x.astype('<f8'))
+    put('food_y', food.y.astype('<f8'))
+    put('food_r', food.r.astype('<f8'))
+    put('food_color', food.color_index)
+    put('food_alive', food.alive.astype(numpy.uint8))
+    put('food_free', numpy.array(food.free, dtype='<i4'))
+
+    player_records = numpy.zeros(len(players), dtype=PLAYER_DTYPE)
+    blob_records = numpy.zeros(n_blobs, dtype=BLOB_DTYPE)
+    row = 0
+    for i, (p, kind) in enumerate(zip(players, kinds)):
+        pr = player_records[i]
+        pr['id'] = p.id_number
+        pr['kind'] = kind
+        pr['has_recovered'] = p.has_recovered
+        pr['has_shoot_time'] = p.shoot_time is not None
+        pr['shoot_time'] = p.shoot_time if p.shoot_time is not None else 0
+        pr['size'] = p.size
+        pr['r'] = p.r
+        pr['time'] = p.time
+        pr['first_blob'] = row
+        pr['blobs'] = len(p.blobs)
+        plan = world.planner.plans.get(p)
+        if plan is not None:
+            pr['has_plan'] = True
+            pr['plan_kind'] = plan.kind
+            pr['plan_crowd'] = plan.crowd
+            pr['plan_tick'] = plan.tick
+            if plan.kind == ai.FOOD:
+                pr['plan_target'] = plan.target
+                pr['plan_food_x'], pr['plan_food_y'] = plan.food_position
+            elif plan.kind != ai.NOTHING and plan.uid is not None:
+                pr['plan_target'] = plan.uid
+            else:
+                pr['plan_target'] = -1
+        for b in p.blobs:
+            if b is p.center:
+                pr['center'] = row
+            br = blob_records[row]
+            br['uid'] = b.uid
+            br['x'] = b.x
+            br['y'] = b.y
+            br['r'] = b.r
+            br['time'] = b.time
+            br['merge_time'] = b.merge_time
+            br['id'] = b.id_number
+            br['color'] = b.color
+            br['shoot'] = b.shoot
+            br['recover'] = b.recover
+            if b.init_direction is not None:
+                br['has_direction'] = True
+                br['dx'], br['dy'] = b.init_direction
+            row += 1
+    put('players', player_records)
+    put('blobs', blob_records)
+
+    rng_records = numpy.zeros(len(STREAMS), dtype=RNG_DTYPE)
+    for r, (version, state, gauss) in zip(rng_records, world.rng.getstate()):
+        r['version'] = version
+        r['state'] = state
+        r['has_gauss'] = gauss is not None
+        r['gauss'] = gauss if gauss is not None else 0
+    put('rng', rng_records)
+    return bytes(buffer)
+
+
+def _plan(kind, target, food_position, crowd, tick, by_uid):
+    '''Rebuilds an ai.Plan from its record. A blob that is gone (the ghost
+    of a blob in another shard, say) leaves a plan with no target, which the
+    planner drops on the next tick as it would have dropped the original'''
+    if kind == ai.FOOD:
+        return ai.Plan(kind, target, None, food_position, crowd, tick)
+    if kind == ai.NOTHING:
+        return ai.Plan(kind, None, None, None, crowd, tick)
+    blob = by_uid.get(target)
+    return ai.Plan(kind, blob, target if blob is not None else None, None,
+                   crowd, tick)
+
+
+def loads(data):
+    '''Builds a world from a snapshot held in any buffer (bytes, a mmap,
+    ...)'''
+    if len(data) < HEADER_DTYPE.itemsize:
+        raise SnapshotError('too short to be a snapshot')
+    h = numpy.frombuffer(data, dtype=HEADER_DTYPE, count=1)[0]
+    if bytes(h['magic']) != MAGIC:
+        raise SnapshotError('not a snapshot')
+    if h['version'] != VERSION:
+        raise SnapshotError('unsupported snapshot version %d' % h['version'])
+    capacity = int(h['food_capacity'])
+    offsets, size = _layout(capacity, int(h['food_free']),
+                            int(h['players']), int(h['blobs']))
+    if len(data) < size:
+        raise SnapshotError('truncated snapshot')
+
+    def get(name, dtype, count):
+        return numpy.frombuffer(data, dtype=dtype, count=count,
+                                offset=offsets[name])
+
+    width, height = float(h['width']), float(h['height'])
+    cell_size = float(h['cell_size'])
+    # an empty world, whose food, players and clock are then filled in
+    world = World(0, 0, width, height, cell_size, int(h['replan_interval']),
+                  int(h['seed']), int(h['max_cells']),
+                  int(h['lod_interval']), user=bool(h['has_user']),
+                  rules=Rules(*h['rules'].tolist()))
+    world.rng.setstate([
+        (version, tuple(state.tolist()), gauss if has_gauss else None)
+        for version, has_gauss, _, gauss, state, _ in
+        get('rng', RNG_DTYPE, len(STREAMS)).tolist()])
+    world.clock.time = float(h['time'])
+    world.clock.ticks = int(h['ticks'])
+    world.next_decay = float(h['next_decay'])
+    world.next_id = int(h['next_id'])
+
+    food = FoodStore(capacity, world.food_source(int(h['food_spawned'])),
+                     SpatialHash(width, height, cell_size))
+    food.spawned = int(h['food_spawned'])
+    food.load(get('food_x', '<f8', capacity), get('food_y', '<f8', capacity),
+              get('food_r', '<f8', capacity),
+              get('food_color', numpy.uint8, capacity),
+              get('food_alive', numpy.uint8, capacity).astype(bool),
+              get('food_free', '<i4', int(h['food_free'])))
+    world.food = food
+
+    blob_records = get('blobs', BLOB_DTYPE, int(h['blobs']))
+    # tolist turns every record into a tuple of plain Python values at once
+    blobs = blob_records.tolist()
+    pool = world.blob_pool
+    built = []
+    for (uid, x, y, r, time, dx, dy, merge_time, id_number, color, shoot,
+         recover, has_direction, _) in blobs:
+        b = pool.acquire(x, y, r, tuple(color.tolist()), bool(shoot),
+                         id_number, (dx, dy) if has_direction else None,
+                         world.clock)
+        b.uid = uid
+        b.time = time
+        b.merge_time = merge_time
+        b.recover = bool(recover)
+        built.append(b)
+    if blobs:
+        pool.reserve_uids(int(blob_records['uid'].max()))
+
+    world.blob_index = SpatialHash(width, height, cell_size)
+    world.other_players = []
+    world.humans = {}
+    world.playerIds = {}
+    by_uid = {b.uid: b for b in built}
+    for (id_number, kind, has_recovered, has_shoot_time, _, size, center, r,
+         time, shoot_time, first, count, has_plan, plan_kind, _,
+         plan_target, plan_food_x, plan_food_y, plan_crowd, plan_tick) in \
+            get('players', PLAYER_DTYPE, int(h['players'])).tolist():
+        p = Player.restore(built[first:first + count], built[center],
+                           world.clock, pool, id_number, size, time,
+                           shoot_time if has_shoot_time else None,
+                           bool(has_recovered), r, world.max_cells)
+        world.index_player(p)
+        world.playerIds[id_number] = p
+        if has_plan:
+            world.planner.plans[p] = _plan(plan_kind, plan_target,
+                                           (plan_food_x, plan_food_y),
+                                           plan_crowd, plan_tick, by_uid)
+        if kind == CPU:
+            world.other_players.append(p)
+        elif kind == HUMAN:
+            world.humans[id_number] = p
+        else:
+            world.user = p
+    return world
+
+
+def save(world, path):
+    '''Writes a snapshot of a world to a file'''
+    with open(path, 'wb') as f:
+        f.write(dumps(world))
+
+
+def load(path):
+    '''Restores a world from a snapshot file, which is memory-mapped rather
+    than read'''
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            return loads(m)
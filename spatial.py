@@ -0,0 +1,248 @@
+import math
+import numpy
+
+CELL_SIZE = 100
+
+
+class SpatialHash():
+    '''A SpatialHash is a uniform grid over a world of any size, used to find
+    the objects near a point or a rectangle without looking at every object.
+    Objects are stored by key (any hashable value, e.g. a Blob or the index of
+    a food pellet) together with their center and radius, and are placed in
+    every cell their bounding box overlaps. Moving an object only touches the
+    grid when the set of cells it overlaps changes'''
+
+    def __init__(self, width, height, cell_size=CELL_SIZE):
+        self.width = width
+        self.height = height
+        self.cell_size = cell_size
+        self.cols = max(1, int(math.ceil(width / cell_size)))
+        self.rows = max(1, int(math.ceil(height / cell_size)))
+        # cell id -> set of keys, only for cells that have held something
+        self.cells = {}
+        # key -> (x, y, r, first col, first row, last col, last row)
+        self.entries = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def _col(self, x):
+        '''Returns the column containing the given x, clamped to the grid'''
+        return min(max(int(x // self.cell_size), 0), self.cols - 1)
+
+    def _row(self, y):
+        '''Returns the row containing the given y, clamped to the grid'''
+        return min(max(int(y // self.cell_size), 0), self.rows - 1)
+
+    def cell_of(self, x, y):
+        '''Returns the id of the cell containing the given point'''
+        return self._row(y) * self.cols + self._col(x)
+
+    def cells_in_rect(self, x0, y0, x1, y1):
+        '''Returns the ids of every cell overlapping the given rectangle'''
+        c0, c1 = self._col(x0), self._col(x1)
+        r0, r1 = self._row(y0), self._row(y1)
+        return [row * self.cols + col for row in range(r0, r1 + 1)
+                for col in range(c0, c1 + 1)]
+
+    def cells_of(self, xs, ys):
+        '''Returns the ids of the cells containing each of the given points,
+        as an array'''
+        cols = numpy.clip(xs // self.cell_size, 0, self.cols - 1)
+        rows = numpy.clip(ys // self.cell_size, 0, self.rows - 1)
+        return (rows * self.cols + cols).astype(numpy.int64)
+
+    def insert(self, key, x, y, r):
+        '''Adds an object with the given center and radius to the index'''
+        c0, c1 = self._col(x - r), self._col(x + r)
+        r0, r1 = self._row(y - r), self._row(y + r)
+        self.entries[key] = (x, y, r, c0, r0, c1, r1)
+        cells = self.cells
+        for row in range(r0, r1 + 1):
+            for col in range(c0, c1 + 1):
+                c = row * self.cols + col
+                if c in cells:
+                    cells[c].add(key)
+                else:
+                    cells[c] = {key}
+
+    def insert_many(self, keys, xs, ys, rs):
+        '''Adds many objects at once, given arrays of integer keys, centers and
+        radii. This is the same as inserting them one by one, but the cells
+        are worked out with array operations and each cell's set is filled in
+        a single update'''
+        size = self.cell_size
+        c0 = numpy.clip((xs - rs) // size, 0, self.cols - 1).astype(int)
+        c1 = numpy.clip((xs + rs) // size, 0, self.cols - 1).astype(int)
+        r0 = numpy.clip((ys - rs) // size, 0, self.rows - 1).astype(int)
+        r1 = numpy.clip((ys + rs) // size, 0, self.rows - 1).astype(int)
+        self.entries.update(zip(numpy.asarray(keys).tolist(), zip(
+            xs.tolist(), ys.tolist(), rs.tolist(), c0.tolist(), r0.tolist(),
+            c1.tolist(), r1.tolist())))
+        # pair every key with each cell it covers, one row/column offset at
+        # a time, then group the pairs by cell
+        keys = numpy.asarray(keys)
+        ids, grouped = [], []
+        for dr in range(int((r1 - r0).max(initial=0)) + 1):
+            for dc in range(int((c1 - c0).max(initial=0)) + 1):
+                covers = (r0 + dr <= r1) & (c0 + dc <= c1)
+                ids.append(((r0 + dr) * self.cols + c0 + dc)[covers])
+                grouped.append(keys[covers])
+        ids = numpy.concatenate(ids)
+        order = numpy.argsort(ids, kind='stable')
+        grouped = numpy.concatenate(grouped)[order].tolist()
+        cell_ids, starts = numpy.unique(ids[order], return_index=True)
+        ends = starts[1:].tolist() + [len(grouped)]
+        cells = self.cells
+        for c, start, end in zip(cell_ids.tolist(), starts.tolist(), ends):
+            if c in cells:
+                cells[c].update(grouped[start:end])
+            else:
+                cells[c] = set(grouped[start:end])
+
+    def remove(self, key):
+        '''Removes an object from the index, if it is there'''
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        _, _, _, c0, r0, c1, r1 = entry
+        cells = self.cells
+        for row in range(r0, r1 + 1):
+            for col in range(c0, c1 + 1):
+                cells[row * self.cols + col].discard(key)
+
+    def update(self, key, x, y, r):
+        '''Moves (or inserts) an object. The grid is only changed if the object
+        now overlaps a different set of cells'''
+        entry = self.entries.get(key)
+        if entry is None:
+            self.insert(key, x, y, r)
+            return
+        c0, c1 = self._col(x - r), self._col(x + r)
+        r0, r1 = self._row(y - r), self._row(y + r)
+        if entry[3:] == (c0, r0, c1, r1):
+            self.entries[key] = (x, y, r, c0, r0, c1, r1)
+        else:
+            self.remove(key)
+            self.insert(key, x, y, r)
+
+    def position(self, key):
+        '''Returns the (x, y, r) the object was last indexed with'''
+        return self.entries[key][:3]
+
+    def query_rect(self, x0, y0, x1, y1):
+        '''Returns the set of keys of every object whose bounding box overlaps
+        the given rectangle'''
+        found = set()
+        cells = self.cells
+        for c in self.cells_in_rect(x0, y0, x1, y1):
+            if c in cells:
+                found.update(cells[c])
+        entries = self.entries
+        return {k for k in found
+                if entries[k][0] + entries[k][2] >= x0 and
+                entries[k][0] - entries[k][2] <= x1 and
+                entries[k][1] + entries[k][2] >= y0 and
+                entries[k][1] - entries[k][2] <= y1}
+
+    def query_radius(self, x, y, r):
+        '''Returns the set of keys of every object whose disk intersects the
+        disk centered at (x, y) with radius r'''
+        found = set()
+        cells = self.cells
+        for c in self.cells_in_rect(x - r, y - r, x + r, y + r):
+            if c in cells:
+                found.update(cells[c])
+        entries = self.entries
+        hits = set()
+        for k in found:
+            ox, oy, o_r = entries[k][:3]
+            if math.hypot(ox - x, oy - y) < o_r + r:
+                hits.add(k)
+        return hits
+
+    def candidate_pairs(self, keys=None):
+        '''Returns every pair of keys whose bounding boxes overlap, each pair
+        exactly once. This is the broad phase for collisions between indexed
+        objects - only these pairs need an exact test. A pair sharing several
+        cells is only reported from the first cell of the overlap of their
+        bounding boxes, so no set of seen pairs is needed. If a set of keys is
+        given, only the pairs including at least one of them are returned'''
+        entries = self.entries
+        occupied = set()
+        for key in entries if keys is None else keys:
+            _, _, _, c0, r0, c1, r1 = entries[key]
+            for row in range(r0, r1 + 1):
+                for col in range(c0, c1 + 1):
+                    occupied.add(row * self.cols + col)
+        pairs = []
+        for c in occupied:
+            cell = self.cells[c]
+            if len(cell) < 2:
+                continue
+            row, col = divmod(c, self.cols)
+            cell = list(cell)
+            for i in range(len(cell)):
+                a = cell[i]
+                ax, ay, ar, ac0, ar0, _, _ = entries[a]
+                for j in range(i + 1, len(cell)):
+                    b = cell[j]
+                    bx, by, br, bc0, br0, _, _ = entries[b]
+                    if max(ac0, bc0) != col or max(ar0, br0) != row:
+                        continue
+                    if keys is not None and a not in keys and b not in keys:
+                        continue
+                    if (abs(ax - bx) <= ar + br and
+                            abs(ay - by) <= ar + br):
+                        pairs.append((a, b))
+        return pairs
+
+    def nearest(self, x, y, k=1, max_distance=None):
+        '''Returns up to k (distance, key) pairs for the objects whose centers
+        are closest to (x, y), closest first. The search spreads out ring by
+        ring from the cell containing the point, and stops once no unvisited
+        cell can contain anything closer, or when it is past max_distance'''
+        if max_distance is None:
+            max_distance = math.hypot(self.width, self.height)
+        col, row = self._col(x), self._row(y)
+        entries = self.entries
+        seen = set()
+        best = []
+        max_ring = max(self.cols, self.rows)
+        for ring in range(max_ring + 1):
+            # the closest any point in this ring can be to (x, y)
+            ring_distance = (ring - 1) * self.cell_size
+            if ring_distance > max_distance:
+                break
+            if len(best) >= k and ring_distance > best[k - 1][0]:
+                break
+            for c in self._ring(col, row, ring):
+                for key in self.cells.get(c, ()):
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    ox, oy = entries[key][:2]
+                    d = math.hypot(ox - x, oy - y)
+                    if d <= max_distance:
+                        best.append((d, key))
+            best.sort(key=lambda pair: pair[0])
+        return best[:k]
+
+    def _ring(self, col, row, ring):
+        '''Returns the ids of the cells at exactly the given Chebyshev distance
+        (in cells) from the given cell'''
+        if ring == 0:
+            return [row * self.cols + col]
+        ids = []
+        for c in range(col - ring, col + ring + 1):
+            for r in (row - ring, row + ring):
+                if 0 <= c < self.cols and 0 <= r < self.rows:
+                    ids.append(r * self.cols + c)
+        for r in range(row - ring + 1, row + ring):
+            for c in (col - ring, col + ring):
+                if 0 <= c < self.cols and 0 <= r < self.rows:
+                    ids.append(r * self.cols + c)
+        return ids
@@ -0,0 +1,139 @@
+'''Merging and separation of the blobs (cells) of a single player. Every cell
+has a merge timer - the simulated time from which it may merge - set when the
+player splits. Once per tick all the cells of a player are resolved together
+with array operations: every pair of touching cells whose timers have both
+run out is merged, any number of pairs at once, and cells that overlap but
+may not merge yet are pushed apart'''
+import math
+import numpy
+
+# the default number of cells a player can split into
+MAX_CELLS = 16
+# the angle between the directions cells on top of each other are pushed
+# apart in, which spreads any number of them evenly
+GOLDEN_ANGLE = math.pi * (3 - math.sqrt(5))
+# up to this many cells, testing every pair is cheaper than building an index
+ALL_PAIRS = 24
+
+
+def candidate_pairs(x, y, r):
+    '''Returns the pairs (i, j), i < j, of the cells with the given centers
+    and radii whose bounding boxes overlap, as two arrays ordered by i and
+    then j - the only pairs that can touch. A few cells are simply all
+    paired up. More are sorted into a uniform grid (the broad phase of a
+    SpatialHash, done with array operations) whose squares are as wide as
+    the largest cell, so a cell only has to be paired with the cells in its
+    own square and the eight around it'''
+    n = len(r)
+    if n <= ALL_PAIRS:
+        return numpy.triu_indices(n, 1)
+    size = 2 * float(r.max())
+    col = ((x - x.min()) // size).astype(numpy.intp)
+    row = ((y - y.min()) // size).astype(numpy.intp)
+    cols = int(col.max()) + 1
+    rows = int(row.max()) + 1
+    square = row * cols + col
+    order = numpy.argsort(square, kind='stable')
+    counts = numpy.bincount(square, minlength=cols * rows)
+    starts = numpy.cumsum(counts) - counts
+    found_i, found_j = [], []
+    # each pair of neighbouring squares once: the square itself and the
+    # four after it
+    for dc, dr in ((0, 0), (1, 0), (-1, 1), (0, 1), (1, 1)):
+        c, rr = col + dc, row + dr
+        near = numpy.flatnonzero((c >= 0) & (c < cols) & (rr < rows))
+        other = rr[near] * cols + c[near]
+        count = counts[other]
+        ends = numpy.cumsum(count)
+        total = int(ends[-1]) if len(ends) else 0
+        found_i.append(numpy.repeat(near, count))
+        found_j.append(order[numpy.arange(total) +
+                             numpy.repeat(starts[other] - (ends - count),
+                                          count)])
+    i = numpy.concatenate(found_i)
+    j = numpy.concatenate(found_j)
+    i, j = numpy.minimum(i, j), numpy.maximum(i, j)
+    # pairs within a square are found both ways round, so keep one of them
+    keep = ((i < j) & (numpy.abs(x[i] - x[j]) <= r[i] + r[j]) &
+            (numpy.abs(y[i] - y[j]) <= r[i] + r[j]))
+    keep[:len(found_i[0])] &= found_i[0] < found_j[0]
+    i, j = i[keep], j[keep]
+    order = numpy.lexsort((j, i))
+    return i[order], j[order]
+
+
+def resolve(player):
+    '''Merges and separates the cells of a player. A cell merges into a
+    touching cell when the distance between their centers is less than the
+    radius of the larger one; the larger cell absorbs the smaller, and can
+    absorb several in a single tick. Cells that were just shot out fly freely
+    and are not pushed, and recovering cells stop recovering once they are.
+    Only the candidate_pairs of cells are looked at'''
+    blobs = list(player.blobs)
+    n = len(blobs)
+    if n < 2:
+        return
+    now = player.clock.time
+    r = numpy.fromiter((b.r for b in blobs), float, n)
+    x = numpy.fromiter((b.x for b in blobs), float, n) + r
+    y = numpy.fromiter((b.y for b in blobs), float, n) + r
+    i, j = candidate_pairs(x, y, r)
+    if not len(i):
+        return
+    ready = numpy.fromiter((b.merge_time <= now for b in blobs), bool, n)
+    free = numpy.fromiter((not b.shoot for b in blobs), bool, n)
+    dx = x[j] - x[i]
+    dy = y[j] - y[i]
+    d = numpy.hypot(dx, dy)
+    both_ready = ready[i] & ready[j]
+    considered = numpy.ones(len(i), dtype=bool)
+
+    merging = both_ready & (d < numpy.maximum(r[i], r[j]))
+    if merging.any():
+        mi, mj = i[merging], j[merging]
+        # the larger cell of each pair eats the smaller, largest first
+        eater = numpy.where(r[mi] >= r[mj], mi, mj)
+        eaten = numpy.where(r[mi] >= r[mj], mj, mi)
+        gone = numpy.zeros(n, dtype=bool)
+        for k in numpy.argsort(-r[eater], kind='stable').tolist():
+            a, b = eater[k], eaten[k]
+            if gone[a] or gone[b]:
+                continue
+            player.absorb(blobs[a], blobs[b])
+            gone[b] = True
+        for k in numpy.flatnonzero(gone).tolist():
+            player.remove_blob(blobs[k])
+        # merged cells are not pushed this tick
+        considered = ~(gone[i] | gone[j])
+
+    reach = r[i] + r[j]
+    pushing = considered & ~both_ready & free[i] & free[j] & (d < reach)
+    if not pushing.any():
+        return
+    depth = reach[pushing] - d[pushing]
+    dist = d[pushing]
+    dx = dx[pushing]
+    dy = dy[pushing]
+    i = i[pushing]
+    j = j[pushing]
+    # cells on top of each other are pushed apart in a fixed direction
+    angle = GOLDEN_ANGLE * (j - i)
+    ux = numpy.where(dist > 0, dx / numpy.where(dist > 0, dist, 1),
+                     numpy.cos(angle))
+    uy = numpy.where(dist > 0, dy / numpy.where(dist > 0, dist, 1),
+                     numpy.sin(angle))
+    # the lighter cell of a pair moves further
+    mass_i = r[i] ** 2
+    mass_j = r[j] ** 2
+    share_i = mass_j / (mass_i + mass_j)
+    shift_x = numpy.zeros(n)
+    shift_y = numpy.zeros(n)
+    numpy.add.at(shift_x, i, -ux * depth * share_i)
+    numpy.add.at(shift_y, i, -uy * depth * share_i)
+    numpy.add.at(shift_x, j, ux * depth * (1 - share_i))
+    numpy.add.at(shift_y, j, uy * depth * (1 - share_i))
+    # a recovering cell that bumps into the others has rejoined them
+    for k in numpy.flatnonzero((shift_x != 0) | (shift_y != 0)).tolist():
+        blobs[k].x += shift_x[k]
+        blobs[k].y += shift_y[k]
+        blobs[k].recover = False
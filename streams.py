@@ -0,0 +1,28 @@
+import random
+
+# the parts of the simulation that draw random numbers, each from its own
+# stream: food placement, the placement and size of new players, and the
+# jitter in the movement of the CPU players
+STREAMS = ('food', 'players', 'ai')
+
+
+class RandomStreams():
+    '''RandomStreams holds a separate random number generator for each part of
+    the simulation, all derived from a single seed. A world seeded the same
+    way and given the same input plays out exactly the same way, and drawing
+    more numbers in one part (e.g. more food being eaten) does not change
+    what happens in the others'''
+
+    def __init__(self, seed):
+        self.seed = seed
+        for name in STREAMS:
+            setattr(self, name, random.Random('%d:%s' % (seed, name)))
+
+    def getstate(self):
+        '''Returns the state of every stream, in the order of STREAMS'''
+        return [getattr(self, name).getstate() for name in STREAMS]
+
+    def setstate(self, states):
+        '''Restores the streams to states returned by getstate'''
+        for name, state in zip(STREAMS, states):
+            getattr(self, name).setstate(state)
@@ -0,0 +1,116 @@
+'''A swarm of scripted clients for load testing the server. Every client
+wanders in a slowly changing direction, splits now and then, and keeps its
+own copy of its viewport up to date from the snapshots it receives. At the
+end the swarm reports how many snapshots arrived and how far apart they
+were, as JSON:
+
+    python server.py &
+    python swarm.py --clients 100 --seconds 30
+'''
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+import numpy
+from server import HOST, PORT
+
+CLIENTS = 100
+SECONDS = 10
+# how often each client sends its input, in seconds
+INPUT_INTERVAL = 0.1
+SPLIT_CHANCE = 0.01
+
+
+class Viewport():
+    '''What a client knows about the world, rebuilt from delta snapshots'''
+
+    def __init__(self):
+        self.food = {}
+        self.blobs = {}
+
+    def apply(self, message):
+        '''Applies a snapshot to the viewport'''
+        for slot in message['fr']:
+            del self.food[slot]
+        for slot, x, y, r, c in message['f']:
+            self.food[slot] = (x, y, r, c)
+        for uid in message['br']:
+            del self.blobs[uid]
+        for uid, x, y, r, owner, color in message['b']:
+            self.blobs[uid] = [x, y, r, owner, color]
+        for uid, x, y, r in message['bu']:
+            self.blobs[uid][:3] = [x, y, r]
+
+
+async def client(host, port, seconds, stats):
+    '''Plays for the given number of seconds, recording the arrival time of
+    every snapshot'''
+    reader, writer = await asyncio.open_connection(host, port)
+    view = Viewport()
+    arrivals = []
+    sizes = []
+    angle = random.uniform(0, 2 * math.pi)
+
+    async def send_inputs():
+        nonlocal angle
+        while True:
+            angle += random.gauss(0, 0.3)
+            data = {'d': [math.cos(angle), math.sin(angle)]}
+            if random.random() < SPLIT_CHANCE:
+                data['s'] = 1
+            writer.write(json.dumps(data).encode() + b'\n')
+            await writer.drain()
+            await asyncio.sleep(INPUT_INTERVAL)
+
+    sender = asyncio.ensure_future(send_inputs())
+    end = time.perf_counter() + seconds
+    try:
+        while time.perf_counter() < end:
+            line = await reader.readline()
+            if not line:
+                break
+            arrivals.append(time.perf_counter())
+            sizes.append(len(line))
+            view.apply(json.loads(line))
+    finally:
+        sender.cancel()
+        writer.close()
+    stats['snapshots'].append(len(arrivals))
+    stats['bytes'].append(sum(sizes))
+    stats['gaps'].extend(numpy.diff(arrivals).tolist())
+    stats['visible'].append(len(view.food) + len(view.blobs))
+
+
+async def swarm(host, port, clients, seconds):
+    '''Runs the given number of clients at once and summarizes what they
+    saw'''
+    stats = {'snapshots': [], 'bytes': [], 'gaps': [], 'visible': []}
+    await asyncio.gather(*(client(host, port, seconds, stats)
+                           for _ in range(clients)))
+    gaps = numpy.array(stats['gaps']) * 1000 if stats['gaps'] else \
+        numpy.zeros(1)
+    return {'clients': clients, 'seconds': seconds,
+            'snapshots_per_sec': sum(stats['snapshots']) / clients / seconds,
+            'kbytes_per_sec': sum(stats['bytes']) / clients / seconds / 1024,
+            'gap_p50_ms': float(numpy.percentile(gaps, 50)),
+            'gap_p99_ms': float(numpy.percentile(gaps, 99)),
+            'gap_max_ms': float(gaps.max()),
+            'mean_visible': sum(stats['visible']) / clients}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load tests the server')
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--clients', type=int, default=CLIENTS)
+    parser.add_argument('--seconds', type=float, default=SECONDS)
+    args = parser.parse_args(argv)
+    result = asyncio.run(swarm(args.host, args.port, args.clients,
+                               args.seconds))
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
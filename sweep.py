@@ -0,0 +1,245 @@
+'''Sweeps the balance of the game: plays many seeded headless matches of CPU
+players for every combination of a grid of settings, across a pool of
+worker processes, and sums them up in a table.
+
+    python sweep.py --set eat_ratio=0.7,0.75,0.8 --set sight=200,300,400 \\
+        --matches 200 --ticks 2000 --out sweep.jsonl
+
+A setting can change any of the Rules (rules.py) or the World's
+food_count, other_players and lod_interval. A match has no viewers, so at
+the World's usual lod_interval every bot would be moved at the coarse level
+of detail; the sweep plays them all at full detail (lod_interval=1) unless a
+setting says otherwise. Every setting is played with the same seeds, so
+settings are compared on the same starting boards. Each match is appended to
+the --out file as a line of JSON as soon as it ends, so a sweep that is
+interrupted loses at most the matches being played: run it again with the
+same arguments and the matches already in the file are skipped. Once all
+matches are in, a table is printed with, for each setting, the deaths per
+match, how long a player survives on average, the spread of the players'
+masses at the end and how fast the matches ran.
+
+    python sweep.py --out sweep.jsonl --table      # just print the table
+'''
+import argparse
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import sys
+import time
+import numpy
+from world import World
+from rules import Rules, DEFAULT_RULES
+from events import EventBus, EventList, SPAWN, EAT
+
+TICK = 0.05
+# the World arguments a setting may change besides the rules
+WORLD_ARGS = ('food_count', 'other_players', 'lod_interval')
+# the quantiles of the final masses shown in the table
+QUANTILES = (10, 50, 90)
+
+
+def parse_value(text):
+    '''Turns a setting's value into an int or a float'''
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+def parse_grid(sets):
+    '''Turns NAME=V1,V2,... strings into the list of every combination of
+    their values, each a dictionary from name to value'''
+    names = []
+    values = []
+    for item in sets:
+        name, _, text = item.partition('=')
+        if name not in Rules._fields and name not in WORLD_ARGS:
+            raise ValueError('unknown setting %r' % name)
+        if not text:
+            raise ValueError('no values for %r' % name)
+        names.append(name)
+        values.append([parse_value(v) for v in text.split(',')])
+    return [dict(zip(names, combination))
+            for combination in itertools.product(*values)]
+
+
+def setting_key(setting):
+    '''A string that identifies a setting, the same for equal settings'''
+    return json.dumps(setting, sort_keys=True)
+
+
+def setting_name(setting):
+    '''A short description of a setting for the table'''
+    if not setting:
+        return 'default'
+    return ' '.join('%s=%s' % item for item in sorted(setting.items()))
+
+
+def build_world(setting, seed):
+    '''Makes a world with no user for a match of the given setting, at full
+    level of detail unless the setting has its own lod_interval'''
+    rules = DEFAULT_RULES._replace(**{k: v for k, v in setting.items()
+                                      if k in Rules._fields})
+    world_args = {k: v for k, v in setting.items() if k in WORLD_ARGS}
+    world_args.setdefault('lod_interval', 1)
+    return World(seed=seed, user=False, rules=rules, **world_args)
+
+
+def play_match(job):
+    '''Plays one match of CPU players for a number of ticks and returns what
+    happened in it. A player dies when its last blob is eaten and it is
+    respawned, which the events of the world record as a spawn; the mass of
+    a player is the total area of its blobs'''
+    setting, seed, ticks = job
+    world = build_world(setting, seed)
+    log = EventList()
+    world.events = EventBus(log)
+    start = time.perf_counter()
+    for _ in range(ticks):
+        world.step(TICK)
+    elapsed = time.perf_counter() - start
+    events = log.events()
+    deaths = int(numpy.count_nonzero(events['kind'] == SPAWN))
+    players = len(world.other_players)
+    masses = sorted(math.pi * sum(b.r * b.r for b in p.blobs)
+                    for p in world.all_players())
+    return {'setting': setting, 'seed': seed, 'ticks': ticks,
+            'seconds': elapsed, 'ticks_per_sec': ticks / elapsed,
+            'deaths': deaths,
+            'eats': int(numpy.count_nonzero(events['kind'] == EAT)),
+            # every player alive for the whole match, split between its lives
+            'survival': ticks * TICK * players / (players + deaths),
+            'masses': [round(m, 1) for m in masses]}
+
+
+def read_results(path):
+    '''Returns the matches in a results file. A last line cut short by an
+    interruption is ignored'''
+    results = []
+    if not os.path.exists(path):
+        return results
+    with open(path) as f:
+        for line in f:
+            try:
+                results.append(json.loads(line))
+            except ValueError:
+                continue
+    return results
+
+
+def summarize(results):
+    '''Sums up the matches of each setting, in the order the settings first
+    appear. Returns a list of rows, one per setting'''
+    groups = {}
+    for result in results:
+        groups.setdefault(setting_key(result['setting']), []).append(result)
+    rows = []
+    for matches in groups.values():
+        masses = numpy.concatenate([m['masses'] for m in matches])
+        row = {'setting': matches[0]['setting'], 'matches': len(matches),
+               'deaths': numpy.mean([m['deaths'] for m in matches]),
+               'survival': numpy.mean([m['survival'] for m in matches]),
+               'ticks_per_sec': numpy.mean([m['ticks_per_sec']
+                                            for m in matches])}
+        for q, value in zip(QUANTILES, numpy.percentile(masses, QUANTILES)):
+            row['mass_p%d' % q] = value
+        row['mass_max'] = masses.max()
+        rows.append(row)
+    return rows
+
+
+def format_table(rows):
+    '''Lays out the rows of summarize() as a text table'''
+    columns = (['matches', 'deaths', 'survival'] +
+               ['mass_p%d' % q for q in QUANTILES] +
+               ['mass_max', 'ticks_per_sec'])
+    formats = (['%d', '%.2f', '%.1f'] + ['%.0f'] * (len(QUANTILES) + 1) +
+               ['%.1f'])
+    names = [setting_name(row['setting']) for row in rows]
+    table = [['setting'] + columns]
+    for name, row in zip(names, rows):
+        table.append([name] + [f % row[c] for f, c in zip(formats, columns)])
+    widths = [max(len(line[i]) for line in table)
+              for i in range(len(table[0]))]
+    return '\n'.join(' '.join([line[0].ljust(widths[0])] +
+                              [cell.rjust(w) for cell, w in
+                               zip(line[1:], widths[1:])])
+                     for line in table)
+
+
+def sweep(settings, seeds, ticks, path, processes=None):
+    '''Plays every setting with every seed, skipping the matches already in
+    the results file and appending the others to it as they finish. Returns
+    the results of all the matches of the sweep'''
+    done = {}
+    for result in read_results(path):
+        if result['ticks'] == ticks:
+            done[setting_key(result['setting']), result['seed']] = result
+    jobs = [(setting, seed, ticks) for setting in settings for seed in seeds
+            if (setting_key(setting), seed) not in done]
+    if not jobs:
+        return [done[setting_key(setting), seed]
+                for setting in settings for seed in seeds]
+    print('%d matches to play, %d already done' %
+          (len(jobs), len(settings) * len(seeds) - len(jobs)),
+          file=sys.stderr)
+    with open(path, 'a') as f:
+        if processes == 0:
+            finished = map(play_match, jobs)
+        else:
+            pool = multiprocessing.Pool(processes)
+            finished = pool.imap_unordered(play_match, jobs)
+        try:
+            for i, result in enumerate(finished):
+                f.write(json.dumps(result) + '\n')
+                f.flush()
+                done[setting_key(result['setting']), result['seed']] = result
+                print('%d/%d' % (i + 1, len(jobs)), end='\r',
+                      file=sys.stderr)
+        finally:
+            print(file=sys.stderr)
+            if processes != 0:
+                pool.terminate()
+    return [done[setting_key(setting), seed]
+            for setting in settings for seed in seeds]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Plays headless matches for a grid of settings')
+    parser.add_argument('--set', action='append', default=[],
+                        metavar='NAME=V1,V2,...',
+                        help='values to try for a rule or world argument')
+    parser.add_argument('--matches', type=int, default=100,
+                        help='matches per setting')
+    parser.add_argument('--ticks', type=int, default=1200,
+                        help='ticks per match')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the first match of every setting')
+    parser.add_argument('--processes', type=int,
+                        help='worker processes (default: one per core, 0 '
+                        'to play in this process)')
+    parser.add_argument('--out', default='sweep.jsonl',
+                        help='file the matches are appended to')
+    parser.add_argument('--table', action='store_true',
+                        help='only print the table of the matches in --out')
+    args = parser.parse_args(argv)
+    if args.table:
+        results = read_results(args.out)
+    else:
+        try:
+            settings = parse_grid(args.set)
+        except ValueError as e:
+            parser.error(str(e))
+        seeds = range(args.seed, args.seed + args.matches)
+        results = sweep(settings, seeds, args.ticks, args.out,
+                        args.processes)
+    if results:
+        print(format_table(summarize(results)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,72 @@
+'''Tiles of the food layer, so the pellets do not have to be drawn again on
+every frame. The board is split into TILE_SIZE squares, and the FoodStore
+keeps a version for each of them that changes whenever a pellet overlapping
+the tile is eaten or spawned. A renderer keeps an image of each tile it has
+drawn in a TileCache, keyed by the tile and its version, and draws a frame
+by copying the few tiles in view into place and drawing the blobs on top;
+only the tiles whose food changed since they were last drawn are drawn
+again.
+
+Versions are unique among all the FoodStores of a process, so one cache can
+hold the tiles of several worlds at once.
+'''
+import itertools
+import math
+from collections import OrderedDict
+
+# small enough that a pellet being eaten or spawned only means drawing a
+# little of the food again, large enough that a frame is a few copies
+TILE_SIZE = 200
+# the most tile images a TileCache keeps
+MAX_TILES = 64
+
+# every version ever handed out is different
+_versions = itertools.count(1)
+
+
+def new_version():
+    '''Returns a version no tile has had before'''
+    return next(_versions)
+
+
+def tiles_in_rect(x0, y0, x1, y1, width, height, size=TILE_SIZE):
+    '''Returns the (column, row) of every tile of a width x height board that
+    overlaps the given rectangle'''
+    c0 = max(0, int(math.floor(x0 / size)))
+    r0 = max(0, int(math.floor(y0 / size)))
+    c1 = min(int(math.ceil(width / size)) - 1, int(math.floor(x1 / size)))
+    r1 = min(int(math.ceil(height / size)) - 1, int(math.floor(y1 / size)))
+    return [(c, r) for r in range(r0, r1 + 1) for c in range(c0, c1 + 1)]
+
+
+def tiles_in_view(width, height, size=TILE_SIZE):
+    '''Returns the most tiles a width x height view can overlap'''
+    return ((int(math.ceil(width / size)) + 1) *
+            (int(math.ceil(height / size)) + 1))
+
+
+class TileCache():
+    '''Keeps the images of the limit most recently used tiles. An image is
+    made by make(tile, version, *args) the first time a tile is asked for at
+    a version, and reused until the tile changes'''
+
+    def __init__(self, make, limit=MAX_TILES):
+        self.make = make
+        self.limit = limit
+        self.images = OrderedDict()
+        # the number of tile images made so far
+        self.made = 0
+
+    def get(self, tile, version, *args):
+        '''Returns the image of a tile at the given version'''
+        key = (tile, version)
+        image = self.images.get(key)
+        if image is None:
+            image = self.make(tile, version, *args)
+            self.made += 1
+            self.images[key] = image
+            if len(self.images) > self.limit:
+                self.images.popitem(last=False)
+        else:
+            self.images.move_to_end(key)
+        return image
@@ -0,0 +1,592 @@
+import math
+import random
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import numpy
+from gameobject import GameObject, GAME_WIDTH, GAME_HEIGHT, FRAME_WIDTH, \
+    FRAME_HEIGHT
+from player import Player
+from splitmerge import MAX_CELLS
+from foodstore import FoodStore
+from spatial import SpatialHash, CELL_SIZE
+from clock import SimClock
+from streams import RandomStreams
+from blob import BlobPool
+from palette import random_color, random_color_index
+from profiler import NULL_PROFILER
+from events import NULL_EVENTS, EAT, FOOD, SPLIT, MERGE, SPAWN
+import ai
+from rules import DEFAULT_RULES
+
+FOOD_COUNT = 2000
+FOOD_RADIUS = 5
+FOOD_SPACING = 54.5
+OTHER_PLAYERS = 20
+INITIAL_RADIUS = 10
+DECAY_INTERVAL = 10
+# CPU players further than the rules' sight + LOD_MARGIN from every human
+# player are only updated every LOD_INTERVAL ticks, with a correspondingly
+# longer step
+LOD_INTERVAL = 4
+LOD_MARGIN = 200
+# the number of bots, blobs or pairs of blobs in each piece of the read-only
+# work of a tick handed to the executor
+CHUNK = 64
+
+# The input given by the user for a single tick: the direction they want to
+# move in and whether they pressed the spacebar to split
+UserInput = namedtuple('UserInput', ['direction', 'split'])
+
+
+def random_food_position(x, y, width=GAME_WIDTH, height=GAME_HEIGHT,
+                         rng=random):
+    '''Function that provides a randomized location for placing food'''
+    randx = rng.gauss(x, 20)
+    randx = max(randx, 0)
+    randx = min(randx, width)
+    randy = rng.gauss(y, 20)
+    randy = max(randy, 0)
+    randy = min(randy, height)
+    return (randx, randy)
+
+
+def food_generator(width=GAME_WIDTH, height=GAME_HEIGHT, start=0,
+                   rng=random):
+    '''Generates food pellets semi-randomly so they are disbursed somewhat
+    evenly throughout the board. Note that the number of food pellets is
+    constant, so the generator is called whenever a piece of food is eaten.
+    Each pellet is yielded as an (x, y, r, color_index) tuple. The generator
+    can be started as if start pellets had already been taken from it, and
+    draws its random numbers from rng'''
+    # a board narrower than the spacing still has a column (or row) of food
+    columns = max(1, int(width // FOOD_SPACING))
+    rows = max(1, int(height // FOOD_SPACING))
+    x = (start // rows) % columns
+    y = start % rows
+    while(True):
+        while x < columns:
+            while y < rows:
+                x_location = FOOD_SPACING * x
+                y_location = FOOD_SPACING * y
+                p1, p2 = random_food_position(x_location, y_location,
+                                              width, height, rng)
+                yield (p1, p2, FOOD_RADIUS, random_color_index(rng))
+                y += 1
+            y = 0
+            x += 1
+        x = 0
+
+
+def create_player(radius, id_number, clock, width=GAME_WIDTH,
+                  height=GAME_HEIGHT, pool=None, rng=random,
+                  max_cells=MAX_CELLS):
+    '''Creates a player in a random position such that more players are near
+    the middle of the frame'''
+    x = rng.gauss(width / 2, width * FRAME_WIDTH / GAME_WIDTH)
+    x = max(x, 0)
+    x = min(x, width)
+    y = rng.gauss(height / 2, height * FRAME_HEIGHT / GAME_HEIGHT)
+    y = max(y, 0)
+    y = min(y, height)
+    return Player(x, y, radius, random_color(rng), id_number, clock, pool,
+                  max_cells)
+
+
+class World():
+    '''A World holds the complete state of a game - the food grid, the CPU
+    players and the user - and advances it one tick at a time. It does not
+    depend on wx, so it can be run without a display and stepped as fast as
+    the machine allows. Food and blobs are each kept in a SpatialHash over the
+    world, so the size of the world and of its cells can be chosen freely.
+    Every random number the world uses comes from streams derived from its
+    seed, so a world with the same seed and input always plays out the same
+    way. CPU players that no human player can see are simulated at a lower
+    rate (every lod_interval ticks) until one comes near. A world made with
+    user=False has no user, only CPU and other human players. The balance of
+    the game - speeds, eat ratio, recovery time, sight - comes from rules.
+
+    Each part of a tick is done in two phases: first everything the players
+    are about to do is worked out from the world as it is, without changing
+    it, and then it is all applied at once, with conflicts settled by fixed
+    rules rather than by the order the players happen to be visited in. The
+    first phase can be split into chunks and run on a thread pool'''
+
+    def __init__(self, food_count=FOOD_COUNT, other_players=OTHER_PLAYERS,
+                 width=GAME_WIDTH, height=GAME_HEIGHT, cell_size=CELL_SIZE,
+                 replan_interval=ai.REPLAN_INTERVAL, seed=None,
+                 max_cells=MAX_CELLS, lod_interval=LOD_INTERVAL, user=True,
+                 rules=DEFAULT_RULES):
+        if seed is None:
+            seed = random.getrandbits(32)
+        self.seed = seed
+        self.rng = RandomStreams(seed)
+        self.width = width
+        self.height = height
+        # the number of blobs a player can split into
+        self.max_cells = max_cells
+        self.lod_interval = lod_interval
+        self.rules = rules
+        self.clock = SimClock()
+        self.profiler = NULL_PROFILER
+        # an EventBus the things that happen in the game are reported to
+        self.events = NULL_EVENTS
+        # an InputRecorder that logs every tick's input, if any
+        self.recorder = None
+        # a concurrent.futures.ThreadPoolExecutor the read-only work of a tick
+        # is spread across, if any
+        self.executor = None
+        self.blob_pool = BlobPool(rules=rules)
+        # blobs eaten or merged this tick, released to the pool after it
+        self.dead_blobs = []
+        self.next_decay = DECAY_INTERVAL
+        self.planner = ai.Planner(replan_interval)
+        # copies of players simulated elsewhere (e.g. by a neighbouring
+        # shard), which the CPU players can see but which are not part of
+        # this world
+        self.ghosts = []
+        # food setup
+        self.food = FoodStore(food_count, self.food_source(),
+                              SpatialHash(width, height, cell_size))
+        for _ in range(food_count):
+            self.food.spawn()
+
+        # other player setup
+        self.blob_index = SpatialHash(width, height, cell_size)
+        self.other_players = []
+        self.playerIds = {}
+        for i in range(other_players):
+            self.spawn_CPU(i)
+
+        self.user = None
+        if user:
+            self.user = self.create_player(INITIAL_RADIUS, other_players + 1)
+            self.playerIds[self.user.id_number] = self.user
+        # other human players, e.g. the clients of a server, by id
+        self.humans = {}
+        self.next_id = other_players + 2
+
+    def food_source(self, start=0):
+        '''Returns the generator new pellets are taken from, started as if
+        start pellets had already been taken from it'''
+        return food_generator(self.width, self.height, start, self.rng.food)
+
+    def step(self, dt, user_input=None, inputs=None):
+        '''Advances the world by a single tick of dt seconds: moves the user
+        according to the given UserInput and the other human players according
+        to the inputs dictionary (id -> UserInput), moves all the CPU players,
+        and handles collisions with food and other players as necessary. Every
+        DECAY_INTERVAL seconds of simulated time, all the players decay. CPU
+        players out of sight are only moved on their turn, every lod_interval
+        ticks, but then as far as they would have gone in that many ticks,
+        eating the food along the way. The CPU players decide where to go
+        before anyone moves, and food and other blobs are eaten by everyone
+        at once once everyone has moved'''
+        prof = self.profiler
+        tick_start = t = prof.clock()
+        tick = self.clock.ticks
+        near, far = self.split_by_interest()
+        prof.count('far_players', len(far))
+        # where the blobs that move several ticks at once start from
+        starts = {b: b.get_absolute_position() for p in far for b in p.blobs}
+        cpus = near + far
+        vectors = self.plan_CPUs(cpus)
+        prof.add('move_CPU', t)
+
+        t = prof.clock()
+        if self.user is not None:
+            self.move_human(self.user, user_input)
+        if self.humans:
+            inputs = inputs or {}
+            for id_number, player in list(self.humans.items()):
+                self.move_human(player, inputs.get(id_number))
+        prof.add('user_move', t)
+
+        t = prof.clock()
+        self.apply_CPU_moves(cpus, vectors, [1] * len(near) +
+                             [self.lod_interval] * len(far))
+        prof.add('move_CPU', t)
+
+        t = prof.clock()
+        tested = self.food.tested
+        moved = cpus + self.humans_and_user()
+        blobs = [b for p in moved for b in p.blobs]
+        self.eat_food(blobs, self.map_chunks(self.food_intents, blobs,
+                                             starts))
+        prof.count('pellets_tested', self.food.tested - tested)
+        prof.add('food_collisions', t)
+
+        t = prof.clock()
+        if len(moved) < len(self.all_players()):
+            # blobs that did not move cannot have started touching
+            self.handle_player_collisions({b for p in moved for b in p.blobs})
+        else:
+            self.handle_player_collisions()
+        prof.add('player_collisions', t)
+
+        for b in self.dead_blobs:
+            self.blob_pool.release(b)
+        self.dead_blobs = []
+        self.clock.advance(dt)
+        while self.clock.time >= self.next_decay:
+            self.next_decay += DECAY_INTERVAL
+            for p in self.all_players():
+                p.decay()
+        self.events.end_tick(tick)
+        prof.end_tick(tick_start)
+        if self.recorder is not None:
+            self.recorder.tick(self, dt, user_input, inputs)
+
+    def humans_and_user(self):
+        '''Returns a list of the human players, the user last'''
+        players = list(self.humans.values())
+        if self.user is not None:
+            players.append(self.user)
+        return players
+
+    def split_by_interest(self):
+        '''Splits the CPU players into those near enough to a human player to
+        be simulated every tick, and those out of sight whose turn it is this
+        tick. The others are not simulated on this tick'''
+        bots = self.other_players
+        if self.lod_interval <= 1 or not bots:
+            return list(bots), []
+        viewers = [p.get_absolute_position() for p in self.humans_and_user()]
+        viewers.extend(g.get_absolute_position() for g in self.ghosts
+                       if g.human)
+        vx = numpy.array([v[0] for v in viewers])
+        vy = numpy.array([v[1] for v in viewers])
+        centers = [p.get_absolute_position() for p in bots]
+        bx = numpy.array([c[0] for c in centers])
+        by = numpy.array([c[1] for c in centers])
+        reach = (self.rules.sight + LOD_MARGIN +
+                 numpy.array([p.r for p in bots]))
+        seen = ((numpy.abs(bx[:, None] - vx[None, :]) <= reach[:, None]) &
+                (numpy.abs(by[:, None] - vy[None, :]) <= reach[:, None])
+                ).any(axis=1).tolist()
+        tick = self.clock.ticks
+        near, far = [], []
+        for bot, visible in zip(bots, seen):
+            if visible:
+                near.append(bot)
+            elif (tick + bot.id_number) % self.lod_interval == 0:
+                far.append(bot)
+        return near, far
+
+    def all_players(self):
+        '''Returns a list of every player in the world, the user last'''
+        total_players = [p for p in self.other_players]
+        total_players.extend(self.humans.values())
+        if self.user is not None:
+            total_players.append(self.user)
+        return total_players
+
+    def move_human(self, player, user_input):
+        '''Splits and moves a human player according to its UserInput. A
+        player without input stands still'''
+        if user_input is not None:
+            if user_input.split:
+                size = player.size
+                player.shoot(user_input.direction)
+                if player.size > size:
+                    x, y = player.get_absolute_position()
+                    self.events.emit(SPLIT, player.id_number,
+                                     player.center.uid, x=x, y=y,
+                                     value=player.size - size)
+            direction = user_input.direction
+        else:
+            direction = (0, 0)
+        x, y = self.trim_position(direction, player.get_absolute_position())
+        self.move_player(player, (x, y))
+
+    def add_human(self, id_number=None):
+        '''Adds another human player to the world, with the given id or the
+        next free one, returning its id'''
+        if id_number is None:
+            id_number = self.next_id
+        self.next_id = max(self.next_id, id_number + 1)
+        player = self.create_player(INITIAL_RADIUS, id_number)
+        self.humans[id_number] = player
+        self.playerIds[id_number] = player
+        if self.recorder is not None:
+            self.recorder.event('join', id_number)
+        return id_number
+
+    def remove_human(self, id_number):
+        '''Takes a human player (and its blobs) out of the world'''
+        player = self.humans.pop(id_number)
+        del self.playerIds[id_number]
+        if self.recorder is not None:
+            self.recorder.event('leave', id_number)
+        for b in player.blobs:
+            self.blob_index.remove(b)
+            self.dead_blobs.append(b)
+
+    def new_player(self, radius, id_number):
+        '''Returns a new player somewhere in this world'''
+        return create_player(radius, id_number, self.clock, self.width,
+                             self.height, self.blob_pool, self.rng.players,
+                             self.max_cells)
+
+    def create_player(self, radius, id_number):
+        '''Creates a player somewhere in this world and adds its blobs to the
+        blob index'''
+        player = self.new_player(radius, id_number)
+        self.index_player(player)
+        x, y = player.get_absolute_position()
+        self.events.emit(SPAWN, id_number, player.center.uid, x=x, y=y,
+                         value=radius)
+        return player
+
+    def index_player(self, player):
+        '''Updates the position of each of the player's blobs in the blob
+        index'''
+        for b in player.blobs:
+            x, y = b.get_absolute_position()
+            self.blob_index.update(b, x, y, b.r)
+
+    def move_player(self, player, direction, steps=1):
+        '''Moves a player (as far as it goes in the given number of ticks) and
+        keeps the blob index up to date, including blobs that were created by
+        splitting or removed by merging'''
+        before = set(player.blobs)
+        player.move(direction, steps)
+        for b in before - player.blobs:
+            # merged into another of the player's blobs
+            x, y = b.get_absolute_position()
+            self.events.emit(MERGE, player.id_number, b.uid, x=x, y=y,
+                             value=math.pi * b.r * b.r)
+            self.blob_index.remove(b)
+            self.dead_blobs.append(b)
+        self.index_player(player)
+
+    def map_chunks(self, function, items, *args):
+        '''Runs function(chunk, *args), which must not change the world, over
+        the items in chunks of CHUNK on the executor, and returns the lists
+        it returns joined in order. Without an executor, or with few items,
+        the function is run on all the items at once. The chunks read the
+        live world and return its own blobs, so the executor has to be a
+        ThreadPoolExecutor: a process pool would work on copies'''
+        if self.executor is None:
+            return function(items, *args)
+        if not isinstance(self.executor, ThreadPoolExecutor):
+            raise TypeError('the executor of a World must be a '
+                            'ThreadPoolExecutor')
+        if len(items) <= CHUNK:
+            return function(items, *args)
+        chunks = [items[i:i + CHUNK] for i in range(0, len(items), CHUNK)]
+        results = []
+        for part in self.executor.map(function, chunks,
+                                      *[[a] * len(chunks) for a in args]):
+            results.extend(part)
+        return results
+
+    def handle_food_collisions(self, blob, start=None):
+        '''Handles food collisions between a blob and a piece of food, changing
+        the blob's size appropriately and removing the food. Note that a new
+        piece of food is also generated, usually elsewhere on the board. If
+        the blob has come from the given start position in one go, all the
+        food along its way is eaten'''
+        starts = {} if start is None else {blob: start}
+        self.eat_food([blob], self.food_intents([blob], starts))
+
+    def food_intents(self, blobs, starts):
+        '''Returns the slots of the pellets each of the given blobs overlaps,
+        or overlapped on its way if it came from a position in starts in one
+        go. Does not change the world (apart from the count of pellets
+        tested, which is only for profiling)'''
+        food = self.food
+        found = []
+        for b in blobs:
+            x, y = b.get_absolute_position()
+            start = starts.get(b)
+            if start is None:
+                found.append(food.overlapping(x, y, b.r))
+            else:
+                found.append(food.overlapping_path(start[0], start[1], x, y,
+                                                   b.r))
+        return found
+
+    def eat_food(self, blobs, found):
+        '''Lets each of the given blobs eat the pellets found for it by
+        food_intents, as settled by award_food, and replaces the eaten
+        pellets'''
+        slots, counts, areas = self.award_food(
+            found, [(-b.r, b.uid) for b in blobs])
+        if not len(slots):
+            return
+        for blob, n, area in zip(blobs, counts, areas):
+            if n == 0:
+                continue
+            x, y = blob.get_absolute_position()
+            self.events.emit(FOOD, blob.id_number, blob.uid, n, x=x, y=y,
+                             value=area)
+            self.playerIds[blob.id_number].grow_blob(blob, area)
+            # growing moves the center, as the corner stays put
+            x, y = blob.get_absolute_position()
+            self.blob_index.update(blob, x, y, blob.r)
+        self.replace_food(slots)
+
+    def award_food(self, found, ranks):
+        '''Settles who eats the pellets found for each of several eaters. A
+        pellet found for several goes to the one with the lowest rank - the
+        largest blob, and the one with the lowest uid of equals. Returns the
+        slots of every pellet eaten, and the number and total area of the
+        pellets each eater gets'''
+        counts = [0] * len(found)
+        areas = [0.0] * len(found)
+        claims = [i for i in range(len(found)) if len(found[i])]
+        if not claims:
+            return numpy.zeros(0, dtype=numpy.intp), counts, areas
+        claims.sort(key=lambda i: ranks[i])
+        food = self.food
+        slots = numpy.concatenate([found[i] for i in claims])
+        owners = numpy.repeat(numpy.arange(len(claims)),
+                              [len(found[i]) for i in claims])
+        # the first claim on a pellet is the one of the lowest rank
+        slots, first = numpy.unique(slots, return_index=True)
+        owners = owners[first]
+        eaten = numpy.bincount(owners, minlength=len(claims)).tolist()
+        eaten_area = numpy.bincount(owners,
+                                    weights=math.pi * food.r[slots] ** 2,
+                                    minlength=len(claims)).tolist()
+        for i, n, area in zip(claims, eaten, eaten_area):
+            counts[i] = n
+            areas[i] = area
+        return slots, counts, areas
+
+    def replace_food(self, slots):
+        '''Replaces the eaten pellets at the given slots, only once they have
+        all been removed, so no blob can eat a pellet spawned in the same
+        tick'''
+        prof = self.profiler
+        prof.count('pellets_eaten', len(slots))
+        t = prof.clock()
+        self.food.replace(slots)
+        prof.add('food_respawn', t)
+
+    def handle_player_collisions(self, blobs=None):
+        '''Handles player collisions and allows one blob to eat another. The
+        blob index provides the pairs of blobs that might touch once per tick
+        (the broad phase), and only those pairs are checked with the eating
+        rules (the narrow phase). If a set of blobs is given, only the pairs
+        including one of them are checked. Every pair is judged by the sizes
+        and positions before anyone eats, and then the eats are resolved by
+        resolve_eats'''
+        pairs = self.blob_index.candidate_pairs(blobs)
+        self.profiler.count('candidate_pairs', len(pairs))
+        self.resolve_eats(self.map_chunks(self.eat_intents, pairs))
+
+    def eat_intents(self, pairs):
+        '''Returns (eater, eaten) for each of the given pairs of blobs in
+        which one can eat the other. Does not change the world'''
+        eats = []
+        for a, b in pairs:
+            if a.id_number == b.id_number:
+                continue
+            if a > b and GameObject.hasEaten(a, b):
+                eats.append((a, b))
+            elif b > a and GameObject.hasEaten(b, a):
+                eats.append((b, a))
+        return eats
+
+    def resolve_eats(self, eats):
+        '''Applies a list of (eater, eaten) pairs, largest eater first (and
+        by uid among equals). A blob is only eaten once, by the largest blob
+        that can eat it, and since every blob that can eat a blob is larger
+        than it, a blob that is eaten in the tick has not eaten anything'''
+        eaten = set()
+        for blob, other in sorted(eats, key=lambda e: (-e[0].r, e[0].uid,
+                                                       -e[1].r, e[1].uid)):
+            if blob in eaten or other in eaten:
+                continue
+            eaten.add(other)
+            self.eat_blob(blob, other)
+
+    def eat_blob(self, blob, other):
+        '''Lets blob eat the other blob. Deals with all cases, including when
+        the last blob of a player is eaten and the player loses. In this case,
+        a new player is generated, or, in the user's case, they start again in
+        a random location'''
+        x, y = other.get_absolute_position()
+        self.events.emit(EAT, blob.id_number, blob.uid, other.id_number,
+                         other.uid, x, y, math.pi * other.r * other.r)
+        self.playerIds[blob.id_number].absorb(blob, other)
+        x, y = blob.get_absolute_position()
+        self.blob_index.update(blob, x, y, blob.r)
+        self.blob_index.remove(other)
+        self.dead_blobs.append(other)
+        player_to_remove = self.playerIds[other.id_number]
+        player_to_remove.remove_blob(other)
+        if len(player_to_remove.blobs) == 0:
+            if player_to_remove is self.user:
+                self.restart_user()
+            elif player_to_remove.id_number in self.humans:
+                self.restart_human(player_to_remove.id_number)
+            else:
+                self.respawn_player(player_to_remove)
+
+    def spawn_CPU(self, id_number):
+        '''Adds a new CPU player of a random size with the given id'''
+        player = self.create_player(int(self.rng.players.uniform(
+                                    INITIAL_RADIUS, 10 * INITIAL_RADIUS)),
+                                    id_number)
+        self.other_players.append(player)
+        self.playerIds[id_number] = player
+        return player
+
+    def respawn_player(self, player):
+        '''Replaces a CPU player that has lost with a new one'''
+        self.other_players.remove(player)
+        self.spawn_CPU(player.id_number)
+
+    def restart_user(self):
+        '''Restarts the game for the user, who starts again in a random
+        location'''
+        self.user = self.create_player(INITIAL_RADIUS, self.user.id_number)
+        self.playerIds[self.user.id_number] = self.user
+
+    def restart_human(self, id_number):
+        '''Restarts the game for a human player that has lost'''
+        player = self.create_player(INITIAL_RADIUS, id_number)
+        self.humans[id_number] = player
+        self.playerIds[id_number] = player
+
+    def trim_position(self, p, ap):
+        '''Trims a given velocity and absolute position so the velocity will
+        fit within the game boundaries'''
+        x, y = p
+        ax, ay = ap
+        if ax <= 0 and x <= 0:
+            x = 0
+        if ax >= self.width and x >= 0:
+            x = 0
+        if ay <= 0 and y <= 0:
+            y = 0
+        if ay >= self.height and y >= 0:
+            y = 0
+        return (x, y)
+
+    def plan_CPUs(self, players):
+        '''Returns the direction each of the given CPU players wants to move
+        in, one row of vectors each, decided by the planner against the
+        world as it is'''
+        return self.planner.movement_vectors(self, players, self.rules.sight)
+
+    def apply_CPU_moves(self, players, vectors, steps=None):
+        '''Moves each CPU player in the direction of its row of vectors, with a
+        little randomness added, by its number of steps (one if not given). A
+        player with nothing in sight (a NaN row) wanders in a random
+        direction'''
+        rng = self.rng.ai
+        if steps is None:
+            steps = [1] * len(players)
+        for player, (vx, vy), n in zip(players, vectors.tolist(), steps):
+            if math.isnan(vx):
+                vx = 2 * rng.random() - 1
+                vy = 2 * rng.random() - 1
+            # add some randomness to movement
+            vx = rng.gauss(vx, vx / 10)
+            vy = rng.gauss(vy, vy / 10)
+            pos = player.get_absolute_position()
+            movement_vector = self.trim_position((vx, vy), pos)
+            self.move_player(player, movement_vector, n)